@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/env python3
+
+"""
+Process-wide pool of AMQP connections used by the testing tool components for publishing into the event bus.
+
+Opening a pika.BlockingConnection costs a TCP + AMQP handshake, doing this for every published message (or every
+request sent to another component) dominates the latency of each test step and piles up connections on the broker
+when running many sessions. Components share instead a small pool of long lived connections, each one with a
+channel in publisher confirms mode, which are transparently re-opened when the broker drops them.
+
+>>> from ioppytest.amqp_pool import get_amqp_publisher
+>>> publisher = get_amqp_publisher(AMQP_URL, AMQP_EXCHANGE)
+>>> publisher.publish_message(MsgTestSuiteStart())
+
+# short request/reply calls can borrow one of the pooled connections (calls waiting on users' replies should use a
+# connection of their own, not to hold a pooled one for their whole timeout):
+>>> with publisher.connection() as connection:
+...     reply = amqp_request(connection, MsgTestSuiteGetStatus(), 'some_component')
+
+"""
+
+import pika
+import logging
+import threading
+from queue import Queue, Empty
+from contextlib import contextmanager
+
+from ioppytest import AMQP_URL, AMQP_EXCHANGE, LOG_LEVEL
+
+COMPONENT_ID = 'amqp_pool'
+
+DEFAULT_POOL_SIZE = 4
+PUBLISH_RETRIES = 3
+ACQUIRE_TIMEOUT = 10  # seconds
+
+logger = logging.getLogger(COMPONENT_ID)
+logger.setLevel(LOG_LEVEL)
+
+# errors after which the pooled connection is considered dead and needs to be re-opened
+RECONNECT_ON_ERRORS = (pika.exceptions.AMQPError, BrokenPipeError, ConnectionResetError)
+
+
+class _PooledConnection:
+    """
+    Lazily opened connection + publishing channel pair, owned by one thread at a time (see AmqpPublisherPool)
+    """
+
+    def __init__(self, amqp_url, confirm_delivery):
+        self.amqp_url = amqp_url
+        self.confirm_delivery = confirm_delivery
+        self.connection = None
+        self.channel = None
+
+    def is_open(self):
+        return self.connection is not None and self.connection.is_open \
+               and self.channel is not None and self.channel.is_open
+
+    def open(self):
+        if self.is_open():
+            return
+
+        self.close()
+        self.connection = pika.BlockingConnection(pika.URLParameters(self.amqp_url))
+        self.channel = self.connection.channel()
+        if self.confirm_delivery:
+            self.channel.confirm_delivery()
+
+    def close(self):
+        for res in (self.channel, self.connection):
+            try:
+                if res is not None and res.is_open:
+                    res.close()
+            except RECONNECT_ON_ERRORS:
+                pass
+        self.connection, self.channel = None, None
+
+
+class AmqpPublisherPool:
+    """
+    Thread-safe pool of AMQP connections for publishing messages into the event bus.
+
+    Connections are opened on demand (up to pool size) and kept open between publications. Channels work in
+    publisher confirms mode, so publish_message() returns once the broker has taken responsibility for the message.
+    """
+
+    def __init__(self, amqp_url, amqp_exchange, size=DEFAULT_POOL_SIZE, confirm_delivery=True):
+        assert size > 0
+
+        self.amqp_url = amqp_url
+        self.exchange = amqp_exchange
+        self.size = size
+        self.confirm_delivery = confirm_delivery
+
+        self._idle = Queue(maxsize=size)
+        for _ in range(size):
+            self._idle.put(_PooledConnection(amqp_url, confirm_delivery))
+
+    @contextmanager
+    def _acquire(self):
+        try:
+            pooled = self._idle.get(timeout=ACQUIRE_TIMEOUT)
+        except Empty:
+            raise pika.exceptions.AMQPConnectionError('No AMQP connection available in pool after %s seconds'
+                                                      % ACQUIRE_TIMEOUT)
+        try:
+            pooled.open()
+            yield pooled
+        except RECONNECT_ON_ERRORS:
+            pooled.close()  # re-opened on next acquire
+            raise
+        finally:
+            self._idle.put(pooled)
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrows one of the pooled connections (e.g. for request/reply calls using amqp_request).
+        The connection MUST NOT be closed, nor used after leaving the context.
+        """
+        with self._acquire() as pooled:
+            yield pooled.connection
+
+    def publish(self, routing_key, body, properties=None):
+        """
+        Publishes body into routing_key, re-opening the connection and retrying if the broker dropped it.
+        """
+        if properties is None:
+            properties = pika.BasicProperties(content_type='application/json')
+
+        retries_left = PUBLISH_RETRIES
+        while True:
+            try:
+                with self._acquire() as pooled:
+                    pooled.channel.basic_publish(
+                        exchange=self.exchange,
+                        routing_key=routing_key,
+                        properties=properties,
+                        body=body,
+                    )
+                return
+            except RECONNECT_ON_ERRORS as e:
+                retries_left -= 1
+                if retries_left <= 0:
+                    logger.error('Could not publish message with routing key %s: %s' % (routing_key, repr(e)))
+                    raise
+                logger.warning('AMQP connection lost (%s). Reconnecting..' % repr(e))
+
+    def publish_message(self, message):
+        """
+        Publishes message into the correct topic (uses Message object metadata)
+        """
+        self.publish(
+            routing_key=message.routing_key,
+            body=message.to_json(),
+            properties=pika.BasicProperties(**message.get_properties()),
+        )
+
+    def close(self):
+        closed = 0
+        while closed < self.size:
+            try:
+                pooled = self._idle.get(timeout=ACQUIRE_TIMEOUT)
+            except Empty:
+                logger.warning('Pooled AMQP connection still in use, not closing it')
+                break
+            pooled.close()
+            closed += 1
+
+        # leave pool usable (connections are lazily re-opened)
+        for _ in range(closed):
+            self._idle.put(_PooledConnection(self.amqp_url, self.confirm_delivery))
+
+
+# # # process-wide publishers registry # # #
+
+_publishers = {}
+_publishers_lock = threading.Lock()
+
+
+def get_amqp_publisher(amqp_url=AMQP_URL, amqp_exchange=AMQP_EXCHANGE):
+    """
+    :return: the AmqpPublisherPool shared by all components of the process for the given url and exchange
+    """
+    with _publishers_lock:
+        key = (amqp_url, amqp_exchange)
+        if key not in _publishers:
+            _publishers[key] = AmqpPublisherPool(amqp_url, amqp_exchange)
+        return _publishers[key]
+
+
+def close_amqp_publishers():
+    with _publishers_lock:
+        for publisher in _publishers.values():
+            publisher.close()
+        _publishers.clear()
@@ -0,0 +1,698 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/env python3
+
+"""
+In-process event bus backend, for running the testing tool components without a RabbitMQ broker.
+
+It implements the subset of pika's BlockingConnection/BlockingChannel API used by the components and by the
+event_bus_utils library (queue declare/bind/unbind/delete/purge, basic qos/consume/cancel/publish/get/ack/nack,
+transactions, start/stop consuming, connection timers and thread-safe callbacks) on top of an in-memory broker with
+topic exchanges semantics, queues max length and dead lettering.
+
+Components create their connections with pika.BlockingConnection(...), so the backend is switched for the whole
+process by installing it before the components (and their module level log handlers) are imported:
+
+>>> from ioppytest import memory_broker
+>>> memory_broker.install()
+>>> from ioppytest.packet_router.__main__ import PacketRouter
+
+Each connection dispatches deliveries, timers and thread-safe callbacks in the thread calling start_consuming,
+process_data_events or sleep, as pika does. Publishing is synchronous (a message is in the matching queues once
+basic_publish returns), so publisher confirms are a no-op.
+"""
+
+import re
+import copy
+import time
+import heapq
+import logging
+import threading
+import itertools
+from collections import deque, namedtuple
+
+import pika
+from pika import frame, spec
+
+from ioppytest import LOG_LEVEL
+
+COMPONENT_ID = 'memory_broker'
+
+DEFAULT_EXCHANGE = 'amq.topic'
+
+# max number of messages delivered to a consumer before giving timers and the rest of consumers a chance to run
+DELIVERY_BATCH_SIZE = 64
+
+# routing decisions are cached per (exchange, routing key) until bindings change, or the cache grows beyond this
+ROUTES_CACHE_MAX_SIZE = 10000
+
+logger = logging.getLogger(COMPONENT_ID)
+logger.setLevel(LOG_LEVEL)
+
+_Message = namedtuple('_Message', ['exchange', 'routing_key', 'body', 'properties', 'redelivered'])
+
+_original_blocking_connection = pika.BlockingConnection
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def topic_to_regex(binding_key):
+    """
+    Compiles an AMQP topic binding key (words separated by dots, * matches one word, # matches zero or more words)
+    into a regex which matches the routing key followed by a dot, e.g. fromAgent.*.# matches 'fromAgent.agent1.'
+    """
+    regex = []
+    for word in binding_key.split('.'):
+        if word == '#':
+            regex.append(r'(?:[^.]*\.)*')
+        elif word == '*':
+            regex.append(r'[^.]*\.')
+        else:
+            regex.append(re.escape(word) + r'\.')
+    return re.compile(''.join(regex) + '$')
+
+
+def topic_matches(binding_key, routing_key):
+    return topic_to_regex(binding_key).match(routing_key + '.') is not None
+
+
+class _Queue:
+
+    def __init__(self, name, auto_delete=False, arguments=None):
+        arguments = arguments or {}
+        self.name = name
+        self.auto_delete = auto_delete
+        self.max_length = arguments.get('x-max-length')
+        self.dead_letter_exchange = arguments.get('x-dead-letter-exchange')
+        self.dead_letter_routing_key = arguments.get('x-dead-letter-routing-key')
+        self.messages = deque()
+        self.consumers = {}  # consumer_tag -> channel
+        self.had_consumers = False
+
+
+class Broker:
+    """
+    In-memory AMQP broker: exchanges, queues and bindings shared by all the connections of the process
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.exchange_types = {DEFAULT_EXCHANGE: 'topic', 'amq.direct': 'direct', 'amq.fanout': 'fanout'}
+        self.queues = {}
+        self.bindings = {}  # exchange -> {(queue_name, binding_key): compiled binding key}
+        self._routes_cache = {}  # (exchange, routing_key) -> [queue names]
+        self._queue_name_counter = itertools.count(1)
+
+    # # # exchanges & queues # # #
+
+    def exchange_declare(self, exchange, exchange_type='direct'):
+        with self.lock:
+            self.exchange_types.setdefault(exchange, exchange_type)
+            self._routes_cache.clear()
+
+    def queue_declare(self, queue='', auto_delete=False, arguments=None):
+        with self.lock:
+            if not queue:
+                queue = 'amq.gen-%s' % next(self._queue_name_counter)
+            if queue not in self.queues:
+                self.queues[queue] = _Queue(queue, auto_delete, arguments)
+            return self.queues[queue]
+
+    def queue_delete(self, queue):
+        with self.lock:
+            q = self.queues.pop(queue, None)
+            if q is None:
+                return 0
+
+            for exchange_bindings in self.bindings.values():
+                for key in [k for k in exchange_bindings if k[0] == queue]:
+                    del exchange_bindings[key]
+            self._routes_cache.clear()
+
+            for consumer_tag, channel in list(q.consumers.items()):
+                channel._on_consumer_cancelled(consumer_tag)
+            return len(q.messages)
+
+    def queue_purge(self, queue):
+        with self.lock:
+            q = self._get_queue(queue)
+            count = len(q.messages)
+            q.messages.clear()
+            return count
+
+    def queue_bind(self, queue, exchange, binding_key):
+        with self.lock:
+            self._get_queue(queue)
+            self.bindings.setdefault(exchange, {})[(queue, binding_key)] = topic_to_regex(binding_key)
+            self._routes_cache.clear()
+
+    def queue_unbind(self, queue, exchange, binding_key):
+        with self.lock:
+            self.bindings.get(exchange, {}).pop((queue, binding_key), None)
+            self._routes_cache.clear()
+
+    def _get_queue(self, queue):
+        try:
+            return self.queues[queue]
+        except KeyError:
+            raise pika.exceptions.ChannelClosedByBroker(404, "NOT_FOUND - no queue '%s'" % queue)
+
+    # # # routing # # #
+
+    def _route(self, exchange, routing_key):
+        key = (exchange, routing_key)
+        try:
+            return self._routes_cache[key]
+        except KeyError:
+            pass
+
+        if exchange == '':
+            # default exchange routes to the queue named after the routing key
+            queues = [routing_key] if routing_key in self.queues else []
+        else:
+            exchange_type = self.exchange_types.get(exchange, 'topic')
+            queues = []
+            for (queue, binding_key), regex in self.bindings.get(exchange, {}).items():
+                if queue in queues:
+                    continue
+                if exchange_type == 'fanout' \
+                        or (exchange_type == 'direct' and binding_key == routing_key) \
+                        or (exchange_type == 'topic' and regex.match(routing_key + '.')):
+                    queues.append(queue)
+
+        if len(self._routes_cache) >= ROUTES_CACHE_MAX_SIZE:
+            self._routes_cache.clear()
+        self._routes_cache[key] = queues
+        return queues
+
+    def publish(self, exchange, routing_key, body, properties):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+
+        message = _Message(exchange, routing_key, body, properties or pika.BasicProperties(), False)
+
+        with self.lock:
+            queues = [self.queues[q] for q in self._route(exchange, routing_key)]
+            for q in queues:
+                self._enqueue(q, message)
+
+        for q in queues:
+            self._notify_consumers(q)
+
+    def _enqueue(self, q, message):
+        q.messages.append(message)
+        if q.max_length is not None and len(q.messages) > q.max_length:
+            # same overflow behaviour as RabbitMQ's default (drop-head)
+            self._dead_letter(q, q.messages.popleft(), 'maxlen')
+
+    def _dead_letter(self, q, message, reason):
+        if q.dead_letter_exchange is None:
+            return
+
+        properties = copy.copy(message.properties)
+        properties.headers = dict(properties.headers or {})
+        properties.headers['x-death'] = [{
+            'count': 1,
+            'reason': reason,
+            'queue': q.name,
+            'time': int(time.time()),
+            'exchange': message.exchange,
+            'routing-keys': [message.routing_key],
+        }] + list(properties.headers.get('x-death', []))
+
+        routing_key = q.dead_letter_routing_key or message.routing_key
+        dead_lettered = _Message(q.dead_letter_exchange, routing_key, message.body, properties, False)
+        for target in [self.queues[name] for name in self._route(q.dead_letter_exchange, routing_key)]:
+            if target is not q:
+                self._enqueue(target, dead_lettered)
+                self._notify_consumers(target)
+
+    def requeue(self, queue, message):
+        with self.lock:
+            q = self.queues.get(queue)
+            if q is None:
+                return
+            q.messages.appendleft(message._replace(redelivered=True))
+        self._notify_consumers(q)
+
+    def reject(self, queue, message):
+        with self.lock:
+            q = self.queues.get(queue)
+            if q is not None:
+                self._dead_letter(q, message, 'rejected')
+
+    def _notify_consumers(self, q):
+        for channel in list(q.consumers.values()):
+            channel.connection._wakeup.set()
+
+    # # # consuming # # #
+
+    def add_consumer(self, queue, consumer_tag, channel):
+        with self.lock:
+            q = self._get_queue(queue)
+            q.consumers[consumer_tag] = channel
+            q.had_consumers = True
+        channel.connection._wakeup.set()
+
+    def remove_consumer(self, queue, consumer_tag):
+        with self.lock:
+            q = self.queues.get(queue)
+            if q is None:
+                return
+            q.consumers.pop(consumer_tag, None)
+            if q.auto_delete and q.had_consumers and not q.consumers:
+                self.queue_delete(queue)
+
+    def get(self, queue):
+        """
+        :return: next message of the queue, None if empty
+        """
+        with self.lock:
+            q = self._get_queue(queue)
+            return q.messages.popleft() if q.messages else None
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = Broker()
+        return _broker
+
+
+def reset_broker():
+    """
+    Drops all exchanges, queues and bindings (existing connections keep using the old broker)
+    """
+    global _broker
+    with _broker_lock:
+        _broker = Broker()
+
+
+class _Consumer:
+
+    def __init__(self, consumer_tag, queue, callback, auto_ack):
+        self.consumer_tag = consumer_tag
+        self.queue = queue
+        self.callback = callback
+        self.auto_ack = auto_ack
+        self.unacked = 0
+
+
+class BlockingChannel:
+    """
+    Subset of pika.adapters.blocking_connection.BlockingChannel
+    """
+
+    def __init__(self, connection, channel_number):
+        self.connection = connection
+        self.broker = connection.broker
+        self.channel_number = channel_number
+        self.is_open = True
+
+        self._consumers = {}  # consumer_tag -> _Consumer
+        self._unacked = {}  # delivery_tag -> (consumer_tag, queue, message)
+        self._delivery_tags = itertools.count(1)
+        self._consumer_tags = itertools.count(1)
+        self._prefetch_count = 0
+        self._consuming = False
+
+        # transaction mode: publishes and acks are held until tx_commit
+        self._tx = None
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    @property
+    def consumer_tags(self):
+        return list(self._consumers)
+
+    def _check_open(self):
+        if not self.is_open:
+            raise pika.exceptions.ChannelWrongStateError('Channel is closed.')
+
+    def _method(self, method):
+        return frame.Method(self.channel_number, method)
+
+    # # # exchanges & queues # # #
+
+    def exchange_declare(self, exchange, exchange_type='direct', passive=False, durable=False, auto_delete=False,
+                         internal=False, arguments=None):
+        self._check_open()
+        self.broker.exchange_declare(exchange, exchange_type)
+        return self._method(spec.Exchange.DeclareOk())
+
+    def queue_declare(self, queue='', passive=False, durable=False, exclusive=False, auto_delete=False,
+                      arguments=None):
+        self._check_open()
+        if passive:
+            q = self.broker._get_queue(queue)
+        else:
+            q = self.broker.queue_declare(queue, auto_delete, arguments)
+        return self._method(spec.Queue.DeclareOk(q.name, len(q.messages), len(q.consumers)))
+
+    def queue_delete(self, queue, if_unused=False, if_empty=False):
+        self._check_open()
+        return self._method(spec.Queue.DeleteOk(self.broker.queue_delete(queue)))
+
+    def queue_purge(self, queue):
+        self._check_open()
+        return self._method(spec.Queue.PurgeOk(self.broker.queue_purge(queue)))
+
+    def queue_bind(self, queue, exchange, routing_key=None, arguments=None):
+        self._check_open()
+        self.broker.queue_bind(queue, exchange, queue if routing_key is None else routing_key)
+        return self._method(spec.Queue.BindOk())
+
+    def queue_unbind(self, queue, exchange=None, routing_key=None, arguments=None):
+        self._check_open()
+        self.broker.queue_unbind(queue, exchange, queue if routing_key is None else routing_key)
+        return self._method(spec.Queue.UnbindOk())
+
+    # # # publishing # # #
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self._check_open()
+        if self._tx is not None:
+            self._tx.append((self.broker.publish, (exchange, routing_key, body, properties)))
+        else:
+            self.broker.publish(exchange, routing_key, body, properties)
+
+    def confirm_delivery(self):
+        self._check_open()  # publishing is synchronous, nothing to confirm
+
+    def tx_select(self):
+        self._check_open()
+        self._tx = []
+        return self._method(spec.Tx.SelectOk())
+
+    def tx_commit(self):
+        self._check_open()
+        pending, self._tx = self._tx or [], []
+        for f, args in pending:
+            f(*args)
+        return self._method(spec.Tx.CommitOk())
+
+    def tx_rollback(self):
+        self._check_open()
+        self._tx = []
+        return self._method(spec.Tx.RollbackOk())
+
+    # # # consuming # # #
+
+    def basic_qos(self, prefetch_size=0, prefetch_count=0, global_qos=False):
+        self._check_open()
+        self._prefetch_count = prefetch_count
+
+    def basic_consume(self, *args, **kwargs):
+        """
+        basic_consume(queue, on_message_callback, auto_ack=False, exclusive=False, consumer_tag=None, arguments=None)
+
+        pika < 1.0 calls (consumer_callback first, no_ack instead of auto_ack) are accepted as well, some of the
+        components and libraries still use them.
+        """
+        self._check_open()
+
+        args = list(args)
+        if args and callable(args[0]):
+            kwargs.setdefault('on_message_callback', args.pop(0))
+        for name, value in zip(('queue', 'on_message_callback'), args):
+            kwargs.setdefault(name, value)
+
+        callback = kwargs.get('on_message_callback', kwargs.get('consumer_callback'))
+        queue = kwargs['queue']
+        auto_ack = kwargs.get('auto_ack', kwargs.get('no_ack', False))
+        consumer_tag = kwargs.get('consumer_tag') or 'ctag%s.%s' % (self.channel_number, next(self._consumer_tags))
+
+        assert callable(callback)
+
+        self._consumers[consumer_tag] = _Consumer(consumer_tag, queue, callback, auto_ack)
+        self.broker.add_consumer(queue, consumer_tag, self)
+        return consumer_tag
+
+    def basic_cancel(self, consumer_tag):
+        consumer = self._consumers.pop(consumer_tag, None)
+        if consumer is not None:
+            self.broker.remove_consumer(consumer.queue, consumer_tag)
+        return []
+
+    def _on_consumer_cancelled(self, consumer_tag):
+        # queue deleted by the broker
+        self._consumers.pop(consumer_tag, None)
+
+    def basic_get(self, queue, auto_ack=False):
+        self._check_open()
+        message = self.broker.get(queue)
+        if message is None:
+            return None, None, None
+
+        delivery_tag = next(self._delivery_tags)
+        if not auto_ack:
+            self._unacked[delivery_tag] = (None, queue, message)
+
+        method = spec.Basic.GetOk(delivery_tag=delivery_tag, redelivered=message.redelivered,
+                                  exchange=message.exchange, routing_key=message.routing_key)
+        return method, message.properties, message.body
+
+    def _pop_unacked(self, delivery_tag, multiple):
+        if multiple:
+            tags = [t for t in self._unacked if t <= delivery_tag or delivery_tag == 0]
+        else:
+            tags = [delivery_tag] if delivery_tag in self._unacked else []
+
+        ret = []
+        for t in tags:
+            consumer_tag, queue, message = self._unacked.pop(t)
+            consumer = self._consumers.get(consumer_tag)
+            if consumer is not None:
+                consumer.unacked -= 1
+            ret.append((queue, message))
+        return ret
+
+    def _settle(self, delivery_tag, multiple, requeue=None):
+        for queue, message in self._pop_unacked(delivery_tag, multiple):
+            if requeue is True:
+                self.broker.requeue(queue, message)
+            elif requeue is False:
+                self.broker.reject(queue, message)
+        self.connection._wakeup.set()
+
+    def _tx_settle(self, delivery_tag, multiple, requeue=None):
+        # like publishes, acks / nacks / rejects of a transactional channel are held until tx_commit
+        if self._tx is not None:
+            self._tx.append((self._settle, (delivery_tag, multiple, requeue)))
+        else:
+            self._settle(delivery_tag, multiple, requeue)
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self._check_open()
+        self._tx_settle(delivery_tag, multiple)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self._check_open()
+        self._tx_settle(delivery_tag, multiple, requeue)
+
+    def basic_reject(self, delivery_tag=0, requeue=True):
+        self._check_open()
+        self._tx_settle(delivery_tag, False, requeue)
+
+    def _deliver(self):
+        """
+        Delivers messages waiting in the queues consumed by this channel (prefetch count applies per consumer)
+        :return: number of messages delivered
+        """
+        delivered = 0
+        for consumer in list(self._consumers.values()):
+            for _ in range(DELIVERY_BATCH_SIZE):
+                if not self.is_open or consumer.consumer_tag not in self._consumers:
+                    break
+                if not consumer.auto_ack and self._prefetch_count and consumer.unacked >= self._prefetch_count:
+                    break
+
+                with self.broker.lock:
+                    q = self.broker.queues.get(consumer.queue)
+                    if q is None or not q.messages:
+                        break
+                    message = q.messages.popleft()
+
+                delivery_tag = next(self._delivery_tags)
+                if not consumer.auto_ack:
+                    consumer.unacked += 1
+                    self._unacked[delivery_tag] = (consumer.consumer_tag, consumer.queue, message)
+
+                method = spec.Basic.Deliver(consumer_tag=consumer.consumer_tag, delivery_tag=delivery_tag,
+                                            redelivered=message.redelivered, exchange=message.exchange,
+                                            routing_key=message.routing_key)
+                consumer.callback(self, method, message.properties, message.body)
+                delivered += 1
+
+        return delivered
+
+    def start_consuming(self):
+        self._check_open()
+        self._consuming = True
+        while self._consuming and self._consumers and self.is_open:
+            self.connection._process_events(None)
+        self._consuming = False
+
+    def stop_consuming(self, consumer_tag=None):
+        if consumer_tag is not None:
+            self.basic_cancel(consumer_tag)
+            return
+
+        for tag in list(self._consumers):
+            self.basic_cancel(tag)
+        self._consuming = False
+        self.connection._wakeup.set()
+
+    def close(self, reply_code=0, reply_text='Normal shutdown'):
+        if not self.is_open:
+            return
+
+        for tag in list(self._consumers):
+            self.basic_cancel(tag)
+
+        # unacked messages go back to their queues, as when the broker loses the channel
+        for queue, message in self._pop_unacked(0, multiple=True):
+            self.broker.requeue(queue, message)
+
+        self.is_open = False
+        self._consuming = False
+        self.connection._on_channel_closed(self)
+
+
+class _Timer:
+
+    def __init__(self, deadline, callback):
+        self.deadline = deadline
+        self.callback = callback
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return self.deadline < other.deadline
+
+
+class BlockingConnection:
+    """
+    Subset of pika.BlockingConnection, connection parameters are ignored (all connections go to the same broker)
+    """
+
+    def __init__(self, parameters=None, broker=None, *args, **kwargs):
+        self.broker = broker or get_broker()
+        self.is_open = True
+
+        self._channels = []
+        self._channel_numbers = itertools.count(1)
+        self._timers = []  # heap of _Timer
+        self._threadsafe_callbacks = deque()
+        self._wakeup = threading.Event()
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    def channel(self, channel_number=None):
+        if not self.is_open:
+            raise pika.exceptions.ConnectionWrongStateError('Connection is closed.')
+        ch = BlockingChannel(self, channel_number or next(self._channel_numbers))
+        self._channels.append(ch)
+        return ch
+
+    def _on_channel_closed(self, channel):
+        if channel in self._channels:
+            self._channels.remove(channel)
+
+    def close(self, reply_code=200, reply_text='Normal shutdown'):
+        if not self.is_open:
+            return
+        for ch in list(self._channels):
+            ch.close()
+        self.is_open = False
+        self._wakeup.set()
+
+    def call_later(self, delay, callback):
+        timer = _Timer(time.time() + delay, callback)
+        heapq.heappush(self._timers, timer)
+        return timer
+
+    def remove_timeout(self, timeout_id):
+        timeout_id.cancelled = True
+
+    def add_callback_threadsafe(self, callback):
+        self._threadsafe_callbacks.append(callback)
+        self._wakeup.set()
+
+    def process_data_events(self, time_limit=0):
+        self._process_events(time_limit)
+
+    def sleep(self, duration):
+        deadline = time.time() + duration
+        while self.is_open:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            self._process_events(remaining)
+
+    def _dispatch(self):
+        """
+        :return: True if any callback, timer or delivery was processed
+        """
+        processed = False
+
+        while self._threadsafe_callbacks:
+            self._threadsafe_callbacks.popleft()()
+            processed = True
+
+        now = time.time()
+        while self._timers and self._timers[0].deadline <= now:
+            timer = heapq.heappop(self._timers)
+            if not timer.cancelled:
+                timer.callback()
+                processed = True
+
+        for ch in list(self._channels):
+            if ch._deliver():
+                processed = True
+
+        return processed
+
+    def _process_events(self, time_limit):
+        """
+        Processes pending events, waiting up to time_limit seconds (forever if None) for some if there are none
+        """
+        deadline = None if time_limit is None else time.time() + time_limit
+
+        while self.is_open:
+            self._wakeup.clear()
+            if self._dispatch():
+                return
+
+            now = time.time()
+            timeouts = [t - now for t in (deadline, self._next_timer_deadline()) if t is not None]
+            if deadline is not None and deadline <= now:
+                return
+
+            self._wakeup.wait(max(0, min(timeouts)) if timeouts else None)
+
+    def _next_timer_deadline(self):
+        while self._timers and self._timers[0].cancelled:
+            heapq.heappop(self._timers)
+        return self._timers[0].deadline if self._timers else None
+
+
+def install():
+    """
+    Switches the whole process to the in-memory backend: connections created afterwards with
+    pika.BlockingConnection(...) (by the components and the libraries they use) go to the in-memory broker
+    """
+    pika.BlockingConnection = BlockingConnection
+    logger.info('In-memory event bus backend installed, AMQP connections will not reach any broker')
+    return get_broker()
+
+
+def uninstall():
+    pika.BlockingConnection = _original_blocking_connection
+
+
+def is_installed():
+    return pika.BlockingConnection is BlockingConnection
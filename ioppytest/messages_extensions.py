@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/env python3
+
+"""
+Event bus messages used internally by the testing tool components which are not (yet) part of the messages library.
+
+Importing this module registers the messages in the library's routing key -> message type map, so they are built by
+Message.load / Message.load_from_pika like any other message of the API.
+"""
+
+from messages import Message, MsgReply, rk_pattern_to_message_type_map
+
+
+# # # # # # ROUTING MESSAGES # # # # # #
+
+class MsgRoutingStats(Message):
+    """
+    Requirements: Packet router SHOULD publish it periodically
+
+    Type: Event
+
+    Pub/Sub: routing -> any
+
+    Description: Per route (src_rkey, dst_rkey) counters and forwarding latency histograms
+    """
+    routing_key = "routing.stats"
+
+    _msg_data_template = {
+        "component": "packet_router",
+        "timestamp": 1488586183.45,
+        "routes": [
+            {
+                "src": "fromAgent.coap_client.ip.tun.packet.raw",
+                "dst": "toAgent.coap_server.ip.tun.packet.raw",
+                "packets": 10,
+                "bytes": 760,
+                "drops": 0,
+                "overflows": 0,
+                "latency": {
+                    "count": 1,
+                    "sum": 0.002,
+                    "max": 0.002,
+                    "buckets": [[0.001, 0], [0.005, 1]],
+                }
+            }
+        ],
+    }
+
+
+class MsgRoutingStatsRequest(Message):
+    """
+    Requirements: Packet router SHOULD implement
+
+    Type: Request (service)
+
+    Pub/Sub: any -> routing
+
+    Description: Request the packet router's stats (see MsgRoutingStats)
+    """
+    routing_key = "routing.stats.request"
+
+    _msg_data_template = {}
+
+
+class MsgRoutingStatsReply(MsgReply):
+    """
+    Requirements: Packet router SHOULD implement
+
+    Type: Reply (service)
+
+    Pub/Sub: routing -> any
+
+    Description: Reply to MsgRoutingStatsRequest, same fields as MsgRoutingStats
+    """
+    routing_key = "routing.stats.reply"
+
+    _msg_data_template = {
+        "ok": True,
+        "component": "packet_router",
+        "timestamp": 1488586183.45,
+        "routes": [],
+    }
+
+
+class MsgRoutingShardStatsReply(Message):
+    """
+    Requirements: Sharded packet routers SHOULD implement (other components should not subscribe to event)
+
+    Type: Event
+
+    Pub/Sub: routing -> routing (shard 0)
+
+    Description: Stats of the routes of a shard (see MsgRoutingStatsRequest), shard 0 collects them and replies to
+    the request with the routes of all shards.
+    """
+    routing_key = "routing.shard.stats.reply"
+
+    _msg_data_template = {
+        "shard": 1,
+        "request_id": "360b0ca6-1e48-4ad3-a6d1-5d5d9ab7a0d7",
+        "routes": [],
+    }
+
+
+class MsgRoutingTableUpdate(Message):
+    """
+    Requirements: Packet router SHOULD implement
+
+    Type: Request (service)
+
+    Pub/Sub: any -> routing
+
+    Description: Reconfigure the packet router's routing table for another test configuration, without restarting it
+    """
+    routing_key = "routing.table.update.request"
+
+    _msg_data_template = {
+        "configuration_id": "COAP_CFG_01",
+    }
+
+
+class MsgRoutingTableUpdateReply(MsgReply):
+    """
+    Requirements: Packet router SHOULD implement
+
+    Type: Reply (service)
+
+    Pub/Sub: routing -> any
+
+    Description: Reply to MsgRoutingTableUpdate, indicates the source routing keys added, removed and changed
+    """
+    routing_key = "routing.table.update.reply"
+
+    _msg_data_template = {
+        "ok": True,
+        "component": "packet_router",
+        "configuration_id": "COAP_CFG_01",
+        "added": [],
+        "removed": [],
+        "changed": [],
+    }
+
+
+class MsgRoutingShardTableUpdateReply(Message):
+    """
+    Requirements: Sharded packet routers SHOULD implement (other components should not subscribe to event)
+
+    Type: Event
+
+    Pub/Sub: routing -> routing (shard 0)
+
+    Description: Routing table partition of a shard updated (see MsgRoutingTableUpdate), shard 0 collects them and
+    replies to the request once all shards applied their partition.
+    """
+    routing_key = "routing.shard.table.update.reply"
+
+    _msg_data_template = {
+        "shard": 1,
+        "request_id": "360b0ca6-1e48-4ad3-a6d1-5d5d9ab7a0d7",
+        "configuration_id": "COAP_CFG_01",
+        "added": [],
+        "removed": [],
+        "changed": [],
+    }
+
+
+# # # # # # SNIFFING MESSAGES # # # # # #
+
+class MsgSniffingGetCaptureChunk(Message):
+    """
+    Requirements: Sniffer SHOULD implement
+
+    Type: Request (service)
+
+    Pub/Sub: coordination -> sniffing
+
+    Description: Get a chunk (length bytes starting at offset) of a capture's pcap file
+    """
+    routing_key = "sniffing.getcapturechunk.request"
+
+    _msg_data_template = {
+        "capture_id": "TD_COAP_CORE_01",
+        "offset": 0,
+        "length": 131072,
+    }
+
+
+class MsgSniffingGetCaptureChunkReply(MsgReply):
+    """
+    Requirements: Sniffer SHOULD implement
+
+    Type: Reply (service)
+
+    Pub/Sub: sniffing -> coordination
+
+    Description: Reply to MsgSniffingGetCaptureChunk, eof is True if the chunk reaches the end of the file
+    """
+    routing_key = "sniffing.getcapturechunk.reply"
+
+    _msg_data_template = {
+        "ok": True,
+        "file_enc": "pcap_base64",
+        "filename": "TD_COAP_CORE_01.pcap",
+        "offset": 0,
+        "total_size": 24,
+        "eof": True,
+        "value": "1MOyoQIABAAAAAAAAAAAAMgAAAAAAAAA",
+    }
+
+
+class MsgSniffingStreamCapture(Message):
+    """
+    Requirements: Sniffer SHOULD implement
+
+    Type: Request (service)
+
+    Pub/Sub: coordination -> sniffing
+
+    Description: Request a capture's pcap file as a stream of MsgSniffingCaptureChunk events (tagged with the request's
+    correlation id), followed by a MsgSniffingStreamCaptureReply with the file's checksum. If compression is 'gzip'
+    the stream is the gzip compressed file (see reply's file_enc)
+    """
+    routing_key = "sniffing.streamcapture.request"
+
+    _msg_data_template = {
+        "capture_id": "TD_COAP_CORE_01",
+        "chunk_size": 131072,
+        "compression": None,
+    }
+
+
+class MsgSniffingCaptureChunk(Message):
+    """
+    Requirements: Sniffer SHOULD implement
+
+    Type: Event
+
+    Pub/Sub: sniffing -> coordination
+
+    Description: Chunk of a capture streamed in response to MsgSniffingStreamCapture
+    """
+    routing_key = "sniffing.capturechunk"
+
+    _msg_data_template = {
+        "stream_id": "360b0d3a-9c5e-4b9d-8bfc-ff5f8b6ad8f4",
+        "capture_id": "TD_COAP_CORE_01",
+        "sequence_number": 0,
+        "offset": 0,
+        "file_enc": "pcap_base64",
+        "value": "1MOyoQIABAAAAAAAAAAAAMgAAAAAAAAA",
+    }
+
+
+class MsgSniffingStreamCaptureReply(MsgReply):
+    """
+    Requirements: Sniffer SHOULD implement
+
+    Type: Reply (service)
+
+    Pub/Sub: sniffing -> coordination
+
+    Description: Sent once all the chunks of the capture have been streamed
+    """
+    routing_key = "sniffing.streamcapture.reply"
+
+    _msg_data_template = {
+        "ok": True,
+        "file_enc": "pcap_base64",
+        "filename": "TD_COAP_CORE_01.pcap",
+        "total_size": 24,
+        "chunks": 1,
+        "checksum_algorithm": "sha256",
+        "checksum": "",
+    }
+
+
+class MsgSniffingExtractCapture(Message):
+    """
+    Requirements: Sniffer SHOULD implement (if running with a ring buffer)
+
+    Type: Request (service)
+
+    Pub/Sub: coordination -> sniffing
+
+    Description: Builds the capture (pcap file) from the frames kept in the sniffer's ring buffer, consumed between
+    t_start and t_end. If nodes is given, only frames sent by those nodes are extracted
+    """
+    routing_key = "sniffing.extractcapture.request"
+
+    _msg_data_template = {
+        "capture_id": "TD_COAP_CORE_01",
+        "t_start": 1488586183.45,
+        "t_end": 1488586190.45,
+        "nodes": None,
+    }
+
+
+class MsgSniffingExtractCaptureReply(MsgReply):
+    """
+    Requirements: Sniffer SHOULD implement (if running with a ring buffer)
+
+    Type: Reply (service)
+
+    Pub/Sub: sniffing -> coordination
+
+    Description: Reply to MsgSniffingExtractCapture, capture can then be retrieved as any other capture. Frames
+    older than oldest_timestamp are no longer in the ring buffer
+    """
+    routing_key = "sniffing.extractcapture.reply"
+
+    _msg_data_template = {
+        "ok": True,
+        "filename": "TD_COAP_CORE_01.pcap",
+        "frames": 0,
+        "oldest_timestamp": 1488586183.45,
+    }
+
+
+class MsgSniffingGetCaptureSlice(Message):
+    """
+    Requirements: Sniffer SHOULD implement
+
+    Type: Request (service)
+
+    Pub/Sub: coordination -> sniffing
+
+    Description: Get the frames of a capture within [t_start, t_end], sent by agents, seen on link_id (all filters
+    are optional), the slice is built using the capture's frame index
+    """
+    routing_key = "sniffing.getcaptureslice.request"
+
+    _msg_data_template = {
+        "capture_id": "TD_COAP_CORE_01",
+        "t_start": None,
+        "t_end": None,
+        "agents": None,
+        "link_id": None,
+        "compression": None,
+    }
+
+
+class MsgSniffingGetCaptureSliceReply(MsgReply):
+    """
+    Requirements: Sniffer SHOULD implement
+
+    Type: Reply (service)
+
+    Pub/Sub: sniffing -> coordination
+
+    Description: Reply to MsgSniffingGetCaptureSlice, value is a pcap file with the selected frames
+    """
+    routing_key = "sniffing.getcaptureslice.reply"
+
+    _msg_data_template = {
+        "ok": True,
+        "file_enc": "pcap_base64",
+        "filename": "TD_COAP_CORE_01.pcap",
+        "frames": 0,
+        "value": "1MOyoQIABAAAAAAAAAAAAMgAAAAAAAAA",
+    }
+
+
+rk_pattern_to_message_type_map.rkey_to_message_dict.update(
+    {
+        MsgRoutingStats.routing_key: MsgRoutingStats,
+        MsgRoutingStatsRequest.routing_key: MsgRoutingStatsRequest,
+        MsgRoutingStatsReply.routing_key: MsgRoutingStatsReply,
+        MsgRoutingShardStatsReply.routing_key: MsgRoutingShardStatsReply,
+        MsgRoutingTableUpdate.routing_key: MsgRoutingTableUpdate,
+        MsgRoutingTableUpdateReply.routing_key: MsgRoutingTableUpdateReply,
+        MsgRoutingShardTableUpdateReply.routing_key: MsgRoutingShardTableUpdateReply,
+        MsgSniffingGetCaptureChunk.routing_key: MsgSniffingGetCaptureChunk,
+        MsgSniffingGetCaptureChunkReply.routing_key: MsgSniffingGetCaptureChunkReply,
+        MsgSniffingStreamCapture.routing_key: MsgSniffingStreamCapture,
+        MsgSniffingCaptureChunk.routing_key: MsgSniffingCaptureChunk,
+        MsgSniffingStreamCaptureReply.routing_key: MsgSniffingStreamCaptureReply,
+        MsgSniffingExtractCapture.routing_key: MsgSniffingExtractCapture,
+        MsgSniffingExtractCaptureReply.routing_key: MsgSniffingExtractCaptureReply,
+        MsgSniffingGetCaptureSlice.routing_key: MsgSniffingGetCaptureSlice,
+        MsgSniffingGetCaptureSliceReply.routing_key: MsgSniffingGetCaptureSliceReply,
+    }
+)
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/env python3
+
+"""
+Encodings of the data plane messages (MsgPacketSniffedRaw / MsgPacketInjectRaw) published in the event bus.
+
+By default packets travel as json messages where each byte of the packet is an integer of the `data` list, which
+inflates each packet byte into 2-4 chars plus a comma. Publishers may instead use a compact encoding, signalled to
+the consumers through the AMQP content_type property:
+
+    - 'application/json' (default, legacy):
+        {"_api_version": "1.2.14", "data": [96, 0, 0, ..], "interface_name": "tun0", "timestamp": 1488586183.45}
+
+    - 'application/json;data=base64':
+        {"_api_version": "1.2.14", "data": "YAAAAA..", "interface_name": "tun0", "timestamp": 1488586183.45}
+
+    - 'application/octet-stream':
+        body is the packet itself (raw bytes), the rest of the message fields are passed as AMQP headers.
+
+>>> body, properties = encode_packet_message(MsgPacketInjectRaw(), PACKET_ENCODING_RAW)
+>>> properties.content_type
+'application/octet-stream'
+>>> m = load_packet_message(method, properties, body)  # method as passed to pika's consumer callbacks
+>>> m.data[:4]
+b'`\\x00\\x00\\x00'
+"""
+
+import json
+import base64
+import logging
+
+import pika
+from messages import Message, NonCompliantMessageFormatError
+from event_bus_utils import AmqpListener
+
+PACKET_ENCODING_JSON = 'json'
+PACKET_ENCODING_BASE64 = 'base64'
+PACKET_ENCODING_RAW = 'raw'
+
+PACKET_ENCODINGS = (
+    PACKET_ENCODING_JSON,
+    PACKET_ENCODING_BASE64,
+    PACKET_ENCODING_RAW,
+)
+
+CONTENT_TYPE_JSON = 'application/json'
+CONTENT_TYPE_BASE64 = 'application/json;data=base64'
+CONTENT_TYPE_RAW = 'application/octet-stream'
+
+_content_type_to_encoding = {
+    CONTENT_TYPE_JSON: PACKET_ENCODING_JSON,
+    CONTENT_TYPE_BASE64: PACKET_ENCODING_BASE64,
+    CONTENT_TYPE_RAW: PACKET_ENCODING_RAW,
+}
+
+_encoding_to_content_type = {v: k for k, v in _content_type_to_encoding.items()}
+
+logger = logging.getLogger(__name__)
+
+
+def is_packet_routing_key(routing_key):
+    """
+    :return: True if routing key belongs to a data plane packet (fromAgent.*.*.packet.raw, toAgent.*.*.packet.raw)
+    """
+    return routing_key.endswith('.packet.raw') and (routing_key.startswith('fromAgent.')
+                                                     or routing_key.startswith('toAgent.'))
+
+
+def get_packet_encoding(properties):
+    """
+    :param properties: pika.BasicProperties of the received message
+    :return: one of PACKET_ENCODINGS, json is assumed if no (or unknown) content type is provided
+    """
+    content_type = getattr(properties, 'content_type', None)
+    if content_type:
+        content_type = content_type.replace(' ', '')
+    return _content_type_to_encoding.get(content_type, PACKET_ENCODING_JSON)
+
+
+def decode_packet_body(properties, body):
+    """
+    :return: tuple (data, fields) where data is the packet as bytes and fields a dict with the rest of message fields
+    """
+    encoding = get_packet_encoding(properties)
+
+    try:
+        if encoding == PACKET_ENCODING_RAW:
+            fields = dict(properties.headers) if properties.headers else {}
+            data = bytes(body)
+
+        else:
+            fields = json.loads(body.decode('utf-8'))
+            data = fields.pop('data', None) or []
+            if encoding == PACKET_ENCODING_BASE64:
+                data = base64.b64decode(data)
+            else:
+                data = bytes(data)
+
+    except (ValueError, TypeError) as e:
+        raise NonCompliantMessageFormatError('Cannot decode %s packet: %s' % (encoding, e))
+
+    return data, fields
+
+
+def encode_packet_body(data, fields, encoding=PACKET_ENCODING_JSON):
+    """
+    :param data: packet as bytes (or list of integers)
+    :param fields: dict with the rest of message fields (timestamp, interface_name, etc)
+    :return: tuple (body, content_type, headers) ready to be published
+    """
+    if encoding == PACKET_ENCODING_RAW:
+        return bytes(data), CONTENT_TYPE_RAW, dict(fields)
+
+    payload = dict(fields)
+    if encoding == PACKET_ENCODING_BASE64:
+        payload['data'] = base64.b64encode(bytes(data)).decode('ascii')
+    elif encoding == PACKET_ENCODING_JSON:
+        payload['data'] = list(data)
+    else:
+        raise ValueError('Unknown packet encoding %s, expected one of %s' % (encoding, PACKET_ENCODINGS))
+
+    return json.dumps(payload, sort_keys=True), _encoding_to_content_type[encoding], None
+
+
+def load_packet_message(method, props, body):
+    """
+    Like Message.load_from_pika, but also understands the compact packet encodings.
+    For compact encodings the returned message carries the `data` field as bytes (iterating it yields integers,
+    same as for the legacy list of integers)
+    """
+    if get_packet_encoding(props) == PACKET_ENCODING_JSON:
+        return Message.load_from_pika(method, props, body)
+
+    data, fields = decode_packet_body(props, body)
+    message = Message.load(json.dumps(fields), method.routing_key, None)
+    message.data = data
+    return message
+
+
+def get_packet_timestamp(message):
+    """
+    :param message: MsgPacketSniffedRaw or MsgPacketInjectRaw message, as returned by load_packet_message
+    :return: timestamp field of the packet (set by its publisher, e.g. when the agent sniffed it), None if the
+        publisher didn't provide a valid one
+    """
+    # Message objects expose the AMQP timestamp property as `timestamp` attribute, which shadows the body's field
+    timestamp = message._msg_data.get('timestamp')
+    if isinstance(timestamp, bool) or not isinstance(timestamp, (int, float)) or timestamp <= 0:
+        return None
+    return float(timestamp)
+
+
+def encode_packet_message(message, encoding=PACKET_ENCODING_JSON):
+    """
+    :param message: MsgPacketInjectRaw or MsgPacketSniffedRaw message
+    :return: tuple (body, pika.BasicProperties) ready to be published
+    """
+    fields = {k: v for k, v in message.to_dict().items() if k != 'data'}
+    body, content_type, headers = encode_packet_body(message.data, fields, encoding)
+
+    properties = message.get_properties()
+    properties['content_type'] = content_type
+    if headers:
+        properties['headers'] = headers
+
+    return body, pika.BasicProperties(**properties)
+
+
+class PacketAwareAmqpListener(AmqpListener):
+    """
+    AmqpListener which also understands data plane packets published with a compact encoding
+    """
+
+    def on_request(self, ch, method, props, body):
+        if not self.use_message_typing or get_packet_encoding(props) == PACKET_ENCODING_JSON:
+            return super(PacketAwareAmqpListener, self).on_request(ch, method, props, body)
+
+        try:
+            m = load_packet_message(method, props, body)
+            self.message_dispatcher(m)
+        except NonCompliantMessageFormatError as e:
+            logger.error('%s got a non compliant message error %s' % (self.__class__.__name__, e))
+        finally:
+            ch.basic_ack(delivery_tag=method.delivery_tag)
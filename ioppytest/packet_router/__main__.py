@@ -1,15 +1,35 @@
 # -*- coding: utf-8 -*-
 # !/usr/bin/env python3
 import sys
+import json
+import time
 import yaml
 import pika
 import tabulate
 import argparse
 import threading
+import multiprocessing
 
 from messages import *
 from ioppytest import AMQP_URL, AMQP_EXCHANGE, LOG_LEVEL, TEST_DESCRIPTIONS_CONFIGS, LOGGER_FORMAT
 from ioppytest.test_suite.testsuite import TestConfig, get_dict_of_all_test_cases_configurations
+from ioppytest.packet_encoding import (
+    PACKET_ENCODINGS,
+    get_packet_encoding,
+    load_packet_message,
+    encode_packet_message,
+)
+from ioppytest.packet_router.impairments import LinkImpairment, TimerWheel
+from ioppytest.packet_router.stats import RoutingStats
+from ioppytest.messages_extensions import (
+    MsgRoutingStats,
+    MsgRoutingStatsRequest,
+    MsgRoutingStatsReply,
+    MsgRoutingShardStatsReply,
+    MsgRoutingTableUpdate,
+    MsgRoutingTableUpdateReply,
+    MsgRoutingShardTableUpdateReply,
+)
 from event_bus_utils import publish_message
 from event_bus_utils.rmq_handler import RabbitMQHandler, JsonFormatter
 
@@ -26,10 +46,58 @@ logging.getLogger('pika').setLevel(logging.WARNING)
 class PacketRouter(threading.Thread):
     DEFAULT_TOPICS = [
         'routing.#',
-    ]  # this list is further extended on __init__ with the routing table
-
-    def __init__(self, amqp_url, amqp_exchange, routing_table):
-        assert routing_table
+    ]
+
+    # all data plane messages are consumed from a single queue and dispatched using the routing table (sharded
+    # routers bind the queue only to the source routing keys of their table's partition)
+    DATA_PLANE_TOPICS = [
+        'fromAgent.*.#',
+        'data.serial.fromAgent.*',  # TODO deprecate old API from 802.15.4 based test suites like sixlowpan
+    ]
+
+    # default mode: packets consumed, acked and forwarded one at a time
+    PREFETCH_COUNT = 1
+    SOURCE_QUEUE_MAX_LENGTH = 100
+
+    # throughput mode: packets are consumed within a larger window, and acked in batches once the broker confirmed
+    # their forwarded copies (publisher confirms, waited for once per batch)
+    THROUGHPUT_MODE_PREFETCH_COUNT = 500
+    THROUGHPUT_MODE_SOURCE_QUEUE_MAX_LENGTH = 10000
+    THROUGHPUT_MODE_BATCH_SIZE = 50
+    THROUGHPUT_MODE_BATCH_TIMEOUT = 0.01  # seconds a packet may wait in an incomplete batch
+    THROUGHPUT_MODE_CONFIRMS_TIMEOUT = 5  # seconds
+
+    STATS_LOG_INTERVAL = 10  # seconds, also the period for publishing MsgRoutingStats
+
+    # forwarding latency is measured for all packets carrying their timestamp in the AMQP headers (raw encoding),
+    # json encoded packets need to be decoded for it, so only 1 out of N is measured
+    LATENCY_SAMPLING = 10
+
+    # resolution of the timer wheel used for delayed (impaired links) packets
+    IMPAIRMENTS_TIMER_TICK = 0.001  # seconds
+
+    # data plane messages dropped by the broker are dead-lettered to a small queue only used for counting them, when
+    # it overflows too the overflow events are lost (stats' overflow counters are then a lower bound)
+    OVERFLOW_QUEUE_MAX_LENGTH = 100
+
+    # sharded routers: seconds shard 0 waits for the other shards' replies before replying to a request without them
+    SHARD_REPLIES_TIMEOUT = 5
+
+    def __init__(self, amqp_url, amqp_exchange, routing_table, packet_encoding=None, packet_validation_sampling=0,
+                 throughput_mode=False, shard_id=None, shard_count=None, partition_by='link'):
+        """
+        :param packet_encoding: encoding used for forwarding packets (json, base64 or raw), if None then packets are
+            forwarded using the same encoding they were received with
+        :param packet_validation_sampling: validate format of 1 out of N forwarded packets, 0 disables validation
+        :param throughput_mode: consume with a large prefetch window and commit acks & publishes in batches
+        :param shard_id: index of the routing table partition handled by this router (see run_sharded_routers)
+        :param shard_count: number of partitions, needed together with partition_by by sharded routers for taking
+            their own partition of the updated routing tables (see MsgRoutingTableUpdate). Shard 0 replies to the
+            service requests once it collected the replies of all the shards (see MsgRoutingShardTableUpdateReply)
+        """
+        # sharded routers may start with an empty partition, and get routes on later routing table updates
+        assert routing_table or shard_id is not None
+        assert packet_encoding is None or packet_encoding in PACKET_ENCODINGS
 
         threading.Thread.__init__(self)
 
@@ -37,9 +105,33 @@ class PacketRouter(threading.Thread):
         self.url = amqp_url
 
         self.routing_table = routing_table
+        self.packet_encoding = packet_encoding
+        self.packet_validation_sampling = packet_validation_sampling
+        self.throughput_mode = throughput_mode
+        self.shard_id = shard_id
+        self.shard_count = shard_count
+        self.partition_by = partition_by
+
+        if self.throughput_mode:
+            self.prefetch_count = self.THROUGHPUT_MODE_PREFETCH_COUNT
+            self.source_queue_max_length = self.THROUGHPUT_MODE_SOURCE_QUEUE_MAX_LENGTH
+        else:
+            self.prefetch_count = self.PREFETCH_COUNT
+            self.source_queue_max_length = self.SOURCE_QUEUE_MAX_LENGTH
 
         # component identification & bus params
-        self.component_id = COMPONENT_ID
+        if self.shard_id is None:
+            self.component_id = COMPONENT_ID
+            self.data_plane_topics = self.DATA_PLANE_TOPICS
+        else:
+            self.component_id = '%s_%s' % (COMPONENT_ID, self.shard_id)
+            self.data_plane_topics = list(self.routing_table)
+
+        self.services_queue = 'services_queue@%s' % self.component_id
+        self.data_plane_queue = 'data_plane@%s' % self.component_id
+
+        # data plane messages overflowing the queue are dead-lettered (through the default exchange) to this queue
+        self.overflow_queue = 'overflow@%s' % self.component_id
 
         # init logging to stnd output and log files
         self.logger = logging.getLogger(self.component_id)
@@ -50,7 +142,34 @@ class PacketRouter(threading.Thread):
         ))
 
         self.message_count = 0
+        self.dropped_count = 0
         self.pending_number_of_packets_to_drop = 0
+        self.stats = RoutingStats(self.routing_table)
+
+        # link impairments (src_rkey -> LinkImpairment) and packets waiting for delayed delivery
+        self.link_impairments = {}
+        self.timer_wheel = TimerWheel(tick=self.IMPAIRMENTS_TIMER_TICK)
+        self._timer_wheel_timer = None
+        self._timer_wheel_deadline = None
+
+        # throughput mode batch state
+        self._batch_len = 0
+        self._batch_last_delivery_tag = None
+        self._batch_timer = None
+
+        # throughput mode publisher confirms
+        self._confirms_async = False
+        self._publish_tag = 0  # delivery tag of the last publish
+        self._unconfirmed_tags = set()
+        self._nacked_count = 0
+
+        # periodic stats
+        self._stats_last_message_count = 0
+        self._stats_last_dropped_count = 0
+
+        # shard 0: partial replies of the shards, per request (correlation id)
+        self._pending_shard_replies = {}
+
         self._set_up_connection()
         self._queues_init()
 
@@ -74,66 +193,523 @@ class PacketRouter(threading.Thread):
             # setup AMQP connection
             self.connection = pika.BlockingConnection(pika.URLParameters(self.url))
             self.channel = self.connection.channel()
-            self.channel.basic_qos(prefetch_count=1)
+            self.channel.basic_qos(prefetch_count=self.prefetch_count)
+            if self.throughput_mode:
+                self._enable_publisher_confirms()
 
         except pika.exceptions.ConnectionClosed as cc:
             self.logger.error(' AMQP connection cannot be established, is message broker up? \n More: %s' % cc)
             sys.exit(1)
 
+    def _enable_publisher_confirms(self):
+        """
+        BlockingChannel.confirm_delivery() makes each publish wait for its own confirm, so confirms are enabled on
+        the underlying pika channel instead, with a callback keeping track of the unconfirmed publishes. They are
+        waited for once per batch (see _commit_batch).
+        """
+        impl = getattr(self.channel, '_impl', None)
+        if impl is None:
+            # in-memory event bus backend, publishing is synchronous
+            self.channel.confirm_delivery()
+            return
+
+        selected = []
+        impl.confirm_delivery(ack_nack_callback=self._on_publish_confirm, callback=selected.append)
+        while not selected:
+            self.connection.process_data_events(time_limit=0.1)
+        self._confirms_async = True
+
+    def _on_publish_confirm(self, frame):
+        method = frame.method
+        if method.multiple:
+            confirmed = {tag for tag in self._unconfirmed_tags if tag <= method.delivery_tag}
+        else:
+            confirmed = {method.delivery_tag} & self._unconfirmed_tags
+
+        if isinstance(method, pika.spec.Basic.Nack):
+            self._nacked_count += len(confirmed)
+        self._unconfirmed_tags -= confirmed
+
+    def _basic_publish(self, routing_key, body, properties):
+        self.channel.basic_publish(
+            body=body,
+            routing_key=routing_key,
+            exchange=self.exchange_name,
+            properties=properties
+        )
+
+        if self._confirms_async:
+            self._publish_tag += 1
+            self._unconfirmed_tags.add(self._publish_tag)
+
+    def _wait_for_publish_confirms(self):
+        # called from consumer callbacks, so the connection only does I/O here (no nested dispatch of deliveries)
+        deadline = time.time() + self.THROUGHPUT_MODE_CONFIRMS_TIMEOUT
+        while self._unconfirmed_tags and time.time() < deadline:
+            self.connection.process_data_events(time_limit=0)
+
+        if self._unconfirmed_tags:
+            self.logger.error('%s forwarded packet(s) not confirmed by the broker' % len(self._unconfirmed_tags))
+            self._unconfirmed_tags.clear()
+
+        if self._nacked_count:
+            self.logger.error('%s forwarded packet(s) nacked by the broker' % self._nacked_count)
+            self._nacked_count = 0
+
     def _queues_init(self):
         # declare a multi-purpose amqp queue for services provided by component
-        self.channel.queue_declare(queue='services_queue@%s' % COMPONENT_ID, auto_delete=True)
-        self.channel.queue_purge('services_queue@%s' % COMPONENT_ID)
+        self.channel.queue_declare(queue=self.services_queue, auto_delete=True)
+        self.channel.queue_purge(self.services_queue)
 
         for t in self.DEFAULT_TOPICS:
             self.channel.queue_bind(exchange=self.exchange_name,
-                                    queue='services_queue@%s' % COMPONENT_ID,
+                                    queue=self.services_queue,
                                     routing_key=t)
 
-            self.channel.basic_qos(prefetch_count=1)
-            self.channel.basic_consume(on_message_callback=self._on_request, queue='services_queue@%s' % COMPONENT_ID)
+            self.channel.basic_consume(on_message_callback=self._on_request, queue=self.services_queue)
 
-        # handle subscriptions for routing table declarations
         for src_rkey, dst_rkey_list in self.routing_table.items():
             assert type(src_rkey) is str
             assert type(dst_rkey_list) is list
 
-            src_queue = '%s@%s' % (src_rkey, COMPONENT_ID)
-            self.channel.queue_declare(queue=src_queue,
-                                       auto_delete=False,
-                                       arguments={'x-max-length': 100})
-
-            # start with clean queues
-            self.channel.queue_purge(src_queue)
+        # the default exchange routes the dead-lettered messages only to this queue (routing key is the queue's name),
+        # so their payloads don't reach the services queue or any other component's queue
+        self.channel.queue_declare(queue=self.overflow_queue,
+                                   auto_delete=True,
+                                   arguments={'x-max-length': self.OVERFLOW_QUEUE_MAX_LENGTH})
+        self.channel.queue_purge(self.overflow_queue)
+        self.channel.basic_consume(on_message_callback=self._on_request, queue=self.overflow_queue)
+
+        # start with a clean queue (deleted, in case it was declared with a different max length), it buffers as
+        # many messages per source as the per source queues used to
+        self.channel.queue_delete(self.data_plane_queue)
+        self.channel.queue_declare(queue=self.data_plane_queue,
+                                   auto_delete=False,
+                                   arguments={
+                                       'x-max-length': self.source_queue_max_length * max(len(self.routing_table), 1),
+                                       'x-dead-letter-exchange': '',
+                                       'x-dead-letter-routing-key': self.overflow_queue,
+                                   })
+
+        for t in self.data_plane_topics:
             self.channel.queue_bind(exchange=self.exchange_name,
-                                    queue=src_queue,
-                                    routing_key=src_rkey)
+                                    queue=self.data_plane_queue,
+                                    routing_key=t)
 
-            # bind all src queues to _on_request callback
-            self.channel.basic_consume(on_message_callback=self._on_request, queue=src_queue)
+        self.channel.basic_consume(on_message_callback=self._on_request, queue=self.data_plane_queue)
 
     def stop(self):
 
         self._notify_component_shutdown()
 
-        # delete routing all queues
-        for src_rkey in self.routing_table.keys():
-            # convention on queue naming
-            src_queue = '%s@%s' % (src_rkey, COMPONENT_ID)
-            self.channel.queue_delete(src_queue)
+        self.channel.queue_delete(self.data_plane_queue)
 
         self.channel.stop_consuming()
 
+    def _drop_packet_if_lossy_link(self, src_rkey):
+        """
+        :return: True if packet needs to be dropped (lossy link configured with pending packets to drop)
+        """
+        if self.pending_number_of_packets_to_drop > 0:
+            self.pending_number_of_packets_to_drop -= 1
+            self.dropped_count += 1
+            self.stats.record_dropped(src_rkey)
+            self.logger.info(
+                'Dropping packet due to lossy link config. Pending packets to drop: %s' %
+                self.pending_number_of_packets_to_drop
+            )
+            return True
+        return False
+
+    def _configure_lossy_link(self, message):
+        """
+        Legacy lossy link requests (no nodes) drop the next N packets whatever their source. Requests indicating the
+        link's nodes configure the impairments of the packets sourced by them, a request with no packets to drop and
+        no impairments resets the link.
+
+        Sharded routers all get the request, but the next N packets are dropped by only one of them: shard 0 for
+        legacy requests, the shard routing the link's first node for the others (the rest of the impairments apply
+        on every shard routing sources of the link).
+        """
+        nodes = getattr(message, 'nodes', None)
+        impairments = getattr(message, 'impairments', None)
+
+        if not nodes:
+            if self.shard_id not in (None, 0):
+                return
+            self.pending_number_of_packets_to_drop = message.number_of_packets_to_drop
+            self.logger.info("Packet router configured to drop %s packet(s)" % self.pending_number_of_packets_to_drop)
+            return
+
+        src_rkeys = [k for k in self.routing_table if _get_source_node(k) in nodes]
+
+        if not impairments and not message.number_of_packets_to_drop:
+            for k in src_rkeys:
+                self.link_impairments.pop(k, None)
+            self.logger.info("Packet router impairments removed for link with nodes %s" % nodes)
+            return
+
+        drop_next = message.number_of_packets_to_drop or 0
+        if self.shard_id is not None and not any(_get_source_node(k) == nodes[0] for k in self.routing_table):
+            drop_next = 0
+
+        try:
+            link_impairment = LinkImpairment.from_dict(impairments or {}, drop_next=drop_next)
+        except (ValueError, AssertionError, TypeError) as e:
+            self.logger.error('Wrong link impairments configuration %s: %s' % (impairments, e))
+            return
+
+        # all sources of the link share the same pipeline (e.g. drop next N packets on the link)
+        for k in src_rkeys:
+            self.link_impairments[k] = link_impairment
+
+        self.logger.info("Packet router configured to drop %s packet(s) and impair link with nodes %s: %s" %
+                         (link_impairment.drop_next, nodes, link_impairment.to_dict()))
+
+    def update_routing_table(self, routing_table):
+        """
+        Swaps the routing table without re-declaring any queue. Sharded routers bind/unbind the data plane queue only
+        to the source routing keys added/removed, routers bound to the wildcard topics just swap the table.
+
+        :return: added, removed and changed (different destinations) source routing keys
+        """
+        for src_rkey, dst_rkey_list in routing_table.items():
+            assert type(src_rkey) is str
+            assert type(dst_rkey_list) is list
+
+        added = sorted(k for k in routing_table if k not in self.routing_table)
+        removed = sorted(k for k in self.routing_table if k not in routing_table)
+        changed = sorted(k for k in routing_table
+                         if k in self.routing_table and routing_table[k] != self.routing_table[k])
+
+        if self.shard_id is not None:
+            for src_rkey in added:
+                self.channel.queue_bind(exchange=self.exchange_name,
+                                        queue=self.data_plane_queue,
+                                        routing_key=src_rkey)
+            for src_rkey in removed:
+                self.channel.queue_unbind(exchange=self.exchange_name,
+                                          queue=self.data_plane_queue,
+                                          routing_key=src_rkey)
+            self.data_plane_topics = list(routing_table)
+
+        # packets from removed sources still in the queue (or in the timer wheel) are not routed anymore
+        for src_rkey in removed:
+            self.link_impairments.pop(src_rkey, None)
+
+        self.routing_table = routing_table
+        self.stats.routing_table = routing_table
+
+        self.logger.info('routing table updated, added: %s, removed: %s, changed: %s' % (added, removed, changed))
+
+        return added, removed, changed
+
+    def _on_routing_table_update(self, request):
+        t_start = time.time()
+        td_config = get_dict_of_all_test_cases_configurations()
+
+        if request.configuration_id not in td_config:
+            m = 'Unknown test configuration %s' % request.configuration_id
+            self.logger.error(m)
+            if self.shard_id in (None, 0):
+                self._publish_message(MsgErrorReply(request, ok=False, error_message=m))
+            return
+
+        testconfig = td_config[request.configuration_id]
+        routing_table = generate_routing_table_from_test_configuration(testconfig)
+        if self.shard_id is not None:
+            routing_table = partition_routing_table(routing_table, testconfig, self.shard_count,
+                                                    self.partition_by)[self.shard_id]
+
+        added, removed, changed = self.update_routing_table(routing_table)
+        self.logger.info('routing table of %s configured in %.3fs' % (request.configuration_id, time.time() - t_start))
+
+        if self.shard_id is None:
+            self._publish_message(MsgRoutingTableUpdateReply(
+                request,
+                component=self.component_id,
+                configuration_id=request.configuration_id,
+                added=added,
+                removed=removed,
+                changed=changed,
+            ))
+        elif self.shard_id == 0:
+            self._collect_shard_reply(request.correlation_id, 0, (added, removed, changed), request)
+        else:
+            self._publish_message(MsgRoutingShardTableUpdateReply(
+                shard=self.shard_id,
+                request_id=request.correlation_id,
+                configuration_id=request.configuration_id,
+                added=added,
+                removed=removed,
+                changed=changed,
+            ))
+
+    def _collect_shard_reply(self, request_id, shard, partial_reply, request=None):
+        """
+        Shard 0 replies to a request once all the shards replied to it (the request always reaches shard 0 before
+        the other shards' replies, both are queued in its services queue), or after SHARD_REPLIES_TIMEOUT.
+
+        :param partial_reply: shard's part of the reply, (added, removed, changed) for routing table updates and
+            the list of routes stats for stats requests
+        :param request: the request, when collecting shard 0's own reply
+        """
+        pending = self._pending_shard_replies.setdefault(request_id, {'request': None, 'replies': {}})
+        pending['replies'][shard] = partial_reply
+
+        if request is not None:
+            pending['request'] = request
+            self.connection.call_later(self.SHARD_REPLIES_TIMEOUT, lambda: self._reply_to_sharded_request(request_id))
+
+        if pending['request'] is not None and len(pending['replies']) == self.shard_count:
+            self._reply_to_sharded_request(request_id)
+
+    def _reply_to_sharded_request(self, request_id):
+        pending = self._pending_shard_replies.pop(request_id, None)
+        if pending is None:
+            return  # already replied
+
+        request = pending['request']
+        replies = [pending['replies'][shard] for shard in sorted(pending['replies'])]
+        missing = sorted(set(range(self.shard_count)) - set(pending['replies']))
+
+        if isinstance(request, MsgRoutingTableUpdate):
+            reply = MsgRoutingTableUpdateReply(
+                request,
+                component=COMPONENT_ID,
+                configuration_id=request.configuration_id,
+                added=sorted(k for added, _, _ in replies for k in added),
+                removed=sorted(k for _, removed, _ in replies for k in removed),
+                changed=sorted(k for _, _, changed in replies for k in changed),
+            )
+        elif isinstance(request, MsgRoutingStatsRequest):
+            # shards route disjoint sets of sources, so their routes are just put together
+            reply = MsgRoutingStatsReply(
+                request,
+                component=COMPONENT_ID,
+                timestamp=time.time(),
+                routes=[route for routes in replies for route in routes],
+            )
+        else:
+            self.logger.error('Unexpected sharded request %s' % repr(request))
+            return
+
+        if missing:
+            reply.ok = False
+            reply.error_message = 'No reply from router shard(s) %s' % missing
+            self.logger.error('%s to %s' % (reply.error_message, repr(request)))
+
+        self._publish_message(reply)
+
+    def _get_packet_timestamp(self, props, body):
+        """
+        :return: packet's timestamp (when sniffed by the agent), None if not available or packet not sampled
+        """
+        if props.headers and 'timestamp' in props.headers:
+            return props.headers['timestamp']
+
+        if self.message_count % self.LATENCY_SAMPLING == 0:
+            try:
+                return json.loads(body.decode('utf-8'))['timestamp']
+            except (ValueError, KeyError, TypeError, AttributeError):
+                pass
+
+        return None
+
+    def _publish_to_destinations(self, src_rkey, body, props, packet_timestamp=None):
+        list_dst_rkey = self.routing_table.get(src_rkey, [])
+        for dst_rkey in list_dst_rkey:
+            self._basic_publish(dst_rkey, body, props)
+
+        latency = time.time() - packet_timestamp if packet_timestamp else None
+        for dst_rkey in list_dst_rkey:
+            self.stats.record_forwarded(src_rkey, dst_rkey, len(body), latency)
+
+        self.logger.debug("Routing packet (%d) from topic: %s to topics: %s" % (self.message_count, src_rkey,
+                                                                                 list_dst_rkey))
+
+    def _route_packet(self, src_rkey, body, props, packet_timestamp=None):
+        """
+        Forwards packet to the destinations of src_rkey, going through the link impairments if any configured
+        """
+        link_impairment = self.link_impairments.get(src_rkey)
+        if link_impairment is None:
+            self._publish_to_destinations(src_rkey, body, props, packet_timestamp)
+            return
+
+        delays = link_impairment.process()
+        if not delays:
+            self.dropped_count += 1
+            self.stats.record_dropped(src_rkey)
+            self.logger.debug('Dropping packet from %s due to link impairments config' % src_rkey)
+            return
+
+        for delay in delays:
+            if delay:
+                expiry = self.timer_wheel.schedule(time.time(), delay, (src_rkey, body, props, packet_timestamp))
+                self._arm_timer_wheel(expiry)
+            else:
+                self._publish_to_destinations(src_rkey, body, props, packet_timestamp)
+
+    def _arm_timer_wheel(self, deadline):
+        """
+        Wakes up the consumer when the next delayed packet is due (instead of at every tick of the wheel)
+        """
+        if self._timer_wheel_timer is not None:
+            if deadline >= self._timer_wheel_deadline:
+                return
+            self.connection.remove_timeout(self._timer_wheel_timer)
+
+        self._timer_wheel_deadline = deadline
+        self._timer_wheel_timer = self.connection.call_later(max(0, deadline - time.time()),
+                                                             self._on_timer_wheel_tick)
+
+    def _on_timer_wheel_tick(self):
+        self._timer_wheel_timer = None
+        for src_rkey, body, props, packet_timestamp in self.timer_wheel.advance(time.time()):
+            self._publish_to_destinations(src_rkey, body, props, packet_timestamp)
+
+        if self.throughput_mode:
+            self._commit_batch()
+
+        if len(self.timer_wheel):
+            self._arm_timer_wheel(self.timer_wheel.next_expiry())
+
+    def _is_valid_packet(self, method, props, body):
+        try:
+            m = load_packet_message(method, props, body)
+        except Exception as e:
+            self.logger.error('Packet from %s could not be decoded: %s' % (method.routing_key, e))
+            return False
+
+        if not isinstance(m, MsgPacketSniffedRaw) or m.data is None or m.interface_name is None:
+            self.logger.error(
+                'wrong message format, <data> , <timestamp> and <interface_name> fields expected, got: {msg}'.
+                    format(msg=repr(m))
+            )
+            return False
+
+        return True
+
+    def _forward_packet(self, method, props, body):
+        """
+        Fast path for packets coming from a known source: only the routing key is rewritten, body and properties
+        (content type, headers) are forwarded untouched. Packets are (optionally) validated 1 out of
+        packet_validation_sampling times.
+        """
+        src_rkey = method.routing_key
+
+        self.message_count += 1
+        if self._drop_packet_if_lossy_link(src_rkey):
+            return
+
+        if self.packet_validation_sampling and self.message_count % self.packet_validation_sampling == 0:
+            if not self._is_valid_packet(method, props, body):
+                return
+
+        self._route_packet(src_rkey, body, props, self._get_packet_timestamp(props, body))
+
+    def _commit_batch(self):
+        """
+        Throughput mode: waits for the broker to confirm the packets forwarded since last commit, then acks
+        (multiple) all messages consumed since last commit
+        """
+        if self._batch_timer is not None:
+            self.connection.remove_timeout(self._batch_timer)
+            self._batch_timer = None
+
+        self._wait_for_publish_confirms()
+
+        if self._batch_len:
+            self.channel.basic_ack(delivery_tag=self._batch_last_delivery_tag, multiple=True)
+            self._batch_len = 0
+
+    def _on_batch_timeout(self):
+        self._batch_timer = None
+        self._commit_batch()
+
+    def _log_stats(self):
+        received = self.message_count - self._stats_last_message_count
+        dropped = self.dropped_count - self._stats_last_dropped_count
+
+        if received:
+            self.logger.info(
+                'Routed %d packet(s) in last %ss (%.1f packets/s), dropped %d. Total packets received: %d' %
+                (received - dropped, self.STATS_LOG_INTERVAL, received / self.STATS_LOG_INTERVAL, dropped,
+                 self.message_count)
+            )
+
+        self._stats_last_message_count = self.message_count
+        self._stats_last_dropped_count = self.dropped_count
+
+        if self.stats.routes:
+            self._publish_message(MsgRoutingStats(
+                component=self.component_id,
+                timestamp=time.time(),
+                routes=self.stats.to_list(),
+            ))
+
+        self.connection.call_later(self.STATS_LOG_INTERVAL, self._log_stats)
+
+    def _record_overflow(self, props):
+        """
+        Data plane messages dropped by the broker (queue max length reached) are dead-lettered to the router's
+        overflow queue, x-death header keeps the original routing key
+        """
+        try:
+            src_rkey = props.headers['x-death'][0]['routing-keys'][0]
+        except (KeyError, IndexError, TypeError):
+            self.logger.warning('Overflow event without x-death information: %s' % props.headers)
+            return
+
+        if isinstance(src_rkey, bytes):
+            src_rkey = src_rkey.decode('utf-8')
+
+        self.stats.record_overflow(src_rkey)
+        self.logger.debug('Data plane queue overflow, packet from %s lost' % src_rkey)
+
+    def _publish_message(self, message):
+        self._basic_publish(message.routing_key, message.to_json(), pika.BasicProperties(**message.get_properties()))
+
     def _on_request(self, ch, method, props, body):
 
-        # ack message received
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+        if not self.throughput_mode:
+            # ack message received
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            self._handle_message(method, props, body)
+            return
+
+        self._handle_message(method, props, body)
+
+        # acked later on, together with the rest of the batch
+        self._batch_last_delivery_tag = method.delivery_tag
+        self._batch_len += 1
+        if self._batch_len >= self.THROUGHPUT_MODE_BATCH_SIZE:
+            self._commit_batch()
+        elif self._batch_timer is None:
+            self._batch_timer = self.connection.call_later(self.THROUGHPUT_MODE_BATCH_TIMEOUT, self._on_batch_timeout)
+
+    def _handle_message(self, method, props, body):
+
+        # packets which don't need re-encoding go through the fast path
+        if method.routing_key in self.routing_table and \
+                (self.packet_encoding is None or self.packet_encoding == get_packet_encoding(props)):
+            self._forward_packet(method, props, body)
+            return
+
+        if method.routing_key == self.overflow_queue:
+            self._record_overflow(props)
+            return
+
+        if method.routing_key not in self.routing_table and not method.routing_key.startswith('routing.'):
+            # e.g. packets from agents which are not part of the topology, or agents' non packet messages
+            self.logger.debug('No known route for r_key source: %s' % method.routing_key)
+            return
 
-        self.logger.info('Identifying request with rkey: %s' % method.routing_key)
+        self.logger.debug('Identifying request with rkey: %s' % method.routing_key)
 
         try:
-            msg_received = Message.load_from_pika(method, props, body)
-            print(msg_received.routing_key)
+            msg_received = load_packet_message(method, props, body)
         except Exception as e:
             self.logger.info(str(e))
             return
@@ -141,12 +717,7 @@ class PacketRouter(threading.Thread):
         if isinstance(msg_received, MsgPacketSniffedRaw):
 
             self.message_count += 1
-            if self.pending_number_of_packets_to_drop > 0:
-                self.pending_number_of_packets_to_drop -= 1
-                self.logger.info(
-                    'Dropping packet due to lossy link config. Pending packets to drop: %s' %
-                    self.pending_number_of_packets_to_drop
-                )
+            if self._drop_packet_if_lossy_link(msg_received.routing_key):
                 return
 
             # let's route the message to the right agent
@@ -164,33 +735,47 @@ class PacketRouter(threading.Thread):
                 return
 
             src_rkey = msg_received.routing_key
-            json_to_send = msg_to_send.to_json()
-            if src_rkey in self.routing_table.keys():
-                list_dst_rkey = self.routing_table[src_rkey]
-                for dst_rkey in list_dst_rkey:
-                    # forward to dst_rkey
-                    self.channel.basic_publish(
-                        body=json_to_send,
-                        routing_key=dst_rkey,
-                        exchange=self.exchange_name,
-                        properties=pika.BasicProperties(
-                            content_type='application/json',
-                        )
-                    )
-
-                    self.logger.info(
-                        "Routing packet (%d) from topic: %s to topic: %s" % (self.message_count, src_rkey, dst_rkey))
-
-            elif 'toAgent' in src_rkey:
-                pass  # this is probably a message echo'ed from a message sent by this same component
+            body_to_send, props_to_send = encode_packet_message(
+                msg_to_send,
+                self.packet_encoding or get_packet_encoding(props)
+            )
+            self._route_packet(src_rkey, body_to_send, props_to_send, msg_received.timestamp)
 
+        elif isinstance(msg_received, MsgRoutingStartLossyLink):
+            self._configure_lossy_link(msg_received)
+
+        elif isinstance(msg_received, MsgRoutingStatsRequest):
+            if self.shard_id is None:
+                self._publish_message(MsgRoutingStatsReply(
+                    msg_received,
+                    component=self.component_id,
+                    timestamp=time.time(),
+                    routes=self.stats.to_list(),
+                ))
+            elif self.shard_id == 0:
+                self._collect_shard_reply(msg_received.correlation_id, 0, self.stats.to_list(), msg_received)
             else:
-                self.logger.warning('No known route for r_key source: {r_key}'.format(r_key=src_rkey))
-                return
+                self._publish_message(MsgRoutingShardStatsReply(
+                    shard=self.shard_id,
+                    request_id=msg_received.correlation_id,
+                    routes=self.stats.to_list(),
+                ))
+
+        elif isinstance(msg_received, MsgRoutingShardStatsReply):
+            if self.shard_id == 0:
+                self._collect_shard_reply(msg_received.request_id, msg_received.shard, msg_received.routes)
+
+        elif isinstance(msg_received, MsgRoutingTableUpdate):
+            self._on_routing_table_update(msg_received)
+
+        elif isinstance(msg_received, MsgRoutingShardTableUpdateReply):
+            if self.shard_id == 0:
+                self._collect_shard_reply(msg_received.request_id, msg_received.shard,
+                                          (msg_received.added, msg_received.removed, msg_received.changed))
+
+        elif isinstance(msg_received, (MsgRoutingStats, MsgRoutingStatsReply, MsgRoutingTableUpdateReply)):
+            pass  # published by this (or another) router
 
-        elif isinstance(msg_received, MsgRoutingStartLossyLink):
-            self.pending_number_of_packets_to_drop = msg_received.number_of_packets_to_drop
-            self.logger.info("Packet router configured to drop %s packet(s)" % self.pending_number_of_packets_to_drop)
         else:
             self.logger.warning("Message ignored %s" % repr(msg_received))
 
@@ -198,20 +783,13 @@ class PacketRouter(threading.Thread):
 
         # FINISHING... let's send a goodbye message
         msg = MsgTestingToolComponentShutdown(
-            component=COMPONENT_ID,
-            description="%s is out!. Bye!" % COMPONENT_ID
-        )
-
-        self.channel.basic_publish(
-            body=msg.to_json(),
-            routing_key=msg.routing_key,
-            exchange=self.exchange_name,
-            properties=pika.BasicProperties(
-                content_type='application/json',
-            )
+            component=self.component_id,
+            description="%s is out!. Bye!" % self.component_id
         )
+        self._publish_message(msg)
 
     def run(self):
+        self.connection.call_later(self.STATS_LOG_INTERVAL, self._log_stats)
         self.channel.start_consuming()
         self._notify_component_shutdown()
 
@@ -282,17 +860,127 @@ def generate_routing_table_from_test_configuration(testconfig: TestConfig):
     return routing_table
 
 
+def _get_source_node(src_rkey):
+    """
+    fromAgent.coap_client.ip.tun.packet.raw -> coap_client
+    data.serial.fromAgent.coap_client -> coap_client
+    """
+    rkey_words = src_rkey.split('.')
+    return rkey_words[rkey_words.index('fromAgent') + 1]
+
+
+def partition_routing_table(routing_table, testconfig: TestConfig, shards, partition_by='link'):
+    """
+    Partitions routing table into N sub-tables, so routing can be distributed across several routers.
+    All routes of a source routing key end up in the same partition, this way each source's packets are still
+    consumed by only one router, and forwarded in order. Partitions are indexed by shard, so routing tables of
+    different configurations are partitioned consistently (some partitions may be empty).
+
+    :param routing_table: as generated by generate_routing_table_from_test_configuration
+    :param testconfig: configuration the routing table was generated from
+    :param shards: max number of partitions
+    :param partition_by: 'link' (all sources of a link's nodes are routed together) or 'node'
+    :return: list of N routing tables
+    """
+    assert shards > 0
+    assert partition_by in ('link', 'node')
+
+    # group source nodes, nodes shared by several links (e.g. agent_TT) are kept with the first one
+    groups = []
+    if partition_by == 'link':
+        grouped_nodes = set()
+        for link in testconfig.topology:
+            group = [n for n in link['nodes'] if n not in grouped_nodes]
+            grouped_nodes.update(group)
+            groups.append(group)
+    else:
+        groups = [[n] for n in testconfig.nodes]
+
+    node_to_shard = {}
+    for i, group in enumerate(groups):
+        for node in group:
+            node_to_shard[node] = i % shards
+
+    partitions = [dict() for _ in range(shards)]
+    for src_rkey, dst_rkey_list in routing_table.items():
+        # sources outside the testconfig nodes (agent_TT) go with the first partition
+        partitions[node_to_shard.get(_get_source_node(src_rkey), 0)][src_rkey] = dst_rkey_list
+
+    return partitions
+
+
+def _run_router_worker(amqp_url, amqp_exchange, routing_table, shard_id, router_kwargs):
+    r = PacketRouter(amqp_url, amqp_exchange, routing_table, shard_id=shard_id, **router_kwargs)
+    try:
+        r.run()
+    except (KeyboardInterrupt, SystemExit):
+        r.stop()
+
+
+def run_sharded_routers(amqp_url, amqp_exchange, routing_tables, **router_kwargs):
+    """
+    Runs one router process (with its own AMQP connection) per routing table partition, and waits for them
+    """
+    router_kwargs['shard_count'] = len(routing_tables)
+
+    workers = []
+    for shard_id, routing_table in enumerate(routing_tables):
+        p = multiprocessing.Process(
+            target=_run_router_worker,
+            name='process_%s_%s' % (COMPONENT_ID, shard_id),
+            args=(amqp_url, amqp_exchange, routing_table, shard_id, router_kwargs)
+        )
+        p.start()
+        logging.info('Router worker %s started (pid %s), routes: %s' % (shard_id, p.pid, list(routing_table)))
+        workers.append(p)
+
+    try:
+        for p in workers:
+            p.join()
+    except (KeyboardInterrupt, SystemExit):
+        logging.info('got SIGINT. Waiting for router workers to finish..')  # workers get SIGINT too
+        for p in workers:
+            p.join()
+
+
 def main():
     td_config = get_dict_of_all_test_cases_configurations()
 
-    assert len(td_config) > 0, 'No test case configuration files found!'
-
     try:
         parser = argparse.ArgumentParser()
         parser.add_argument(
             "td_configuration_id",
             help="Test case configuration ID as indicated in yaml file",
-            choices=list(td_config)
+        )
+        parser.add_argument(
+            "--packet-encoding",
+            help="Encoding for the forwarded packets, by default packets keep the encoding used by the source agent",
+            choices=PACKET_ENCODINGS,
+            default=None
+        )
+        parser.add_argument(
+            "--validate-packets",
+            help="Validate the format of 1 out of N routed packets (0 disables validation)",
+            type=int,
+            default=0
+        )
+        parser.add_argument(
+            "--throughput-mode",
+            help="Consume packets with a large prefetch window and ack/forward them in batches (bursty traffic)",
+            action='store_true',
+            default=False
+        )
+        parser.add_argument(
+            "--workers",
+            help="Number of router processes the routing table is partitioned into",
+            type=int,
+            default=1
+        )
+        parser.add_argument(
+            "--partition-by",
+            help="How routes are distributed across router processes (--workers), per source routes are never split",
+            choices=['link', 'node'],
+            default='link'
         )
 
         args = parser.parse_args()
@@ -300,11 +988,28 @@ def main():
     except Exception as e:
         print(e)
 
-    testcase_config = td_config[args.td_configuration_id]
+    # only the test suite of the configuration gets loaded
+    try:
+        testcase_config = td_config[args.td_configuration_id]
+    except KeyError:
+        logging.error('Test case configuration %s not found in the test descriptions' % args.td_configuration_id)
+        sys.exit(1)
     agents_routing_table = generate_routing_table_from_test_configuration(testcase_config)
 
+    router_kwargs = {
+        'packet_encoding': args.packet_encoding,
+        'packet_validation_sampling': args.validate_packets,
+        'throughput_mode': args.throughput_mode,
+    }
+
+    if args.workers > 1:
+        routing_tables = partition_routing_table(agents_routing_table, testcase_config, args.workers,
+                                                 args.partition_by)
+        run_sharded_routers(AMQP_URL, AMQP_EXCHANGE, routing_tables, partition_by=args.partition_by, **router_kwargs)
+        return
+
     # start amqp router thread
-    r = PacketRouter(AMQP_URL, AMQP_EXCHANGE, agents_routing_table)
+    r = PacketRouter(AMQP_URL, AMQP_EXCHANGE, agents_routing_table, **router_kwargs)
     try:
         r.start()
         r.join()
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/env python3
+
+"""
+Link impairments applied by the packet router (lossy context test cases).
+
+Each impaired link gets a LinkImpairment which decides, for every packet, whether it is dropped, delayed,
+duplicated or reordered (netem-like semantics: a reordered packet skips the configured delay, so it overtakes the
+packets sent just before it, reorder is thus refused on links without delay nor jitter). Delayed packets are stored
+in a TimerWheel, which the router's consumer thread advances from a pika timer armed for the next expiry, so the
+consumer never sleeps while packets are in flight.
+
+Impairments are configured in the test configuration yaml file, per link:
+
+    topology:
+      - link_id : link_01
+        special_mode : lossy_context
+        impairments:
+          loss: 10           # percentage of packets dropped
+          delay: 0.05        # seconds
+          jitter: 0.02       # seconds, delay varies uniformly within [delay - jitter, delay + jitter]
+          duplication: 5     # percentage of packets forwarded twice
+          reorder: 5         # percentage of packets forwarded without delay (needs delay or jitter)
+        nodes:
+          - coap_client
+          - coap_server
+"""
+
+import random
+from collections import deque
+
+IMPAIRMENT_PARAMETERS = ('loss', 'delay', 'jitter', 'duplication', 'reorder')
+
+
+class LinkImpairment:
+    """
+    Impairment pipeline of a link: drop next N packets (legacy lossy context), loss, duplication, reorder, delay
+    """
+
+    def __init__(self, loss=0, delay=0, jitter=0, duplication=0, reorder=0, drop_next=0, rand=None):
+        """
+        :param loss: percentage of packets dropped
+        :param delay: seconds each packet is delayed
+        :param jitter: seconds, delay of each packet is uniformly distributed within [delay - jitter, delay + jitter]
+        :param duplication: percentage of packets forwarded twice
+        :param reorder: percentage of packets forwarded right away instead of being delayed (needs delay or jitter)
+        :param drop_next: number of packets to drop (deterministically) before applying the rest of impairments
+        :param rand: random.Random instance (for reproducible tests)
+        """
+        for p in (loss, duplication, reorder):
+            assert 0 <= p <= 100, 'percentages must be within [0, 100]'
+        assert delay >= 0 and jitter >= 0
+        assert not reorder or delay or jitter, 'reorder needs a delay or jitter, packets would not be reordered'
+
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.duplication = duplication
+        self.reorder = reorder
+        self.drop_next = drop_next
+        self.rand = rand or random.Random()
+
+    @classmethod
+    def from_dict(cls, d, drop_next=0):
+        unknown = set(d) - set(IMPAIRMENT_PARAMETERS)
+        if unknown:
+            raise ValueError('Unknown link impairment parameter(s) %s, expected %s' % (unknown, IMPAIRMENT_PARAMETERS))
+        return cls(drop_next=drop_next, **d)
+
+    def to_dict(self):
+        return {p: getattr(self, p) for p in IMPAIRMENT_PARAMETERS}
+
+    def _chance(self, percentage):
+        return percentage > 0 and self.rand.random() * 100 < percentage
+
+    def _get_delay(self):
+        if self.jitter:
+            return max(0, self.delay + self.rand.uniform(-self.jitter, self.jitter))
+        return self.delay
+
+    def process(self):
+        """
+        :return: list of delays (in seconds) with which the packet needs to be forwarded, empty list if dropped
+        """
+        if self.drop_next > 0:
+            self.drop_next -= 1
+            return []
+
+        if self._chance(self.loss):
+            return []
+
+        copies = 2 if self._chance(self.duplication) else 1
+
+        if self._chance(self.reorder):
+            return [0] * copies
+
+        return [self._get_delay() for _ in range(copies)]
+
+
+class TimerWheel:
+    """
+    Hashed timing wheel: O(1) schedule, expired items are collected by advancing the wheel up to the current time.
+    Items due within the same tick are returned in the order they were scheduled.
+    """
+
+    def __init__(self, tick=0.001, slots=1024):
+        assert tick > 0 and slots > 0
+
+        self.tick = tick
+        self.slots = [deque() for _ in range(slots)]
+        self.current_tick = None
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def _to_tick(self, t):
+        return int(t / self.tick)
+
+    def schedule(self, now, delay, item):
+        """
+        Schedules item to expire `delay` seconds after `now`
+        :return: time at which the item expires
+        """
+        if self.current_tick is None:
+            self.current_tick = self._to_tick(now)
+
+        # an item never expires within the tick it was scheduled in (it'd be missed by advance())
+        expiry_tick = max(self._to_tick(now + delay), self.current_tick + 1)
+        self.slots[expiry_tick % len(self.slots)].append((expiry_tick, item))
+        self._len += 1
+        return expiry_tick * self.tick
+
+    def advance(self, now):
+        """
+        :return: list of items which expired up to `now`
+        """
+        if self.current_tick is None or not self._len:
+            self.current_tick = self._to_tick(now)
+            return []
+
+        target_tick = self._to_tick(now)
+        expired = []
+
+        # beyond one full turn every slot gets visited once
+        for t in range(self.current_tick + 1, min(target_tick, self.current_tick + len(self.slots)) + 1):
+            slot = self.slots[t % len(self.slots)]
+            if not slot:
+                continue
+
+            pending = deque()
+            while slot:
+                expiry_tick, item = slot.popleft()
+                if expiry_tick <= target_tick:
+                    expired.append((expiry_tick, item))
+                else:
+                    pending.append((expiry_tick, item))  # expires on a later turn of the wheel
+            self.slots[t % len(self.slots)] = pending
+
+        self.current_tick = max(self.current_tick, target_tick)
+        self._len -= len(expired)
+
+        # sort is stable, so same tick items keep their scheduling order
+        expired.sort(key=lambda e: e[0])
+        return [item for _, item in expired]
+
+    def next_expiry(self):
+        """
+        :return: time at which the earliest scheduled item expires, None if the wheel is empty
+        """
+        if not self._len:
+            return None
+
+        for t in range(self.current_tick + 1, self.current_tick + len(self.slots) + 1):
+            if any(expiry_tick == t for expiry_tick, _ in self.slots[t % len(self.slots)]):
+                return t * self.tick
+
+        # all items expire on later turns of the wheel
+        return min(expiry_tick for slot in self.slots for expiry_tick, _ in slot) * self.tick
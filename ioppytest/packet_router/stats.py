@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/env python3
+
+"""
+Per route (src_rkey -> dst_rkey) counters and forwarding latency histograms of the packet router.
+
+Forwarding latency goes from the packet's timestamp (set by the source agent when sniffing it) to the moment the
+router publishes it into the destination topic, so it includes broker queueing and delays added by link impairments
+(and the clock offset between agent and router when they run on different hosts).
+"""
+
+import bisect
+
+# upper bounds (seconds) of the latency histogram buckets, last bucket (+inf) catches the rest
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+
+class LatencyHistogram:
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def record(self, latency):
+        self.counts[bisect.bisect_left(self.bounds, latency)] += 1
+        self.count += 1
+        self.sum += latency
+        self.max = max(self.max, latency)
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+            'buckets': [[b, c] for b, c in zip(list(self.bounds) + ['+inf'], self.counts)],
+        }
+
+
+class RouteStats:
+
+    def __init__(self):
+        self.packets = 0
+        self.bytes = 0
+        self.drops = 0
+        self.overflows = 0
+        self.latency = LatencyHistogram()
+
+    def to_dict(self):
+        return {
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'drops': self.drops,
+            'overflows': self.overflows,
+            'latency': self.latency.to_dict(),
+        }
+
+
+class RoutingStats:
+    """
+    Stats of all routes of a routing table
+    """
+
+    def __init__(self, routing_table):
+        self.routing_table = routing_table
+        self.routes = {}
+
+    def _get(self, src_rkey, dst_rkey):
+        try:
+            return self.routes[(src_rkey, dst_rkey)]
+        except KeyError:
+            route = self.routes[(src_rkey, dst_rkey)] = RouteStats()
+            return route
+
+    def record_forwarded(self, src_rkey, dst_rkey, size, latency=None):
+        route = self._get(src_rkey, dst_rkey)
+        route.packets += 1
+        route.bytes += size
+        if latency is not None:
+            route.latency.record(max(0, latency))
+
+    def record_dropped(self, src_rkey):
+        for dst_rkey in self.routing_table.get(src_rkey, []):
+            self._get(src_rkey, dst_rkey).drops += 1
+
+    def record_overflow(self, src_rkey, count=1):
+        for dst_rkey in self.routing_table.get(src_rkey, []):
+            self._get(src_rkey, dst_rkey).overflows += count
+
+    def to_list(self):
+        ret = []
+        for (src_rkey, dst_rkey), route in sorted(self.routes.items()):
+            d = {'src': src_rkey, 'dst': dst_rkey}
+            d.update(route.to_dict())
+            ret.append(d)
+        return ret
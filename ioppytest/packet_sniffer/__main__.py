@@ -1,26 +1,51 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import io
 import base64
 import errno
 import argparse
 import os
 import sys
 import pika
-import signal
 import logging
 import traceback
-import multiprocessing
-from datetime import time
 
 import pure_pcapy
 from messages import *
 from event_bus_utils import (
     publish_message,
-    packet_dumper,
     rmq_handler,
 )
 
 from ioppytest import TMPDIR, DATADIR, LOGDIR, AMQP_URL, AMQP_EXCHANGE, LOG_LEVEL, LOGGER_FORMAT
+from ioppytest.packet_encoding import load_packet_message
+from ioppytest.packet_sniffer.capture_worker import CaptureWorker
+from ioppytest.packet_sniffer.ring_buffer import CaptureRingBuffer
+from ioppytest.packet_sniffer.capture_index import slice_capture
+from ioppytest.packet_sniffer.capture_compression import (
+    get_requested_compression,
+    get_file_enc,
+    encode_capture,
+    new_compressor,
+)
+from ioppytest.packet_sniffer.capture_transfer import (
+    CHECKSUM_ALGORITHM,
+    get_chunk_size,
+    read_chunk,
+    iter_chunks,
+    new_checksum,
+)
+from ioppytest.messages_extensions import (
+    MsgSniffingGetCaptureChunk,
+    MsgSniffingGetCaptureChunkReply,
+    MsgSniffingStreamCapture,
+    MsgSniffingStreamCaptureReply,
+    MsgSniffingCaptureChunk,
+    MsgSniffingExtractCapture,
+    MsgSniffingExtractCaptureReply,
+    MsgSniffingGetCaptureSlice,
+    MsgSniffingGetCaptureSliceReply,
+)
 
 
 logging.basicConfig(
@@ -30,9 +55,6 @@ logging.basicConfig(
 
 logging.getLogger('pika').setLevel(logging.WARNING)
 
-# in seconds
-TIME_WAIT_FOR_COMPONENTS_FINISH_EXECUTION = 2
-
 # generate dirs
 for d in TMPDIR, DATADIR, LOGDIR:
     try:
@@ -44,14 +66,17 @@ for d in TMPDIR, DATADIR, LOGDIR:
 
 class Sniffer:
     DEFAULT_TOPICS = [
-        'fromAgent.#',
-        'sniffing.#',
+        'sniffing.*.request',  # replies & streamed capture chunks are not for the sniffer
     ]
 
-    def __init__(self, traffic_dlt, amqp_url, amqp_exchange):
+    def __init__(self, traffic_dlt, amqp_url, amqp_exchange, ring_buffer=None):
+        """
+        :param ring_buffer: CaptureRingBuffer keeping all frames of the data plane, see MsgSniffingExtractCapture
+        """
         self.traffic_dlt = traffic_dlt
+        self.ring_buffer = ring_buffer
         self.last_capture_name = None
-        self.pcap_dumper_subprocess = None
+        self.capture_worker = None
         self.connection = None
 
         self.exchange = amqp_exchange
@@ -88,10 +113,125 @@ class Sniffer:
                 self.channel.basic_qos(prefetch_count=1)
                 self.channel.basic_consume(on_message_callback=self.on_request, queue='services_queue@%s' % self.COMPONENT_ID)
 
+            # data plane packets are consumed by the capture worker, subscribed for the whole sniffer's lifetime
+            self.capture_worker = CaptureWorker(self.url, self.exchange, self.traffic_dlt, TMPDIR,
+                                                ring_buffer=self.ring_buffer)
+
         except pika.exceptions.ConnectionClosed:
             self.logger.error(' AMQP cannot be established, is message broker up? \n More: %s' % traceback.format_exc())
             sys.exit(1)
 
+    def _publish(self, message):
+        """
+        Publishes using the sniffer's channel, so messages (e.g. streamed chunks and the final reply) keep their order
+        """
+        self.channel.basic_publish(
+            body=message.to_json(),
+            routing_key=message.routing_key,
+            exchange=self.exchange,
+            properties=pika.BasicProperties(**message.get_properties())
+        )
+
+    def _send_capture_chunk(self, request):
+        filename = '%s.pcap' % request.capture_id
+        full_path = os.path.join(TMPDIR, filename)
+
+        try:
+            total_size = os.path.getsize(full_path)
+            data = read_chunk(full_path, request.offset, get_chunk_size(request.length))
+        except (OSError, ValueError, TypeError) as e:
+            self.logger.warning('Couldnt read chunk of capture %s: %s' % (request.capture_id, e))
+            self._publish(MsgErrorReply(request, ok=False, error_message=str(e)))
+            return
+
+        self._publish(MsgSniffingGetCaptureChunkReply(
+            request,
+            ok=True,
+            filename=filename,
+            offset=request.offset,
+            total_size=total_size,
+            eof=request.offset + len(data) >= total_size,
+            value=base64.b64encode(data).decode('utf-8'),
+        ))
+
+    def _stream_capture(self, request):
+        filename = '%s.pcap' % request.capture_id
+        full_path = os.path.join(TMPDIR, filename)
+
+        checksum = new_checksum()
+        total_size = 0
+        chunks = 0
+
+        def send_chunk(data):
+            nonlocal total_size, chunks
+            self._publish(MsgSniffingCaptureChunk(
+                stream_id=request.correlation_id,
+                capture_id=request.capture_id,
+                sequence_number=chunks,
+                offset=total_size,
+                file_enc=file_enc,
+                value=base64.b64encode(data).decode('utf-8'),
+            ))
+            checksum.update(data)
+            total_size += len(data)
+            chunks += 1
+
+        try:
+            compression = get_requested_compression(request)
+            file_enc = get_file_enc(compression)
+            compressor = new_compressor(compression)
+            for _, data in iter_chunks(full_path, get_chunk_size(request.chunk_size)):
+                data = compressor.compress(data)
+                if data:
+                    send_chunk(data)
+            data = compressor.flush()
+            if data:
+                send_chunk(data)
+        except (OSError, ValueError) as e:
+            self.logger.warning('Couldnt stream capture %s: %s' % (request.capture_id, e))
+            self._publish(MsgErrorReply(request, ok=False, error_message=str(e)))
+            return
+
+        self.logger.info('Capture %s streamed (%s bytes, %s chunks, %s)' %
+                         (request.capture_id, total_size, chunks, file_enc))
+        self._publish(MsgSniffingStreamCaptureReply(
+            request,
+            ok=True,
+            file_enc=file_enc,
+            filename=filename,
+            total_size=total_size,
+            chunks=chunks,
+            checksum_algorithm=CHECKSUM_ALGORITHM,
+            checksum=checksum.hexdigest(),
+        ))
+
+    def _send_capture_slice(self, request):
+        filename = '%s.pcap' % request.capture_id
+        full_path = os.path.join(TMPDIR, filename)
+
+        f = io.BytesIO()
+        try:
+            compression = get_requested_compression(request)
+            frames = slice_capture(full_path, f,
+                                   t_start=getattr(request, 't_start', None),
+                                   t_end=getattr(request, 't_end', None),
+                                   agents=getattr(request, 'agents', None),
+                                   link=getattr(request, 'link_id', None))
+        except (OSError, ValueError) as e:
+            self.logger.warning('Couldnt slice capture %s: %s' % (request.capture_id, e))
+            self._publish(MsgErrorReply(request, ok=False, error_message=str(e)))
+            return
+
+        file_enc, value = encode_capture(f.getvalue(), compression)
+        self._publish(MsgSniffingGetCaptureSliceReply(
+            request,
+            ok=True,
+            file_enc=file_enc,
+            filename=filename,
+            frames=frames,
+            value=value,
+        ))
+
     def on_request(self, ch, method, props, body):
         # ack message received
         ch.basic_ack(delivery_tag=method.delivery_tag)
@@ -99,12 +239,45 @@ class Sniffer:
         self.logger.info('Identifying request with rkey: %s' % method.routing_key)
 
         try:
-            request = Message.load_from_pika(method, props, body)
+            request = load_packet_message(method, props, body)
         except Exception as e:
             self.logger.info(str(e))
             return
 
-        if isinstance(request, MsgSniffingGetCaptureLast):
+        if isinstance(request, MsgSniffingGetCaptureChunk):
+            self.logger.debug('HANDLING request: %s' % repr(request))
+            self._send_capture_chunk(request)
+
+        elif isinstance(request, MsgSniffingStreamCapture):
+            self.logger.debug('HANDLING request: %s' % repr(request))
+            self._stream_capture(request)
+
+        elif isinstance(request, MsgSniffingGetCaptureSlice):
+            self.logger.debug('HANDLING request: %s' % repr(request))
+            self._send_capture_slice(request)
+
+        elif isinstance(request, MsgSniffingExtractCapture):
+            self.logger.debug('HANDLING request: %s' % repr(request))
+
+            try:
+                frames, oldest_timestamp = self.capture_worker.extract_capture(
+                    request.capture_id, request.t_start, request.t_end, getattr(request, 'nodes', None))
+            except Exception as e:
+                m = 'Couldnt extract capture %s: %s' % (request.capture_id, e)
+                self.logger.warning(m)
+                self._publish(MsgErrorReply(request, ok=False, error_message=m))
+                return
+
+            self.last_capture_name = request.capture_id
+            self._publish(MsgSniffingExtractCaptureReply(
+                request,
+                ok=True,
+                filename='%s.pcap' % request.capture_id,
+                frames=frames,
+                oldest_timestamp=oldest_timestamp,
+            ))
+
+        elif isinstance(request, MsgSniffingGetCaptureLast):
             self.logger.debug('HANDLING request: %s' % repr(request))
 
             if self.last_capture_name:
@@ -139,13 +312,14 @@ class Sniffer:
                 try:
                     # do not dump into PCAP_DIR, coordinator puts the PCAPS there
                     with open(TMPDIR + "/%s.pcap" % capture_id, "rb") as file:
-                        enc = base64.b64encode(file.read())
+                        file_enc, value = encode_capture(file.read(), get_requested_compression(request))
 
                     response = MsgSniffingGetCaptureLastReply(
                         request,
                         ok=True,
+                        file_enc=file_enc,
                         filename='%s.pcap' % capture_id,
-                        value=enc.decode("utf-8")
+                        value=value
                     )
                 except Exception as e:
                     err_mess = str(e)
@@ -169,6 +343,12 @@ class Sniffer:
 
             self.logger.debug('HANDLING request: %s' % repr(request))
 
+            try:
+                compression = get_requested_compression(request)
+            except ValueError as e:
+                publish_message(self.connection, MsgErrorReply(request, error_message=str(e)))
+                return
+
             try:
                 capture_id = request.capture_id
                 filename = "{0}.pcap".format(capture_id)
@@ -196,13 +376,14 @@ class Sniffer:
 
             # do not dump into PCAP_DIR, coordinator puts the PCAPS there
             with open(full_path, "rb") as file:
-                enc = base64.b64encode(file.read())
+                file_enc, value = encode_capture(file.read(), compression)
 
             response = MsgSniffingGetCaptureReply(
                 request,
                 ok=True,
+                file_enc=file_enc,
                 filename="{0}.pcap".format(capture_id),
-                value=enc.decode("utf-8")
+                value=value
 
             )
 
@@ -223,27 +404,20 @@ class Sniffer:
                 self.logger.info(err_mess)
                 return
 
-            try:
-                # start process for sniffing packets
-                if self.pcap_dumper_subprocess is not None:
-                    m = "Sniffer process is already running, please stop before if you meant to restart it"
-                    response = MsgErrorReply(request, ok=False, error_message=m)
-                    self.logger.info(m)
+            # one capture per (capture_id, link_id) may be ongoing, links of a same capture run concurrently
+            link_id = getattr(request, 'link_id', None)
+            nodes = getattr(request, 'nodes', None)
 
-                else:
-                    self.pcap_dumper_subprocess = multiprocessing.Process(
-                        target=packet_dumper.launch_amqp_data_to_pcap_dumper,
-                        name='process_%s_%s' % (self.COMPONENT_ID, capture_id),
-                        args=(
-                            TMPDIR, LOG_LEVEL, filename, self.traffic_dlt, self.url, self.exchange,
-                            self.DEFAULT_TOPICS))
-                    self.pcap_dumper_subprocess.start()
-                    self.logger.info("Sniffer process started %s, pid %s" % (
-                        self.pcap_dumper_subprocess, self.pcap_dumper_subprocess.pid))
-                    response = MsgSniffingStartReply(request, ok=True)
+            try:
+                # filters are compiled once here, and evaluated on ingest (non matching packets aren't written)
+                self.capture_worker.start_capture(capture_id, link_id, nodes,
+                                                  filter_proto=getattr(request, 'filter_proto', None),
+                                                  filter_if=getattr(request, 'filter_if', None))
+                self.logger.info("Capture %s started (link: %s)" % (capture_id, link_id))
+                response = MsgSniffingStartReply(request, ok=True)
 
             except Exception as e:
-                m = 'Didnt succeed starting the sniffer process, the exception captured is %s' % str(e)
+                m = 'Didnt succeed starting the capture, the exception captured is %s' % str(e)
                 self.logger.error(m)
                 response = MsgErrorReply(request, ok=False, error_message=m)
 
@@ -254,25 +428,19 @@ class Sniffer:
 
         elif isinstance(request, MsgSniffingStop):
 
-            if self.pcap_dumper_subprocess is None:
-                self.logger.info("Sniffer process not running")
-                response = MsgSniffingStopReply(request, ok=True)
-            else:
-                try:  # the process stops on it's own, we just verify it is stopped
-                    time.sleep(TIME_WAIT_FOR_COMPONENTS_FINISH_EXECUTION)  # to avoid race conditions
-
-                    if self.pcap_dumper_subprocess.is_alive():
-                        response = MsgSniffingStopReply(request, ok=False)
-                        self.logger.info("Sniffer process couldnt be stopped")
-                    else:
-                        response = MsgSniffingStopReply(request, ok=True)
-                        self.logger.info("Sniffer process stopped correctly")
-                        self.pcap_dumper_subprocess = None
-
-                except:
-                    m = "Sniffer process couldnt be stopped"
-                    self.logger.error(m)
-                    response = MsgErrorReply(request, ok=False, error_message=m)
+            try:  # replies as soon as the capture worker has flushed and closed the files
+                frames = self.capture_worker.stop_capture(getattr(request, 'capture_id', None),
+                                                          getattr(request, 'link_id', None))
+                if frames:
+                    self.logger.info("Capture stopped, frames dumped: %s" % frames)
+                else:
+                    self.logger.info("No ongoing capture")
+                response = MsgSniffingStopReply(request, ok=True, frames=sum(frames.values()), captures=frames)
+
+            except Exception as e:
+                m = "Capture couldnt be stopped: %s" % e
+                self.logger.error(m)
+                response = MsgErrorReply(request, ok=False, error_message=m)
 
             # send final response to API call
             publish_message(self.connection, response)
@@ -302,6 +470,7 @@ class Sniffer:
     def run(self):
 
         self.connect()
+        self.capture_worker.start()
         msg = MsgTestingToolComponentReady(component='sniffing')
         publish_message(self.connection, msg)
 
@@ -319,6 +488,10 @@ class Sniffer:
             self.logger.error(' Unexpected error \n More: %s' % traceback.format_exc())
             sys.exit(1)
         finally:
+            if self.capture_worker and self.capture_worker.is_alive():
+                self.capture_worker.connection.add_callback_threadsafe(self.capture_worker.stop)
+                self.capture_worker.join()
+
             # close AMQP connection
             if self.connection:
                 self.connection.close()
@@ -327,6 +500,13 @@ class Sniffer:
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("mode", help="", choices=['ipv6_tun', '802_15_4_tun'])
+    parser.add_argument("--ring-buffer-size", type=int, default=0,
+                        help="Keep the last N MB of data plane frames in memory, captures can then be extracted "
+                             "for any time window (see MsgSniffingExtractCapture)")
+    parser.add_argument("--ring-buffer-spill-dir", default=None,
+                        help="Move frames evicted from the ring buffer to segment files in this dir")
+    parser.add_argument("--ring-buffer-spill-size", type=int, default=1024,
+                        help="MB of frames kept in the ring buffer's spill dir")
     args = parser.parse_args()
     mode = args.mode
 
@@ -338,10 +518,19 @@ def main():
         print(' Unknown mode %s' % mode)
         return
 
+    ring_buffer = None
+    if args.ring_buffer_size:
+        ring_buffer = CaptureRingBuffer(
+            max_size=args.ring_buffer_size * 1024 * 1024,
+            spill_dir=args.ring_buffer_spill_dir,
+            spill_max_size=args.ring_buffer_spill_size * 1024 * 1024,
+        )
+
     sniffer = Sniffer(
         traffic_dlt=traffic_dlt,
         amqp_url=AMQP_URL,
-        amqp_exchange=AMQP_EXCHANGE
+        amqp_exchange=AMQP_EXCHANGE,
+        ring_buffer=ring_buffer,
     )
 
     sniffer.run()
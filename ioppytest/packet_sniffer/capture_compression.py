@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/env python3
+
+"""
+Compression of captures, for transfer (sniffer replies) and storage (coordinator's dumps dir).
+
+Requests for captures may carry a `compression` field (None or 'gzip'), the sniffer states the encoding actually
+used in the reply's `file_enc` field:
+
+    - 'pcap_base64': pcap file, base64 encoded (default, legacy)
+    - 'pcap_gzip_base64': gzip compressed pcap file, base64 encoded
+
+Replies to requests addressing a part of the file (MsgSniffingGetCaptureChunk offsets) are never compressed.
+Compressed captures are stored as <capture>.pcap.gz by the coordinator (PCAP_DIR). The sniffer keeps its own captures
+uncompressed (TMPDIR), as they are written while the capture goes on, and their frame indexes, slices and chunk
+offsets address the pcap file itself, they are only compressed when sent.
+
+>>> file_enc, value = encode_capture(pcap_bytes, COMPRESSION_GZIP)
+>>> decode_capture(file_enc, value) == pcap_bytes
+True
+"""
+
+import gzip
+import zlib
+import base64
+
+COMPRESSION_GZIP = 'gzip'
+COMPRESSIONS = (
+    COMPRESSION_GZIP,
+)
+
+FILE_ENC_PCAP = 'pcap_base64'
+FILE_ENC_PCAP_GZIP = 'pcap_gzip_base64'
+
+COMPRESSED_CAPTURE_SUFFIX = '.gz'
+COMPRESSION_LEVEL = 6
+
+_compression_to_file_enc = {
+    None: FILE_ENC_PCAP,
+    COMPRESSION_GZIP: FILE_ENC_PCAP_GZIP,
+}
+
+_file_enc_to_compression = {v: k for k, v in _compression_to_file_enc.items()}
+
+
+def get_requested_compression(request):
+    """
+    :return: compression requested by the message (None if not compressed)
+    :raises ValueError: unknown compression
+    """
+    compression = getattr(request, 'compression', None)
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ValueError('Unknown compression %s, expected one of %s' % (compression, COMPRESSIONS))
+    return compression
+
+
+def get_file_enc(compression):
+    return _compression_to_file_enc[compression]
+
+
+def get_compression(file_enc):
+    """
+    :return: compression of a reply's value, replies without file_enc are not compressed
+    """
+    try:
+        return _file_enc_to_compression[file_enc or FILE_ENC_PCAP]
+    except KeyError:
+        raise ValueError('Unknown file encoding %s' % file_enc)
+
+
+def compress(data, compression):
+    if compression == COMPRESSION_GZIP:
+        return gzip.compress(data, compresslevel=COMPRESSION_LEVEL)
+    return data
+
+
+def decompress(data, compression):
+    if compression == COMPRESSION_GZIP:
+        return gzip.decompress(data)
+    return data
+
+
+def encode_capture(data, compression=None):
+    """
+    :return: file_enc, base64 encoded (and compressed) data as str
+    """
+    return get_file_enc(compression), base64.b64encode(compress(data, compression)).decode('utf-8')
+
+
+def decode_capture(file_enc, value):
+    """
+    :return: pcap file (bytes) of a reply's file_enc and value
+    """
+    return decompress(base64.b64decode(value), get_compression(file_enc))
+
+
+class _NoCompression:
+
+    def compress(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+
+def new_compressor(compression):
+    """
+    :return: streaming compressor (compress(data) / flush()), for sending a file chunk by chunk
+    """
+    if compression == COMPRESSION_GZIP:
+        return zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+    return _NoCompression()
+
+
+def get_capture_filename(filename, compression):
+    if compression == COMPRESSION_GZIP:
+        return filename + COMPRESSED_CAPTURE_SUFFIX
+    return filename
+
+
+def open_capture(path):
+    """
+    :return: file object (read, binary) of the pcap file, decompressed on the fly if stored compressed
+    """
+    if path.endswith(COMPRESSED_CAPTURE_SUFFIX):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
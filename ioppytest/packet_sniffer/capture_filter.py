@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/env python3
+
+"""
+Capture filters, evaluated by the capture worker when packets are ingested, so only the relevant frames of a capture
+are written (e.g. the test configuration's capture_filter of each link: 'udp').
+
+Filters are compiled once per capture into a predicate over the frame's interface and IP headers. Expressions are a
+subset of the pcap-filter syntax: primitives joined by 'and' / 'or' ('and' binds tighter, no parentheses), each
+primitive may be negated with 'not':
+
+    ip | ip6 | udp | tcp | icmp | icmp6
+    [udp | tcp] [src | dst] port <port>
+    [src | dst] host <ipv4 or ipv6 address>
+
+>>> predicate = compile_capture_filter('udp port 5683 or icmp6')
+>>> predicate(CaptureFrame(data, 'tun0'))
+True
+
+Protocol filters need frames starting with the IP header (DLT_RAW), empty filters ('', 'none', 'TBD') capture all.
+"""
+
+import struct
+import ipaddress
+import collections
+
+import pure_pcapy
+
+NO_FILTER_EXPRESSIONS = ('', 'none', 'tbd', 'any', 'all')
+
+PROTOCOLS = {
+    'icmp': 1,
+    'tcp': 6,
+    'udp': 17,
+    'icmp6': 58,
+}
+
+IPV6_EXTENSION_HEADERS = (0, 43, 60)  # hop-by-hop, routing, destination options (fragments aren't followed)
+
+IpHeaders = collections.namedtuple('IpHeaders', ['version', 'proto', 'src', 'dst', 'sport', 'dport'])
+
+
+def parse_ip_headers(data):
+    """
+    :return: IpHeaders of a packet starting with its IP header, None if not an IP packet (or truncated)
+    """
+    if not data:
+        return None
+
+    version = data[0] >> 4
+    try:
+        if version == 6:
+            proto = data[6]
+            src, dst = bytes(data[8:24]), bytes(data[24:40])
+            offset = 40
+            while proto in IPV6_EXTENSION_HEADERS:
+                proto = data[offset]
+                offset += (data[offset + 1] + 1) * 8
+        elif version == 4:
+            proto = data[9]
+            src, dst = bytes(data[12:16]), bytes(data[16:20])
+            offset = (data[0] & 0x0F) * 4
+        else:
+            return None
+
+        sport = dport = None
+        if proto in (PROTOCOLS['udp'], PROTOCOLS['tcp']):
+            sport, dport = struct.unpack_from('!HH', data, offset)
+    except (IndexError, struct.error):
+        return None
+
+    return IpHeaders(version, proto, src, dst, sport, dport)
+
+
+class CaptureFrame:
+    """
+    Frame being ingested, its headers are parsed (once) only if a filter needs them
+    """
+
+    def __init__(self, data, interface_name=None):
+        self.data = data
+        self.interface_name = interface_name
+        self._headers = None
+        self._parsed = False
+
+    @property
+    def headers(self):
+        if not self._parsed:
+            self._headers = parse_ip_headers(self.data)
+            self._parsed = True
+        return self._headers
+
+
+def _version_primitive(version):
+    return lambda h: h.version == version
+
+
+def _proto_primitive(proto):
+    return lambda h: h.proto == proto
+
+
+def _port_primitive(port, direction, proto=None):
+    def primitive(h):
+        if proto is not None and h.proto != proto:
+            return False
+        if direction == 'src':
+            return h.sport == port
+        if direction == 'dst':
+            return h.dport == port
+        return h.sport == port or h.dport == port
+
+    return primitive
+
+
+def _host_primitive(address, direction):
+    packed = address.packed
+
+    def primitive(h):
+        if direction == 'src':
+            return h.src == packed
+        if direction == 'dst':
+            return h.dst == packed
+        return h.src == packed or h.dst == packed
+
+    return primitive
+
+
+def _parse_primitive(tokens, i):
+    """
+    :return: primitive (function of IpHeaders), index of the next token
+    """
+    token = tokens[i]
+    if token == 'ip':
+        return _version_primitive(4), i + 1
+    if token == 'ip6':
+        return _version_primitive(6), i + 1
+
+    proto = None
+    if token in PROTOCOLS:
+        proto = PROTOCOLS[token]
+        if i + 1 == len(tokens) or tokens[i + 1] not in ('src', 'dst', 'port'):
+            return _proto_primitive(proto), i + 1
+        i += 1
+
+    direction = None
+    if tokens[i] in ('src', 'dst'):
+        direction = tokens[i]
+        i += 1
+
+    if i + 1 >= len(tokens) or tokens[i] not in ('port', 'host') or (proto and tokens[i] == 'host'):
+        raise ValueError('Unsupported capture filter primitive at "%s"' % ' '.join(tokens[i:]))
+
+    keyword, value = tokens[i], tokens[i + 1]
+    if keyword == 'port':
+        if not value.isdigit() or int(value) > 0xFFFF:
+            raise ValueError('Invalid port %s' % value)
+        return _port_primitive(int(value), direction, proto), i + 2
+
+    return _host_primitive(ipaddress.ip_address(value), direction), i + 2
+
+
+def compile_capture_filter(expression=None, interface_name=None, dlt=pure_pcapy.DLT_RAW):
+    """
+    :param expression: filter expression (see module doc)
+    :param interface_name: if not None, only frames of this agent interface are captured
+    :param dlt: data link type of the frames
+    :return: predicate(CaptureFrame) -> bool, None if everything is captured
+    :raises ValueError: wrong or unsupported expression
+    """
+    tokens = (expression or '').lower().split()
+    if ' '.join(tokens) in NO_FILTER_EXPRESSIONS:
+        tokens = []
+
+    if tokens and dlt != pure_pcapy.DLT_RAW:
+        raise ValueError('Capture filters are only supported for raw IP captures (DLT_RAW)')
+
+    # disjunction of conjunctions of (negated, primitive)
+    alternatives = [[]]
+    i = 0
+    while i < len(tokens):
+        negated = tokens[i] == 'not'
+        if negated:
+            i += 1
+        if i == len(tokens):
+            raise ValueError('Capture filter %s is incomplete' % expression)
+
+        primitive, i = _parse_primitive(tokens, i)
+        alternatives[-1].append((negated, primitive))
+
+        if i < len(tokens):
+            if tokens[i] == 'or':
+                alternatives.append([])
+            elif tokens[i] != 'and':
+                raise ValueError('Expected "and" / "or" in capture filter, got "%s"' % tokens[i])
+            i += 1
+            if i == len(tokens):
+                raise ValueError('Capture filter %s is incomplete' % expression)
+
+    if not tokens and interface_name is None:
+        return None
+
+    def predicate(frame):
+        if interface_name is not None and frame.interface_name != interface_name:
+            return False
+        if not tokens:
+            return True
+
+        headers = frame.headers
+        for conjunction in alternatives:
+            if all((headers is not None and primitive(headers)) != negated for negated, primitive in conjunction):
+                return True
+        return False
+
+    return predicate
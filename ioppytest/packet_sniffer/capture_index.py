@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/env python3
+
+"""
+Frame index of pcap files, written by the capture worker next to each capture (<capture>.pcap.idx).
+
+For each frame the index records its offset in the pcap file, timestamp, length, source agent and links (those of
+the capture the frame was dumped for), so captures can be sliced by time window, agent or link by seeking into the
+pcap file instead of reading it whole.
+
+Index file format: a json header line (number of frames, agent and link names, byte order) followed by the columns
+(arrays) of the index:
+
+    offsets (uint64), timestamps (double), lengths (uint32), agents (uint16, index in agents list),
+    links (uint32, bitmask over the links list)
+
+>>> index = load_capture_index('TD_COAP_CORE_01.pcap')
+>>> with open('TD_COAP_CORE_01_slice.pcap', 'wb') as f:
+...     slice_capture('TD_COAP_CORE_01.pcap', f, t_start=1488586183.45, t_end=1488586184.45, agents=['coap_client'])
+"""
+
+import os
+import sys
+import json
+import array
+import bisect
+import struct
+
+from ioppytest.packet_sniffer.capture_compression import open_capture
+
+INDEX_SUFFIX = '.idx'
+INDEX_VERSION = 1
+
+PCAP_GLOBAL_HEADER_LEN = 24
+PCAP_RECORD_HEADER_LEN = 16
+
+NO_AGENT = 0xFFFF
+MAX_LINKS = 32
+
+_columns = (
+    ('offsets', 'Q'),
+    ('timestamps', 'd'),
+    ('lengths', 'I'),
+    ('agents', 'H'),
+    ('links', 'I'),
+)
+
+
+def get_index_path(pcap_path):
+    return pcap_path + INDEX_SUFFIX
+
+
+class CaptureIndex:
+
+    def __init__(self):
+        for name, typecode in _columns:
+            setattr(self, name, array.array(typecode))
+        self.agent_names = []
+        self.link_names = []
+        self._agent_ids = {}
+        self._link_ids = {}
+        self.sorted = True  # timestamps in ascending order, i.e. time windows can be bisected
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _agent_id(self, agent):
+        if agent is None:
+            return NO_AGENT
+        try:
+            return self._agent_ids[agent]
+        except KeyError:
+            self.agent_names.append(agent)
+            agent_id = self._agent_ids[agent] = len(self.agent_names) - 1
+            return agent_id
+
+    def _links_mask(self, links):
+        mask = 0
+        for link in links:
+            if link is None:
+                continue
+            if link not in self._link_ids:
+                if len(self.link_names) == MAX_LINKS:
+                    continue
+                self.link_names.append(link)
+                self._link_ids[link] = len(self.link_names) - 1
+            mask |= 1 << self._link_ids[link]
+        return mask
+
+    def add(self, offset, timestamp, length, agent=None, links=()):
+        """
+        :param offset: offset of the frame's pcap record (header included) in the file
+        :param length: captured length of the frame
+        """
+        if self.sorted and self.timestamps and timestamp < self.timestamps[-1]:
+            self.sorted = False
+        self.offsets.append(offset)
+        self.timestamps.append(timestamp)
+        self.lengths.append(length)
+        self.agents.append(self._agent_id(agent))
+        self.links.append(self._links_mask(links))
+
+    def select(self, t_start=None, t_end=None, agents=None, link=None):
+        """
+        :return: positions (in the index) of the frames within [t_start, t_end], sent by agents, seen on link
+        """
+        # frames are dumped in consumption order, timestamps are sorted unless the agents' clocks are skewed
+        if self.sorted:
+            first = 0 if t_start is None else bisect.bisect_left(self.timestamps, t_start)
+            last = len(self) if t_end is None else bisect.bisect_right(self.timestamps, t_end)
+            t_start = t_end = None  # window already applied
+        else:
+            first, last = 0, len(self)
+
+        agent_ids = None
+        if agents:
+            agent_ids = {self._agent_ids[a] for a in agents if a in self._agent_ids}
+
+        link_mask = None
+        if link is not None:
+            link_mask = 1 << self._link_ids[link] if link in self._link_ids else 0
+
+        return [i for i in range(first, last)
+                if (t_start is None or self.timestamps[i] >= t_start) and
+                (t_end is None or self.timestamps[i] <= t_end) and
+                (agent_ids is None or self.agents[i] in agent_ids) and
+                (link_mask is None or self.links[i] & link_mask)]
+
+    def save(self, path):
+        header = {
+            'version': INDEX_VERSION,
+            'frames': len(self),
+            'byteorder': sys.byteorder,
+            'agents': self.agent_names,
+            'links': self.link_names,
+        }
+        with open(path, 'wb') as f:
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            for name, _ in _columns:
+                getattr(self, name).tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with open(path, 'rb') as f:
+            header = json.loads(f.readline().decode('utf-8'))
+            if header['version'] != INDEX_VERSION:
+                raise ValueError('Unsupported capture index version %s' % header['version'])
+
+            for name, _ in _columns:
+                column = getattr(index, name)
+                column.fromfile(f, header['frames'])
+                if header['byteorder'] != sys.byteorder:
+                    column.byteswap()
+
+        timestamps = index.timestamps
+        index.sorted = all(timestamps[i] <= timestamps[i + 1] for i in range(len(timestamps) - 1))
+        for agent in header['agents']:
+            index._agent_id(agent)
+        index._links_mask(header['links'])
+        return index
+
+    @classmethod
+    def build(cls, pcap_path):
+        """
+        Builds the index by scanning the pcap file (no agent nor link info), for captures without index
+        """
+        index = cls()
+        with open_capture(pcap_path) as f:
+            magic = f.read(PCAP_GLOBAL_HEADER_LEN)[:4]
+            endianness = '<' if magic == b'\xd4\xc3\xb2\xa1' else '>'
+            offset = PCAP_GLOBAL_HEADER_LEN
+            while True:
+                header = f.read(PCAP_RECORD_HEADER_LEN)
+                if len(header) < PCAP_RECORD_HEADER_LEN:
+                    return index
+                ts_sec, ts_usec, incl_len, orig_len = struct.unpack(endianness + 'IIII', header)
+                index.add(offset, ts_sec + ts_usec / 1000000, incl_len)
+                f.seek(incl_len, os.SEEK_CUR)
+                offset += PCAP_RECORD_HEADER_LEN + incl_len
+
+
+def load_capture_index(pcap_path):
+    """
+    :return: CaptureIndex of the pcap file, from its index file if any
+    """
+    index_path = get_index_path(pcap_path)
+    if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(pcap_path):
+        return CaptureIndex.load(index_path)
+    return CaptureIndex.build(pcap_path)
+
+
+def slice_capture(pcap_path, fileobj, t_start=None, t_end=None, agents=None, link=None):
+    """
+    Writes into fileobj a pcap file with the frames of pcap_path within [t_start, t_end], sent by agents, seen on link
+    (pcap_path may be a compressed capture, see capture_compression)
+    :return: number of frames written
+    """
+    index = load_capture_index(pcap_path)
+    positions = index.select(t_start, t_end, agents, link)
+
+    with open_capture(pcap_path) as f:
+        fileobj.write(f.read(PCAP_GLOBAL_HEADER_LEN))
+        for i in positions:
+            f.seek(index.offsets[i])
+            fileobj.write(f.read(PCAP_RECORD_HEADER_LEN + index.lengths[i]))
+
+    return len(positions)
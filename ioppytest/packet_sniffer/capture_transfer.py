@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/env python3
+
+"""
+Chunked transfer of captures (pcap files) from the sniffer.
+
+MsgSniffingGetCapture replies carry the whole pcap file base64 encoded, so the file is loaded in memory on both
+sides and long captures produce messages beyond the broker's frame/message size limits. Captures can instead be
+retrieved:
+
+- by chunks, requesting offset and length (MsgSniffingGetCaptureChunk), or
+- as a stream of MsgSniffingCaptureChunk events followed by a reply carrying the file's checksum
+  (MsgSniffingStreamCapture)
+
+>>> client = CaptureTransferClient(connection, 'my_component')
+>>> with open('TD_COAP_CORE_01.pcap', 'wb') as f:
+...     reply = client.stream('TD_COAP_CORE_01', f)
+"""
+
+import time
+import uuid
+import base64
+import hashlib
+import logging
+
+import pika
+from messages import Message
+
+from ioppytest import AMQP_EXCHANGE, LOG_LEVEL
+from ioppytest.messages_extensions import (
+    MsgSniffingGetCaptureChunk,
+    MsgSniffingGetCaptureChunkReply,
+    MsgSniffingStreamCapture,
+    MsgSniffingStreamCaptureReply,
+    MsgSniffingCaptureChunk,
+)
+
+COMPONENT_ID = 'capture_transfer'
+
+DEFAULT_CHUNK_SIZE = 128 * 1024  # bytes
+MAX_CHUNK_SIZE = 4 * 1024 * 1024  # bytes
+CHECKSUM_ALGORITHM = 'sha256'
+
+logger = logging.getLogger(COMPONENT_ID)
+logger.setLevel(LOG_LEVEL)
+
+
+class CaptureTransferError(Exception):
+    pass
+
+
+def get_chunk_size(requested_size):
+    return min(requested_size or DEFAULT_CHUNK_SIZE, MAX_CHUNK_SIZE)
+
+
+def read_chunk(path, offset, length):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+def iter_chunks(path, chunk_size):
+    """
+    :return: iterator of (offset, data) over the file, reading one chunk at a time
+    """
+    offset = 0
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                return
+            yield offset, data
+            offset += len(data)
+
+
+def new_checksum():
+    return hashlib.new(CHECKSUM_ALGORITHM)
+
+
+class CaptureTransferClient:
+    """
+    Retrieves captures from the sniffer and writes them into a file object, never holding more than one chunk in memory
+
+    Replies are polled from a private queue (as event_bus_utils.amqp_request does), so the client can be used from
+    within a pika consumer callback.
+    """
+
+    POLL_INTERVAL_MIN = 0.001  # seconds
+    POLL_INTERVAL_MAX = 0.05  # seconds
+
+    def __init__(self, connection, component_id, exchange=AMQP_EXCHANGE, timeout=10):
+        """
+        :param connection: pika.BlockingConnection
+        :param timeout: seconds without receiving anything from the sniffer before giving up
+        """
+        self.connection = connection
+        self.component_id = component_id
+        self.exchange = exchange
+        self.timeout = timeout
+
+    def _open_queue(self, routing_keys):
+        channel = self.connection.channel()
+        queue = 'capture_transfer_%s@%s' % (str(uuid.uuid4())[:8], self.component_id)
+        channel.queue_declare(queue=queue, auto_delete=True)
+        for rk in routing_keys:
+            channel.queue_bind(exchange=self.exchange, queue=queue, routing_key=rk)
+        return channel, queue
+
+    def _close_queue(self, channel, queue):
+        if channel.is_open:
+            channel.queue_delete(queue)
+            channel.close()
+
+    def _publish(self, channel, message):
+        channel.basic_publish(
+            exchange=self.exchange,
+            routing_key=message.routing_key,
+            properties=pika.BasicProperties(**message.get_properties()),
+            body=message.to_json(),
+        )
+
+    def _next_message(self, channel, queue):
+        """
+        :return: next message in queue, waits up to timeout for it
+        """
+        deadline = time.time() + self.timeout
+        poll_interval = self.POLL_INTERVAL_MIN
+        while True:
+            method, props, body = channel.basic_get(queue, auto_ack=True)
+            if method:
+                return Message.load_from_pika(method, props, body)
+
+            if time.time() > deadline:
+                raise CaptureTransferError('Capture transfer timeout, sniffer did not respond in %ss' % self.timeout)
+
+            time.sleep(poll_interval)
+            poll_interval = min(poll_interval * 2, self.POLL_INTERVAL_MAX)
+
+    def _wait_reply(self, channel, queue, request):
+        while True:
+            m = self._next_message(channel, queue)
+            if m.correlation_id != request.correlation_id:
+                continue
+            if not m.ok:
+                raise CaptureTransferError('Sniffer replied with error: %s' % getattr(m, 'error_message', repr(m)))
+            return m
+
+    def get_chunk(self, capture_id, offset, length=DEFAULT_CHUNK_SIZE):
+        """
+        :return: MsgSniffingGetCaptureChunkReply (value is base64 encoded)
+        """
+        request = MsgSniffingGetCaptureChunk(capture_id=capture_id, offset=offset, length=length)
+        channel, queue = self._open_queue([MsgSniffingGetCaptureChunkReply.routing_key])
+        try:
+            self._publish(channel, request)
+            return self._wait_reply(channel, queue, request)
+        finally:
+            self._close_queue(channel, queue)
+
+    def download(self, capture_id, fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Gets the capture chunk by chunk (one request per chunk)
+        :return: filename, size
+        """
+        channel, queue = self._open_queue([MsgSniffingGetCaptureChunkReply.routing_key])
+        try:
+            offset = 0
+            while True:
+                request = MsgSniffingGetCaptureChunk(capture_id=capture_id, offset=offset, length=chunk_size)
+                self._publish(channel, request)
+                reply = self._wait_reply(channel, queue, request)
+
+                data = base64.b64decode(reply.value)
+                fileobj.write(data)
+                offset += len(data)
+
+                if reply.eof or not data:
+                    return reply.filename, offset
+        finally:
+            self._close_queue(channel, queue)
+
+    def stream(self, capture_id, fileobj, chunk_size=DEFAULT_CHUNK_SIZE, compression=None):
+        """
+        Gets the capture as a stream of chunks, verifies size and checksum once the sniffer's final reply arrives
+
+        :param compression: compression requested (see capture_compression), the reply's file_enc tells whether the
+            data written into fileobj is compressed
+        :return: MsgSniffingStreamCaptureReply
+        """
+        request = MsgSniffingStreamCapture(capture_id=capture_id, chunk_size=chunk_size, compression=compression)
+        channel, queue = self._open_queue([MsgSniffingCaptureChunk.routing_key,
+                                           MsgSniffingStreamCaptureReply.routing_key])
+
+        try:
+            self._publish(channel, request)
+
+            checksum = new_checksum()
+            size = 0
+            chunks = 0
+            while True:
+                m = self._next_message(channel, queue)
+
+                if isinstance(m, MsgSniffingCaptureChunk) and m.stream_id == request.correlation_id:
+                    if m.sequence_number != chunks or m.offset != size:
+                        raise CaptureTransferError('Chunk %s (offset %s) received out of order, expected %s (offset %s)'
+                                                   % (m.sequence_number, m.offset, chunks, size))
+                    data = base64.b64decode(m.value)
+                    fileobj.write(data)
+                    checksum.update(data)
+                    size += len(data)
+                    chunks += 1
+
+                elif isinstance(m, MsgSniffingStreamCaptureReply) and m.correlation_id == request.correlation_id:
+                    if not m.ok:
+                        raise CaptureTransferError('Sniffer replied with error: %s' %
+                                                   getattr(m, 'error_message', repr(m)))
+                    if m.chunks != chunks or m.total_size != size:
+                        raise CaptureTransferError('Incomplete capture transfer, got %s chunks (%s bytes), expected %s '
+                                                   'chunks (%s bytes)' % (chunks, size, m.chunks, m.total_size))
+                    if m.checksum_algorithm != CHECKSUM_ALGORITHM or m.checksum != checksum.hexdigest():
+                        raise CaptureTransferError('Capture checksum mismatch')
+                    return m
+        finally:
+            self._close_queue(channel, queue)
@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/env python3
+
+"""
+Long lived capture worker of the packet sniffer.
+
+The worker stays subscribed to the data plane (fromAgent.#) for the whole sniffer's lifetime, and writes the packets
+it consumes into the pcap files of the ongoing captures. Starting and stopping a capture just opens and closes the
+capture's file (a segment), so no process is spawned and no AMQP connection is set up at each test case start, and
+packets published right after the start reply are not missed.
+
+Several captures can be ongoing at the same time, and a capture may be started once per link of the test
+configuration, all fed from the same subscription. A link capture only takes the packets sent by the link's nodes
+(source agent of the routing key), and dumps them into <capture_id>_<link_id>.pcap. The capture's file
+(<capture_id>.pcap, the one analysed by the TAT) gets all the data plane packets, whatever their source, each packet
+dumped only once.
+Each pcap file gets a frame index file next to it once closed (see capture_index).
+Frames are stamped with the packet's own timestamp (set by the agent which sniffed it), or with the ingest time if
+the packet has none, so frames of different agents may be slightly out of timestamp order.
+
+Link captures may have a capture filter (e.g. the test configuration's capture_filter: 'udp') and an interface
+filter, compiled once when the capture starts (see capture_filter), packets not matching them aren't written (into
+the link's file, nor into the capture's file unless another link's filter matches them).
+
+Start / stop commands are executed in the worker's thread (AMQP callbacks, pika's connections are not thread-safe),
+the caller is blocked until the command is done:
+
+>>> worker = CaptureWorker(AMQP_URL, AMQP_EXCHANGE, pure_pcapy.DLT_RAW)
+>>> worker.start()
+>>> worker.start_capture('TD_COAP_CORE_01', link_id='link_01', nodes=['coap_client', 'coap_server'])
+>>> worker.stop_capture('TD_COAP_CORE_01')
+"""
+
+import os
+import time
+import struct
+import logging
+import threading
+
+import pika
+from messages import MsgPacketSniffedRaw, NonCompliantMessageFormatError
+
+from ioppytest import TMPDIR, LOG_LEVEL
+from ioppytest.exceptions import SnifferError
+from ioppytest.packet_encoding import load_packet_message, get_packet_timestamp
+from ioppytest.packet_sniffer.capture_index import CaptureIndex, get_index_path
+from ioppytest.packet_sniffer.capture_filter import CaptureFrame, compile_capture_filter
+
+COMPONENT_ID = 'packet_sniffer|capture_worker'
+
+# same pcap params as event_bus_utils.packet_dumper
+PCAP_SNAPLEN = 2000
+PCAP_MAGIC_NUMBER = 0xa1b2c3d4
+PCAP_VERSION = (2, 4)
+
+logger = logging.getLogger(COMPONENT_ID)
+logger.setLevel(LOG_LEVEL)
+
+
+class PcapWriter:
+    """
+    Writes frames into a pcap file, native byte order (as pure_pcapy.Dumper), and the file's frame index
+    (see capture_index)
+    """
+
+    def __init__(self, path, dlt, snaplen=PCAP_SNAPLEN):
+        self.path = path
+        self.frames = 0
+        self.index = CaptureIndex()
+
+        index_path = get_index_path(path)
+        if os.path.exists(index_path):  # index of a previous capture with the same name
+            os.remove(index_path)
+
+        self.file = open(path, 'wb')
+        self.file.write(struct.pack('IHHiIII', PCAP_MAGIC_NUMBER, PCAP_VERSION[0], PCAP_VERSION[1], 0, 0, snaplen, dlt))
+        self.file.flush()
+        self.offset = self.file.tell()
+
+    def write(self, timestamp, data, source_agent=None, links=()):
+        ts_sec = int(timestamp)
+        ts_usec = int((timestamp - ts_sec) * 1000000)
+        record = struct.pack('IIII', ts_sec, ts_usec, len(data), len(data)) + data
+        self.file.write(record)
+        self.file.flush()  # file can be retrieved (GetCapture..) while capture is still ongoing
+        self.index.add(self.offset, timestamp, len(data), source_agent, links)
+        self.offset += len(record)
+        self.frames += 1
+
+    def close(self):
+        """
+        Flushes and closes the file, and saves its index. Once returned the capture is on disk (fsync'd)
+        :return: number of frames in the file
+        """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.index.save(get_index_path(self.path))
+        return self.frames
+
+
+def get_source_agent(routing_key):
+    """
+    fromAgent.coap_client.ip.tun.packet.raw -> coap_client
+    """
+    rkey_words = routing_key.split('.')
+    try:
+        return rkey_words[rkey_words.index('fromAgent') + 1]
+    except (ValueError, IndexError):
+        return None
+
+
+def get_capture_filename(capture_id, link_id=None):
+    if link_id is None:
+        return '%s.pcap' % capture_id
+    return '%s_%s.pcap' % (capture_id, link_id)
+
+
+class LinkCapture:
+    """
+    Capture of the packets sent by the nodes of a link, link_id None captures the whole data plane
+    """
+
+    def __init__(self, link_id, nodes, writer=None, predicate=None):
+        """
+        :param predicate: compiled capture filter (see capture_filter), None captures all packets of the nodes
+        """
+        self.link_id = link_id
+        self.nodes = set(nodes) if nodes else None
+        self.writer = writer
+        self.predicate = predicate
+
+    def matches_filter(self, frame):
+        return self.predicate is None or self.predicate(frame)
+
+    def matches_nodes(self, source_agent):
+        return self.nodes is None or source_agent in self.nodes
+
+
+class Capture:
+    """
+    Ongoing capture, made of the captures of one or more links
+    """
+
+    def __init__(self, capture_id, writer):
+        self.capture_id = capture_id
+        self.writer = writer
+        self.links = {}  # link_id -> LinkCapture
+
+    def write(self, source_agent, timestamp, frame):
+        """
+        Link files get the frames sent by the link's nodes, the capture's file gets all the frames matching the
+        capture/interface filter of any of its links (indexed with the links whose nodes sent them)
+        """
+        captured = False
+        matched_links = []
+        for link in self.links.values():
+            if not link.matches_filter(frame):
+                continue
+            captured = True
+            if link.matches_nodes(source_agent):
+                matched_links.append(link.link_id)
+                if link.writer:
+                    link.writer.write(timestamp, frame.data, source_agent, (link.link_id,))
+
+        if captured:
+            self.writer.write(timestamp, frame.data, source_agent, matched_links)
+
+    def close_link(self, link_id):
+        link = self.links.pop(link_id)
+        if link.writer:
+            link.writer.close()
+
+    def close(self):
+        for link_id in list(self.links):
+            self.close_link(link_id)
+        return self.writer.close()
+
+
+class CaptureWorker(threading.Thread):
+    DATA_PLANE_TOPICS = [
+        'fromAgent.#',
+    ]
+
+    PREFETCH_COUNT = 100
+    QUEUE_MAX_LENGTH = 10000
+    COMMAND_TIMEOUT = 5  # seconds
+
+    def __init__(self, amqp_url, amqp_exchange, traffic_dlt, dump_dir=TMPDIR, component_id=COMPONENT_ID,
+                 ring_buffer=None):
+        """
+        :param ring_buffer: CaptureRingBuffer, if not None all frames are kept in it, and captures can be extracted
+            from it afterwards (see extract_capture)
+        """
+        threading.Thread.__init__(self, name='thread_%s' % component_id)
+        self.daemon = True
+
+        self.exchange = amqp_exchange
+        self.traffic_dlt = traffic_dlt
+        self.dump_dir = dump_dir
+        self.ring_buffer = ring_buffer
+        self.captures = {}  # capture_id -> Capture, only accessed from the worker's thread
+
+        # subscribe to the data plane before the sniffer announces itself as ready
+        self.connection = pika.BlockingConnection(pika.URLParameters(amqp_url))
+        self.channel = self.connection.channel()
+        self.queue = 'data_plane@%s' % component_id
+        self.channel.queue_declare(queue=self.queue, auto_delete=True,
+                                   arguments={'x-max-length': self.QUEUE_MAX_LENGTH})
+        for t in self.DATA_PLANE_TOPICS:
+            self.channel.queue_bind(exchange=self.exchange, queue=self.queue, routing_key=t)
+        self.channel.basic_qos(prefetch_count=self.PREFETCH_COUNT)
+        self.channel.basic_consume(on_message_callback=self.on_packet, queue=self.queue)
+
+    def _call(self, function, *args):
+        """
+        Executes function in the worker's thread, and waits for it to return
+        """
+        result = {}
+        done = threading.Event()
+
+        def callback():
+            try:
+                result['value'] = function(*args)
+            except Exception as e:
+                result['error'] = e
+            finally:
+                done.set()
+
+        self.connection.add_callback_threadsafe(callback)
+        if not done.wait(self.COMMAND_TIMEOUT):
+            raise SnifferError('Capture worker did not respond in %ss' % self.COMMAND_TIMEOUT)
+        if 'error' in result:
+            raise result['error']
+        return result.get('value')
+
+    def _open_capture(self, capture_id, link_id, nodes, filter_proto, filter_if):
+        capture = self.captures.get(capture_id)
+        if capture and link_id in capture.links:
+            raise SnifferError('Capture %s (link %s) already ongoing' % (capture_id, link_id))
+
+        try:
+            predicate = compile_capture_filter(filter_proto, filter_if, self.traffic_dlt)
+        except ValueError as e:
+            raise SnifferError('Capture %s (link %s): wrong capture filter %s, %s' %
+                               (capture_id, link_id, filter_proto, e))
+
+        if capture is None:
+            path = os.path.join(self.dump_dir, get_capture_filename(capture_id))
+            capture = self.captures[capture_id] = Capture(capture_id, PcapWriter(path, self.traffic_dlt))
+
+        link_writer = None
+        if link_id is not None:
+            link_writer = PcapWriter(os.path.join(self.dump_dir, get_capture_filename(capture_id, link_id)),
+                                     self.traffic_dlt)
+
+        capture.links[link_id] = LinkCapture(link_id, nodes, link_writer, predicate)
+        logger.info('Capture %s started (link: %s, nodes: %s, filter: %s, interface: %s)' %
+                    (capture_id, link_id, nodes or 'all', filter_proto, filter_if or 'all'))
+
+    def _close_capture(self, capture_id, link_id=None):
+        """
+        Closes the link's capture, once a capture has no links left its file is closed too
+        """
+        capture = self.captures.get(capture_id)
+        if capture is None or (link_id is not None and link_id not in capture.links):
+            raise SnifferError('No ongoing capture %s (link %s)' % (capture_id, link_id))
+
+        if link_id is not None:
+            capture.close_link(link_id)
+            if capture.links:
+                return capture.writer.frames
+
+        frames = capture.close()
+        del self.captures[capture_id]
+        logger.info('Capture %s stopped, %s frames dumped' % (capture_id, frames))
+        return frames
+
+    def _close_all_captures(self):
+        return {capture_id: self._close_capture(capture_id) for capture_id in list(self.captures)}
+
+    def start_capture(self, capture_id, link_id=None, nodes=None, filter_proto=None, filter_if=None):
+        """
+        Opens the capture's pcap files (overwriting previous captures with the same id), all packets consumed from
+        now on are dumped into them
+
+        :param link_id: if None all packets are captured, else only those sent by the link's nodes
+        :param nodes: nodes of the link
+        :param filter_proto: capture filter expression (see capture_filter), e.g. 'udp', None captures all packets
+        :param filter_if: if not None, only packets of the agents' interface with this name are captured
+        :raises SnifferError: capture already ongoing, or wrong capture filter
+        """
+        self._call(self._open_capture, capture_id, link_id, nodes, filter_proto, filter_if)
+
+    def stop_capture(self, capture_id=None, link_id=None):
+        """
+        Flushes and closes the capture's pcap files, if capture_id is None then all ongoing captures are closed, if
+        link_id is None all links of the capture are closed.
+        Returns once files are fsync'd, so they can be retrieved right away.
+        :return: dict capture_id -> number of frames dumped
+        """
+        if capture_id is None:
+            return self._call(self._close_all_captures)
+        return {capture_id: self._call(self._close_capture, capture_id, link_id)}
+
+    def _extract_capture(self, capture_id, t_start, t_end, nodes):
+        if self.ring_buffer is None:
+            raise SnifferError('Sniffer is not running with a ring buffer')
+        if capture_id in self.captures:
+            raise SnifferError('Capture %s is ongoing' % capture_id)
+
+        writer = PcapWriter(os.path.join(self.dump_dir, get_capture_filename(capture_id)), self.traffic_dlt)
+        for frame in self.ring_buffer.extract(t_start, t_end, nodes):
+            writer.write(frame.timestamp, frame.data, frame.source_agent)
+        frames = writer.close()
+
+        logger.info('Capture %s extracted from ring buffer (%s frames between %s and %s)' %
+                    (capture_id, frames, t_start, t_end))
+        return frames, self.ring_buffer.oldest_timestamp
+
+    def extract_capture(self, capture_id, t_start, t_end, nodes=None):
+        """
+        Builds the capture's pcap file out of the ring buffer's frames consumed between t_start and t_end
+
+        :param nodes: if not None, only frames sent by these nodes are extracted
+        :return: frames extracted, timestamp of the oldest frame still in the ring buffer
+        """
+        return self._call(self._extract_capture, capture_id, t_start, t_end, nodes)
+
+    def get_ongoing_captures(self):
+        """
+        :return: list of (capture_id, link_id)
+        """
+        return self._call(lambda: sorted(((c.capture_id, l) for c in self.captures.values() for l in c.links),
+                                         key=str))
+
+    def on_packet(self, ch, method, props, body):
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+        if not self.captures and self.ring_buffer is None:  # nothing to decode if packet is not going to be dumped
+            return
+
+        try:
+            m = load_packet_message(method, props, body)
+        except NonCompliantMessageFormatError as e:
+            logger.error(e)
+            return
+
+        if not isinstance(m, MsgPacketSniffedRaw):
+            logger.info('drop amqp message: %s' % repr(m))
+            return
+
+        if 'serial' not in m.interface_name and 'tun' not in m.interface_name:
+            logger.info('drop packet from unknown interface %s' % m.interface_name)
+            return
+
+        frame = CaptureFrame(bytes(m.data), m.interface_name)  # headers parsed once, if a filter needs them
+        timestamp = get_packet_timestamp(m)
+        if timestamp is None:  # publisher didn't stamp the packet, ingest time is the best we have
+            timestamp = time.time()
+        source_agent = get_source_agent(method.routing_key)
+        for capture in self.captures.values():
+            capture.write(source_agent, timestamp, frame)
+
+        if self.ring_buffer is not None:
+            self.ring_buffer.append(timestamp, source_agent, frame.data)
+
+        logger.debug('Dumped packet found in %s interface of %s bytes' % (m.interface_name, len(frame.data)))
+
+    def stop(self):
+        """
+        Stops the worker, call from the worker's thread (see connection.add_callback_threadsafe)
+        """
+        self._close_all_captures()
+        self.channel.stop_consuming()
+
+    def run(self):
+        logger.info('Capture worker subscribed to %s' % self.DATA_PLANE_TOPICS)
+        try:
+            self.channel.start_consuming()
+        finally:
+            for capture in self.captures.values():
+                capture.close()
+            if self.ring_buffer is not None:
+                self.ring_buffer.close()
+            self.connection.close()
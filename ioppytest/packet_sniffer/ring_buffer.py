@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/env python3
+
+"""
+Rolling, time-indexed buffer of the last frames seen in the data plane.
+
+When the sniffer runs with a ring buffer, all frames are kept (not only those of the ongoing captures), so a test
+case's capture can be built afterwards from its time window (see MsgSniffingExtractCapture), e.g. if the sniffer
+start raced with the stimuli or failed.
+
+Frames are kept in memory up to max_size bytes, older frames are then dropped or, if a spill_dir is given, moved to
+segment files on disk, themselves bounded to spill_max_size bytes (oldest segments are deleted).
+
+>>> rb = CaptureRingBuffer(max_size=16 * 1024 * 1024, spill_dir='/tmp/ring')
+>>> rb.append(time.time(), 'coap_client', b'...')
+>>> list(rb.extract(t_start, t_end, nodes=['coap_client', 'coap_server']))
+[(1488586183.45, 'coap_client', b'...')]
+"""
+
+import os
+import glob
+import struct
+import collections
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024  # bytes
+DEFAULT_SPILL_MAX_SIZE = 1024 * 1024 * 1024  # bytes
+DEFAULT_SPILL_SEGMENT_SIZE = 16 * 1024 * 1024  # bytes
+
+# spilled frame: timestamp, source agent length, data length, source agent, data
+SPILL_RECORD_HEADER = struct.Struct('<dHI')
+
+Frame = collections.namedtuple('Frame', ['timestamp', 'source_agent', 'data'])
+
+
+class SpillSegment:
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.size = 0
+        self.min_timestamp = None
+        self.max_timestamp = None
+
+    def write(self, frame):
+        agent = (frame.source_agent or '').encode('utf-8')
+        self.file.write(SPILL_RECORD_HEADER.pack(frame.timestamp, len(agent), len(frame.data)) + agent + frame.data)
+        record_size = SPILL_RECORD_HEADER.size + len(agent) + len(frame.data)
+        self.size += record_size
+        if self.min_timestamp is None:
+            self.min_timestamp = self.max_timestamp = frame.timestamp
+        else:
+            self.min_timestamp = min(self.min_timestamp, frame.timestamp)
+            self.max_timestamp = max(self.max_timestamp, frame.timestamp)
+        return record_size
+
+    def read(self):
+        if not self.file.closed:
+            self.file.flush()
+
+        with open(self.path, 'rb') as f:
+            while True:
+                header = f.read(SPILL_RECORD_HEADER.size)
+                if len(header) < SPILL_RECORD_HEADER.size:
+                    return
+                timestamp, agent_len, data_len = SPILL_RECORD_HEADER.unpack(header)
+                agent = f.read(agent_len).decode('utf-8') or None
+                yield Frame(timestamp, agent, f.read(data_len))
+
+    def close(self):
+        self.file.close()
+
+    def delete(self):
+        self.close()
+        os.remove(self.path)
+
+
+class CaptureRingBuffer:
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, spill_dir=None, spill_max_size=DEFAULT_SPILL_MAX_SIZE,
+                 spill_segment_size=DEFAULT_SPILL_SEGMENT_SIZE):
+        """
+        :param max_size: bytes of frames kept in memory
+        :param spill_dir: if not None, frames evicted from memory are moved to segment files in this dir
+        :param spill_max_size: bytes of frames kept on disk
+        """
+        self.max_size = max_size
+        self.spill_dir = spill_dir
+        self.spill_max_size = spill_max_size
+        self.spill_segment_size = min(spill_segment_size, spill_max_size)
+
+        self.frames = collections.deque()
+        self.size = 0
+        self.segments = collections.deque()
+        self.segments_count = 0
+        self.spill_size = 0
+        self.sorted = True  # frames appended in timestamp order, i.e. extract can stop at the first frame after t_end
+        self._last_timestamp = None
+
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            for path in glob.glob(os.path.join(spill_dir, 'ring_*.bin')):  # leftovers of a previous run
+                os.remove(path)
+
+    @property
+    def oldest_timestamp(self):
+        for segment in self.segments:
+            if segment.min_timestamp is not None:
+                return segment.min_timestamp
+        if not self.frames:
+            return None
+        return self.frames[0].timestamp if self.sorted else min(frame.timestamp for frame in self.frames)
+
+    def _spill(self, frame):
+        if not self.segments or self.segments[-1].size >= self.spill_segment_size:
+            if self.segments:
+                self.segments[-1].close()
+            self.segments.append(SpillSegment(os.path.join(self.spill_dir, 'ring_%08d.bin' % self.segments_count)))
+            self.segments_count += 1
+
+        self.spill_size += self.segments[-1].write(frame)
+
+        while self.spill_size > self.spill_max_size and len(self.segments) > 1:
+            segment = self.segments.popleft()
+            self.spill_size -= segment.size
+            segment.delete()
+
+    def append(self, timestamp, source_agent, data):
+        if self._last_timestamp is not None and timestamp < self._last_timestamp:
+            self.sorted = False  # e.g. frames stamped by agents with skewed clocks
+        self._last_timestamp = timestamp
+        self.frames.append(Frame(timestamp, source_agent, data))
+        self.size += len(data)
+
+        while self.size > self.max_size and len(self.frames) > 1:
+            frame = self.frames.popleft()
+            self.size -= len(frame.data)
+            if self.spill_dir:
+                self._spill(frame)
+
+    def extract(self, t_start, t_end, nodes=None):
+        """
+        :return: iterator over the frames (oldest first) with t_start <= timestamp <= t_end, sent by nodes
+        """
+        nodes = set(nodes) if nodes else None
+
+        def selected(frames):
+            for frame in frames:
+                if frame.timestamp > t_end:
+                    if self.sorted:
+                        return
+                    continue
+                if frame.timestamp >= t_start and (nodes is None or frame.source_agent in nodes):
+                    yield frame
+
+        for segment in list(self.segments):
+            if segment.max_timestamp is None or segment.max_timestamp < t_start:
+                continue
+            if segment.min_timestamp > t_end:
+                if self.sorted:
+                    return
+                continue
+            yield from selected(segment.read())
+
+        yield from selected(self.frames)
+
+    def close(self):
+        while self.segments:
+            self.segments.popleft().delete()
+        self.spill_size = 0
+        self.frames.clear()
+        self.size = 0
+        self.sorted = True
+        self._last_timestamp = None
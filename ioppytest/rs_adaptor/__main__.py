@@ -8,6 +8,7 @@ import logging
 import traceback
 
 from ioppytest import LOG_LEVEL, LOGGER_FORMAT, AMQP_URL, AMQP_EXCHANGE
+from ioppytest.amqp_pool import get_amqp_publisher
 
 from messages import Message, MsgReportSaveRequest, MsgReportSaveReply, MsgTestCaseVerdict, MsgTestSuiteReport
 from event_bus_utils import AmqpSynchCallTimeoutError, AmqpListener, amqp_request
@@ -51,14 +52,14 @@ def save_result_into_RS_db(message: Message):
     )
     logger.info("Sending %s results to RS" % m_type)
     try:
-
-        reply = amqp_request(
-            connection=pika.BlockingConnection(pika.URLParameters(AMQP_URL)),
-            request_message=m,
-            component_id=COMPONENT_ID,
-            retries=3,
-            use_message_typing=True,
-        )
+        with get_amqp_publisher(AMQP_URL, AMQP_EXCHANGE).connection() as connection:
+            reply = amqp_request(
+                connection=connection,
+                request_message=m,
+                component_id=COMPONENT_ID,
+                retries=3,
+                use_message_typing=True,
+            )
 
     except AmqpSynchCallTimeoutError as tout:
         logger.warning("Request for %s timed out. Is RS up?" % type(m))
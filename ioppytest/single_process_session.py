@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/env python3
+
+"""
+Runs the testing tool's session components (test coordinator, packet router and packet sniffer) as threads of a
+single process, talking through the in-memory event bus backend (see ioppytest.memory_broker), so no RabbitMQ broker
+is needed.
+
+Meant for CI: end-to-end runs and benchmarks of the coordinator, router and sniffer which are fast and deterministic.
+Other components (agents, automated IUTs, TAT..) can be started within the same process, after start_session.
+
+EXECUTE AS:
+
+    python3 -m ioppytest.single_process_session coap COAP_CFG_01
+"""
+
+import os
+import errno
+import logging
+import argparse
+import threading
+
+import pure_pcapy
+
+from ioppytest import memory_broker
+from ioppytest import (AMQP_URL, AMQP_EXCHANGE, TEST_DESCRIPTIONS_DICT, TEST_DESCRIPTIONS_CONFIGS_DICT, LOGGER_FORMAT,
+                       LOG_LEVEL, DATADIR, TMPDIR, LOGDIR, RESULTS_DIR, PCAP_DIR)
+
+COMPONENT_ID = 'single_process_session'
+
+logging.basicConfig(format=LOGGER_FORMAT)
+
+logger = logging.getLogger(COMPONENT_ID)
+logger.setLevel(LOG_LEVEL)
+
+
+def start_session(testsuite, td_configuration_id, traffic_dlt=pure_pcapy.DLT_RAW, **router_kwargs):
+    """
+    Installs the in-memory event bus backend, and starts the test coordinator, packet router and packet sniffer threads
+
+    :param testsuite: test suite id (see TEST_DESCRIPTIONS_DICT)
+    :param td_configuration_id: test configuration the packet router is started with
+    :param traffic_dlt: data link type of the captures
+    :param router_kwargs: PacketRouter params (packet encoding, throughput mode..)
+    :return: coordinator, router
+    """
+    memory_broker.install()
+
+    # components open their connections (log handlers included) when imported, so only once the backend is installed
+    from event_bus_utils import publish_message
+    from messages import MsgTestingToolReady
+    from ioppytest.test_suite.testsuite import get_dict_of_all_test_cases_configurations
+    from ioppytest.test_coordinator.coordinator import Coordinator
+    from ioppytest.packet_router.__main__ import PacketRouter, generate_routing_table_from_test_configuration
+    from ioppytest.packet_sniffer.__main__ import Sniffer
+
+    for d in TMPDIR, DATADIR, LOGDIR, RESULTS_DIR, PCAP_DIR:
+        try:
+            os.makedirs(d)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    testconfig = get_dict_of_all_test_cases_configurations()[td_configuration_id]
+    router = PacketRouter(AMQP_URL, AMQP_EXCHANGE, generate_routing_table_from_test_configuration(testconfig),
+                          **router_kwargs)
+    router.daemon = True
+    router.start()
+
+    sniffer = Sniffer(traffic_dlt, AMQP_URL, AMQP_EXCHANGE)
+    sniffer_thread = threading.Thread(target=sniffer.run, name='thread_packet_sniffer')
+    sniffer_thread.daemon = True
+    sniffer_thread.start()
+
+    coordinator = Coordinator(AMQP_URL, AMQP_EXCHANGE, TEST_DESCRIPTIONS_DICT[testsuite],
+                              TEST_DESCRIPTIONS_CONFIGS_DICT[testsuite], testsuite)
+    coordinator.bootstrap()
+
+    coordinator_thread = threading.Thread(target=coordinator.run, name='thread_test_coordinator')
+    coordinator_thread.daemon = True
+    coordinator_thread.start()
+
+    connection = memory_broker.BlockingConnection()
+    publish_message(connection, MsgTestingToolReady())
+    connection.close()
+
+    logger.info('Session running in a single process (test suite: %s, configuration: %s)' %
+                (testsuite, td_configuration_id))
+
+    return coordinator, router
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("testsuite", help="Test Suite", choices=list(TEST_DESCRIPTIONS_DICT.keys()))
+    parser.add_argument("td_configuration_id", help="Test case configuration ID the packet router is started with")
+    parser.add_argument("--throughput-mode", help="Start the packet router in throughput mode", action='store_true')
+    args = parser.parse_args()
+
+    coordinator, router = start_session(args.testsuite, args.td_configuration_id,
+                                        throughput_mode=args.throughput_mode)
+
+    try:
+        router.join()
+    except (KeyboardInterrupt, SystemExit):
+        logger.info('got SIGINT. Bye bye!')
+
+
+if __name__ == '__main__':
+    main()
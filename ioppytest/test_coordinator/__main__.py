@@ -14,7 +14,7 @@ from threading import Timer
 
 from ioppytest import (AMQP_URL, AMQP_EXCHANGE, TEST_DESCRIPTIONS_DICT, TEST_DESCRIPTIONS_CONFIGS_DICT, LOGGER_FORMAT,
                        LOG_LEVEL,DATADIR, TMPDIR, LOGDIR, TD_DIR, RESULTS_DIR, PCAP_DIR)
-from ioppytest.test_coordinator.coordinator import Coordinator
+from ioppytest.test_coordinator.coordinator import Coordinator, JOURNAL_FILE
 from event_bus_utils.rmq_handler import RabbitMQHandler, JsonFormatter
 from event_bus_utils import publish_message
 from messages import MsgTestingToolReady, MsgTestingToolComponentReady, Message
@@ -48,6 +48,7 @@ READY_SIGNAL_TOUT = 45
 if __name__ == '__main__':
 
     no_component_checks = None
+    restore = None
     testsuite = None
     ted_tc_file = None
     ted_config_file = None
@@ -57,10 +58,14 @@ if __name__ == '__main__':
         parser.add_argument("testsuite", help="Test Suite", choices=list(TEST_DESCRIPTIONS_DICT.keys()))
         parser.add_argument("-ncc", "--no_component_checks", help="Do not check if other processes send ready message",
                             action="store_true")
+        parser.add_argument("-r", "--restore", help="Restore the session journaled by a previous coordinator process "
+                                                    "(e.g. after a crash), finished test cases are not re-executed",
+                            action="store_true")
         args = parser.parse_args()
 
         testsuite = args.testsuite
         no_component_checks = args.no_component_checks
+        restore = args.restore
 
         if testsuite in TEST_DESCRIPTIONS_DICT and testsuite in TEST_DESCRIPTIONS_CONFIGS_DICT:
             ted_tc_file = TEST_DESCRIPTIONS_DICT[testsuite]
@@ -163,8 +168,10 @@ if __name__ == '__main__':
     try:
         logger.info(
             'Starting test-coordinator for test suite: \n\t%s\n\t%s\n\t%s' % (ted_tc_file, ted_config_file, testsuite))
-        coordinator = Coordinator(AMQP_URL, AMQP_EXCHANGE, ted_tc_file, ted_config_file, testsuite)
-        coordinator.bootstrap()
+        coordinator = Coordinator(AMQP_URL, AMQP_EXCHANGE, ted_tc_file, ted_config_file, testsuite,
+                                  journal_file=JOURNAL_FILE)
+        if not (restore and coordinator.restore_session()):
+            coordinator.bootstrap()
         publish_message(connection, MsgTestingToolReady())
 
     except Exception as e:
@@ -3,15 +3,24 @@
 
 import os
 import pika
+import contextlib
 import logging
 import datetime
 
 from transitions.core import MachineError
 from ioppytest import AMQP_EXCHANGE, AMQP_URL, LOG_LEVEL
 from ioppytest import RESULTS_DIR
+from ioppytest.amqp_pool import get_amqp_publisher
 from event_bus_utils import amqp_request, publish_message, AmqpSynchCallTimeoutError
 from event_bus_utils.rmq_handler import RabbitMQHandler, JsonFormatter
 from ioppytest.exceptions import CoordinatorError
+from ioppytest.packet_sniffer.capture_transfer import CaptureTransferClient, CaptureTransferError
+from ioppytest.packet_sniffer.capture_compression import get_compression, get_capture_filename
+from ioppytest.messages_extensions import (
+    MsgSniffingExtractCapture,
+    MsgSniffingStreamCapture,
+    MsgSniffingStreamCaptureReply,
+)
 from messages import *
 
 # TODO these VARs need to come from the session orchestrator + test configuratio files
@@ -84,6 +93,9 @@ class CoordinatorAmqpInterface:
             MsgTestCaseSkip: 'skip_testcase',
         }
 
+        # publishing goes through the process-wide pool of connections
+        self.publisher = get_amqp_publisher(self.amqp_url, self.amqp_exchange)
+
         # amqp connect to bus & subscribe to events
         self.amqp_connect()
         self.amqp_create_queues_bind_and_susbcribe()
@@ -160,50 +172,14 @@ class CoordinatorAmqpInterface:
 
     def _publish_message(self, message):
         """
-        Generic publish message which uses class connection
+        Generic publish message which uses the process-wide pool of connections
         Publishes message into the correct topic (uses Message object metadata)
-        Creates temporary channel on it's own
-        Connection must be a pika.BlockingConnection
         """
-        #publish_message(self.connection, message)
-
-        connection = None
-        channel = None
-        properties = pika.BasicProperties(**message.get_properties())
-
         logger.info("PUBLISHING to routing_key: %s, msg: %s"
                     % (message.routing_key,
                        repr(message)[:70],))
-        try:
-            # channel = self.connection.channel()
-            connection = self.get_new_amqp_connection()
-            channel = connection.channel()
-            channel.basic_publish(
-                exchange=AMQP_EXCHANGE,
-                routing_key=message.routing_key,
-                properties=properties,
-                body=message.to_json(),
-            )
-
-        except (pika.exceptions.ConnectionClosed, BrokenPipeError):
-            print("Log handler connection closed. Reconnecting..")
-            connection = pika.BlockingConnection(pika.URLParameters(AMQP_URL))
-            channel = connection.channel()
-
-            # send retry
-            channel.basic_publish(
-                exchange=AMQP_EXCHANGE,
-                routing_key=message.routing_key,
-                properties=properties,
-                body=message.to_json(),
-            )
 
-        finally:
-            if channel and channel.is_open:
-                channel.close()
-
-            if connection and connection.is_open:
-                connection.close()
+        self.publisher.publish_message(message)
 
     def handle_service(self, ch, method, props, body):
 
@@ -475,6 +451,51 @@ class CoordinatorAmqpInterface:
         except AmqpSynchCallTimeoutError as e:
             logger.error("Sniffer API didn't respond. Maybe it isn't up yet?. More info: %s" % e)
 
+    def call_service_sniffer_extract_capture(self, **kwargs):
+
+        try:
+            response = amqp_request(self.connection,
+                                    MsgSniffingExtractCapture(**kwargs),
+                                    COMPONENT_ID,
+                                    use_message_typing=True)
+            logger.info("Received answer from sniffer: %s, answer: %s" % (response.routing_key, repr(response)))
+            return response
+        except AmqpSynchCallTimeoutError as e:
+            logger.error("Sniffer API didn't respond. Maybe it isn't up yet?. More info: %s" % e)
+
+    def call_service_sniffer_stream_capture(self, capture_id, dump_dir, compression=None):
+        """
+        Gets the capture from the sniffer as a stream of chunks, written into dump_dir/<capture_id>.pcap (or
+        <capture_id>.pcap.gz if the sniffer sent it compressed)
+        :return: MsgSniffingStreamCaptureReply, with ok=False if the transfer failed
+        """
+        partial_path = os.path.join(dump_dir, '%s.pcap.part' % capture_id)
+        client = CaptureTransferClient(self.connection, COMPONENT_ID, self.amqp_exchange)
+
+        try:
+            with open(partial_path, 'wb') as f:
+                response = client.stream(capture_id, f, compression=compression)
+            file_compression = get_compression(getattr(response, 'file_enc', None))
+            filename = get_capture_filename('%s.pcap' % capture_id, file_compression)
+            os.replace(partial_path, os.path.join(dump_dir, filename))
+            logger.info("Capture received from sniffer: %s (%s bytes, %s chunks, %s)" %
+                        (filename, response.total_size, response.chunks, response.file_enc))
+            return response
+        except (CaptureTransferError, ValueError, OSError) as e:
+            logger.error("Couldn't get capture from sniffer. More info: %s" % e)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(partial_path)
+            # no capture, the template's capture fields are overwritten
+            request = MsgSniffingStreamCapture(capture_id=capture_id, compression=compression)
+            return MsgSniffingStreamCaptureReply(request,
+                                                 ok=False,
+                                                 error_message="Couldn't get capture from sniffer: %s" % e,
+                                                 filename='%s.pcap' % capture_id,
+                                                 file_enc=None,
+                                                 total_size=0,
+                                                 chunks=0,
+                                                 checksum='')
+
     def call_service_testcase_analysis(self, **kwargs):
 
         try:
@@ -488,5 +509,14 @@ class CoordinatorAmqpInterface:
         except AmqpSynchCallTimeoutError as e:
             raise e  # let caller handle it
 
-    def call_service_router_drop_packets(self, number_packets_to_drop=3):
-        self._publish_message(MsgRoutingStartLossyLink(number_of_packets_to_drop=number_packets_to_drop))
+    def call_service_router_drop_packets(self, number_packets_to_drop=3, nodes=None, impairments=None):
+        """
+        :param nodes: nodes of the impaired link, if None the router drops the next packets of any link
+        :param impairments: dict with link impairments (loss, delay, jitter, duplication, reorder),
+            see ioppytest.packet_router.impairments
+        """
+        kwargs = {'number_of_packets_to_drop': number_packets_to_drop}
+        if nodes:
+            kwargs['nodes'] = nodes
+            kwargs['impairments'] = impairments
+        self._publish_message(MsgRoutingStartLossyLink(**kwargs))
@@ -2,6 +2,7 @@
 # !/usr/bin/env python3
 
 import os
+import time
 import base64
 from urllib.parse import urlparse
 
@@ -11,16 +12,28 @@ from transitions.extensions.states import add_state_features, Tags, Timeout
 from ioppytest import TMPDIR, PCAP_DIR, RESULTS_DIR, AMQP_URL, LOG_LEVEL, AMQP_EXCHANGE
 from ioppytest.test_coordinator.amqp_connector import CoordinatorAmqpInterface
 from ioppytest.test_coordinator.states_and_transitions import transitions, states
+from ioppytest.test_coordinator.journal import SessionJournal
 from ioppytest.test_suite.testsuite import TestSuite
 
 from ioppytest.exceptions import CoordinatorError
+from ioppytest.packet_sniffer.capture_compression import get_compression, get_capture_filename, open_capture
 from messages import *
 from event_bus_utils import AmqpSynchCallTimeoutError
 from event_bus_utils.rmq_handler import RabbitMQHandler, JsonFormatter
 
 ANALYSIS_MODE = 'post_mortem'  # either step_by_step or post_mortem # TODO test suite param?
-SNIFFER_FILTER_IF = 'tun0'  # TODO test suite param?, # if left empty packet_sniffer chooses the loopback
+SNIFFER_FILTER_IF = None  # TODO test suite param?, None: packets of all agents' interfaces (tun or serial) are captured
 LOSSY_CONTEXT__NUMBER_OF_PACKETS_TO_DROP = 2  # TODO test suite param?
+PCAP_COMPRESSION = os.environ.get('PCAP_COMPRESSION')  # 'gzip' -> captures transferred and stored compressed
+JOURNAL_FILE = os.environ.get('COORDINATOR_JOURNAL', os.path.join(TMPDIR, 'coordinator_journal.jsonl'))
+
+# FSM states restored as they are, the others are transitory or have an ongoing test case (see restore_session)
+RESTORABLE_STATES = (
+    'waiting_for_testsuite_config',
+    'waiting_for_testsuite_start',
+    'waiting_for_testcase_start',
+    'testsuite_finished',
+)
 
 # component identification & bus params
 COMPONENT_ID = '%s|%s' % ('test_coordinator', 'FSM')
@@ -52,20 +65,89 @@ class Coordinator(CoordinatorAmqpInterface):
     """
     component_id = 'test_coordinator'
 
-    def __init__(self, amqp_url, amqp_exchange, ted_tc_file, ted_config_file, testsuite_name):
+    def __init__(self, amqp_url, amqp_exchange, ted_tc_file, ted_config_file, testsuite_name, journal_file=None):
         self.event = None
         self.testsuite_name = testsuite_name
 
         # testsuite init
         self.testsuite = TestSuite(ted_tc_file, ted_config_file)
 
+        # links (tuple of nodes) with impairments configured in the packet router
+        self.impaired_links = set()
+
+        # time window of the ongoing test case, for extracting its capture from the sniffer's ring buffer if the
+        # sniffer couldn't be started
+        self.capture_t_start = None
+        self.capture_start_failed = False
+
+        # session state is journaled on each FSM transition, for restoring it if the coordinator crashes
+        self.journal = SessionJournal(journal_file) if journal_file else None
+        self._journal_all_testcases = True  # next snapshot includes all test cases, not only the changed ones
+
         # init amqp interface
         super(Coordinator, self).__init__(amqp_url, amqp_exchange)
 
         self.machine = CustomStateMachine(model=self,
                                           states=states,
                                           transitions=transitions,
-                                          initial='null')
+                                          initial='null',
+                                          after_state_change='save_session_snapshot')
+
+    def get_session_snapshot(self, testcases=None):
+        """
+        :param testcases: ids of the test cases included in the snapshot, all of them if None
+        """
+        testsuite_state, testcases_state = self.testsuite.get_execution_state(testcases)
+        return {
+            'fsm': {'state': self.state},
+            'coordinator': {'impaired_links': sorted(list(link) for link in self.impaired_links)},
+            'testsuite': testsuite_state,
+            'testcases': testcases_state,
+        }
+
+    def save_session_snapshot(self, *args, **kwargs):
+        if self.journal is None:
+            return
+
+        # only the test cases which changed are serialized, the journal diffs the rest of the sections
+        changed = self.testsuite.pop_changed_testcases()
+        try:
+            self.journal.append(self.get_session_snapshot(None if self._journal_all_testcases else changed))
+            self._journal_all_testcases = False
+        except (OSError, TypeError, ValueError) as e:  # never break the session for the journal
+            logger.error('Could not journal session state: %s' % e)
+            self._journal_all_testcases = True  # changes not journaled
+
+    def restore_session(self):
+        """
+        Restores the session journaled by a previous coordinator process (e.g. after a crash). Test cases already
+        finished or skipped are not re-executed, a test case which was ongoing is restarted.
+
+        :return: True if a session was restored, False if there's nothing to restore (bootstrap instead)
+        """
+        snapshot = self.journal.load() if self.journal else None
+        if snapshot is None or snapshot['fsm']['state'] in ('null', 'bootstrapping'):
+            logger.info('No session to restore')
+            return False
+
+        self.testsuite.restore_execution_state(snapshot['testsuite'], snapshot['testcases'])
+        self.impaired_links = set(tuple(link) for link in snapshot['coordinator']['impaired_links'])
+
+        state = snapshot['fsm']['state']
+        current_tc = self.testsuite.get_current_testcase()
+        if state in RESTORABLE_STATES:
+            self.machine.set_state(state)
+        elif current_tc is not None and current_tc.state not in ('finished', 'skipped'):
+            logger.warning('Test case %s was ongoing (%s), restarting it' % (current_tc.id, state))
+            current_tc.reinit()
+            self.to_preparing_next_testcase(MsgTestCaseRestart())
+        else:
+            self.to_preparing_next_testcase(None)
+
+        logger.info('Session %s restored, FSM state: %s (journaled: %s)' % (self.testsuite.session_id,
+                                                                            self.state, state))
+        self.save_session_snapshot()
+        return True
 
     def _set_received_event(self, event=None):
         if event is None:
@@ -272,24 +354,31 @@ class Coordinator(CoordinatorAmqpInterface):
         tc_id = current_tc.id
         tc_ref = current_tc.uri
 
-        # Stop sniffing packets for this test case
+        # Stop sniffing packets for this test case, sniffer replies once the capture is flushed to disk
         logger.debug("Sending sniffer stop request...")
-        self.call_service_sniffer_stop()
-        time.sleep(0.1)
+        stop_response = self.call_service_sniffer_stop()
+        if stop_response and stop_response.ok:
+            logger.debug("Capture closed by sniffer (%s frames)" % getattr(stop_response, 'frames', '?'))
+
+        if self.capture_start_failed:
+            logger.warning("Sniffer wasn't capturing during test case, extracting capture from its ring buffer...")
+            self.call_service_sniffer_extract_capture(capture_id=tc_id, t_start=self.capture_t_start,
+                                                      t_end=time.time())
 
-        # Get capture of test case
-        logger.debug("Sending get capture request to sniffer...")
-        sniffer_response = self.call_service_sniffer_get_capture(capture_id=tc_id)
+        # Get capture of test case (streamed by chunks straight into PCAP_DIR)
+        logger.debug("Sending stream capture request to sniffer...")
+        sniffer_response = self.call_service_sniffer_stream_capture(capture_id=tc_id, dump_dir=PCAP_DIR,
+                                                                    compression=PCAP_COMPRESSION)
 
-        # Save .pcap file locally
+        # Load .pcap file saved locally (decompressed if stored compressed), TAT expects it base64 encoded
         try:
             if sniffer_response.ok:
-                pcap_file_base64 = sniffer_response.value
-                filename = sniffer_response.filename
+                compression = get_compression(getattr(sniffer_response, 'file_enc', None))
+                filename = get_capture_filename(sniffer_response.filename, compression)
 
-                with open(os.path.join(PCAP_DIR, filename), "wb") as pcap_file:
-                    nb = pcap_file.write(base64.b64decode(pcap_file_base64))
-                    logger.debug("Pcap correctly saved (%d Bytes) at %s" % (nb, TMPDIR))
+                with open_capture(os.path.join(PCAP_DIR, filename)) as pcap_file:
+                    pcap_file_base64 = base64.b64encode(pcap_file.read()).decode('utf-8')
+                    logger.debug("Pcap correctly saved (%d Bytes) at %s" % (sniffer_response.total_size, PCAP_DIR))
             else:
                 error_msg = 'Error encountered with packet sniffer: %s' % repr(sniffer_response)
                 logger.warning(error_msg)
@@ -455,6 +544,8 @@ class Coordinator(CoordinatorAmqpInterface):
 
         # start sniffing each link
         config = self.testsuite.get_current_testcase_configuration()
+        self.capture_t_start = time.time()
+        self.capture_start_failed = False
 
         for link in config.topology:
             filter_proto = link['capture_filter']
@@ -465,21 +556,29 @@ class Coordinator(CoordinatorAmqpInterface):
                 'filter_proto': filter_proto,
                 'filter_if': SNIFFER_FILTER_IF,
                 'link_id': link_id,
+                'nodes': link['nodes'],
             }
 
             # sniffer calls are blocking
-            if self.call_service_sniffer_start(**sniff_params):
+            response = self.call_service_sniffer_start(**sniff_params)
+            if response and response.ok:
                 logger.debug('Sniffer successfully started')
             else:
                 logger.error("Sniffer COULDN'T be started")
+                self.capture_start_failed = True
 
-            #check if we need to trigger some special behaviour (e.g. f links)
-            try:
-                special_mode = link['special_mode']
-                if special_mode == "lossy_context":
-                    self.call_service_router_drop_packets(number_packets_to_drop = LOSSY_CONTEXT__NUMBER_OF_PACKETS_TO_DROP)
-            except KeyError:
-                pass
+            # check if we need to trigger some special behaviour (e.g. lossy links)
+            link_nodes = tuple(link['nodes'])
+            if link.get('special_mode') == "lossy_context":
+                self.call_service_router_drop_packets(number_packets_to_drop=LOSSY_CONTEXT__NUMBER_OF_PACKETS_TO_DROP,
+                                                      nodes=list(link_nodes),
+                                                      impairments=link.get('impairments'))
+                self.impaired_links.add(link_nodes)
+
+            elif link_nodes in self.impaired_links:
+                # link impaired by a previous test case, let's reset it
+                self.call_service_router_drop_packets(number_packets_to_drop=0, nodes=list(link_nodes))
+                self.impaired_links.discard(link_nodes)
 
     def _prepare_next_testcase(self, received_event):
         logger.info('Preparing next testcase..')
@@ -545,6 +644,9 @@ class Coordinator(CoordinatorAmqpInterface):
         return False
 
     def handle_bootstrap(self):
+        if self.journal:
+            self.journal.clear()  # new session
+            self._journal_all_testcases = True
         self.trigger('_bootstrapped', None)
 
     def handle_finish_testcase(self, received_event):
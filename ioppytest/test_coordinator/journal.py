@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/env python3
+
+"""
+Append-only journal of the coordinator's session state, for restoring a session after a crash of the coordinator.
+
+A snapshot is a dict of sections, each section a dict of JSON serializable items, e.g.:
+
+    {
+        'fsm': {'state': 'waiting_for_step_executed'},
+        'testsuite': {'current_tc': 'TD_COAP_CORE_01', 'addressing_table': {...}, 'nodes_configured': [...], ...},
+        'testcases': {'TD_COAP_CORE_01': {'state': 'executing', 'steps': [...], ...}, ...},
+    }
+
+Snapshots are taken on every FSM transition, but only the items which changed since the previous snapshot are
+appended (one JSON line per snapshot), replaying the journal merges them back into the last snapshot.
+
+>>> journal = SessionJournal('tmp/coordinator_journal.jsonl')
+>>> journal.clear()
+>>> journal.append({'fsm': {'state': 'waiting_for_testsuite_config'}, 'testcases': {'TD_COAP_CORE_01': {...}}})
+>>> journal.append({'fsm': {'state': 'waiting_for_testsuite_start'}, 'testcases': {'TD_COAP_CORE_01': {...}}})
+>>> SessionJournal('tmp/coordinator_journal.jsonl').load()
+{'fsm': {'state': 'waiting_for_testsuite_start'}, 'testcases': {'TD_COAP_CORE_01': {...}}}
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+
+from ioppytest import LOG_LEVEL
+
+COMPONENT_ID = '%s|%s' % ('test_coordinator', 'journal')
+
+logger = logging.getLogger(COMPONENT_ID)
+logger.setLevel(LOG_LEVEL)
+
+
+class SessionJournal:
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._written = {}  # (section, key) -> item as last written (json)
+        self._lock = threading.Lock()  # FSM timeouts trigger transitions from timer threads
+
+    def _open(self, mode):
+        if self._file is not None:
+            self._file.close()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._file = open(self.path, mode)
+
+    def clear(self):
+        """
+        Truncates the journal (new session)
+        """
+        with self._lock:
+            self._open('w')
+            self._written.clear()
+
+    def append(self, snapshot):
+        """
+        Appends the items of the snapshot which changed since the last appended (or loaded) one
+        :return: number of items written
+        """
+        with self._lock:
+            delta = {}
+            for section, items in snapshot.items():
+                for key, value in items.items():
+                    encoded = json.dumps(value, sort_keys=True)
+                    if self._written.get((section, key)) != encoded:
+                        delta.setdefault(section, {})[key] = value
+                        self._written[(section, key)] = encoded
+
+            if not delta:
+                return 0
+
+            if self._file is None:
+                self._open('a')
+
+            # flushed, so the record survives a crash of the process
+            self._file.write(json.dumps({'t': time.time(), 'delta': delta}) + '\n')
+            self._file.flush()
+            return sum(len(items) for items in delta.values())
+
+    def load(self):
+        """
+        Replays the journal, following appends continue from the loaded snapshot
+        :return: last snapshot, None if the journal is empty or doesn't exist
+        """
+        snapshot = {}
+        count = 0
+        size = 0  # of the valid records
+        try:
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b'\n'):
+                            raise ValueError('truncated record')
+                        delta = json.loads(line.decode('utf-8'))['delta']
+                    except (ValueError, KeyError):
+                        # record being written when the process died, dropped so appends start on a new line
+                        logger.warning('Dropping truncated record %s of journal %s' % (count + 1, self.path))
+                        os.truncate(self.path, size)
+                        break
+                    for section, items in delta.items():
+                        snapshot.setdefault(section, {}).update(items)
+                    count += 1
+                    size += len(line)
+        except FileNotFoundError:
+            return None
+
+        with self._lock:
+            self._written = {
+                (section, key): json.dumps(value, sort_keys=True)
+                for section, items in snapshot.items()
+                for key, value in items.items()
+            }
+
+        logger.info('Journal %s replayed: %s records' % (self.path, count))
+        return snapshot or None
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/env python3
+
+"""
+Compiled cache of the test description and test configuration yaml files.
+
+Parsing the yaml files (~11k lines) takes seconds, and it's done by every component importing the test suite, at
+each container start. The documents of each file are parsed once, and stored (pickled) in the cache dir, keyed by
+the hash of the file's content, so any edit of a yaml file invalidates its entry. Cache misses are parsed with the
+libyaml (C) loader when available.
+
+Cached documents are the !testcase / !configuration mappings (constructor kwargs), not model objects, so entries
+don't depend on the models' implementation, and each load builds new (mutable) TestCase / TestConfig objects.
+
+The cache can be prebuilt (e.g. when building the docker images), default dir: TD_CACHE_DIR env var or tmp/td_cache
+Entries are unpickled, so the cache dir is created private (0700), and a cache dir or entry which isn't owned by the
+current user (or root) or is writable by other users is ignored.
+
+>>> python3 -m ioppytest.test_descriptions.td_cache
+>>> load_yaml_documents(TD_COAP_CORE)
+[YamlDocument(tag='!testcase', mapping={'testcase_id': 'TD_COAP_CORE_01', ...}), ...]
+"""
+
+import os
+import sys
+import stat
+import pickle
+import hashlib
+import logging
+import argparse
+import tempfile
+import collections
+
+import yaml
+
+from ioppytest import TMPDIR, LOG_LEVEL, LOGGER_FORMAT, TEST_DESCRIPTIONS_DICT, TEST_DESCRIPTIONS_CONFIGS_DICT
+
+COMPONENT_ID = 'td_cache'
+
+TD_CACHE_DIR = os.environ.get('TD_CACHE_DIR', os.path.join(TMPDIR, 'td_cache'))
+TD_CACHE_VERSION = 1  # bump if the format of the cached documents changes
+TD_CACHE_SUFFIX = '.pickle'
+
+TESTCASE_TAG = '!testcase'
+CONFIGURATION_TAG = '!configuration'
+
+logger = logging.getLogger(COMPONENT_ID)
+logger.setLevel(LOG_LEVEL)
+
+YamlDocument = collections.namedtuple('YamlDocument', ['tag', 'mapping'])
+
+_FastLoader = getattr(yaml, 'CFullLoader', yaml.FullLoader)
+
+
+class DocumentLoader(_FastLoader):
+    """
+    Loads the !testcase / !configuration nodes as YamlDocument (tag, mapping)
+    """
+    pass
+
+
+def _document_constructor(loader, node):
+    return YamlDocument(node.tag, loader.construct_mapping(node, deep=True))
+
+
+DocumentLoader.add_constructor(TESTCASE_TAG, _document_constructor)
+DocumentLoader.add_constructor(CONFIGURATION_TAG, _document_constructor)
+
+# hash -> pickled documents, already loaded (or built) by this process
+_memory_cache = {}
+
+
+def get_content_hash(content):
+    return hashlib.sha256(b'%d:' % TD_CACHE_VERSION + content).hexdigest()
+
+
+def parse_yaml_documents(content):
+    """
+    :param content: yaml file (bytes)
+    :return: list of documents in the file
+    """
+    return list(yaml.load_all(content, Loader=DocumentLoader))
+
+
+def _is_trusted(path):
+    """
+    :return: True if path is owned by the current user (or root) and not writable by other users
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return st.st_uid in (0, os.getuid()) and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def _get_trusted_cache_dir(cache_dir):
+    """
+    :return: cache_dir (created private if missing), None if it can't be trusted
+    """
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    except OSError as e:
+        logger.debug('Could not create test description cache dir %s: %s' % (cache_dir, e))
+        return None
+
+    if not _is_trusted(cache_dir):
+        logger.warning('Test description cache dir %s is not owned by the current user or is writable by other users, '
+                       'cache not used' % cache_dir)
+        return None
+    return cache_dir
+
+
+def _write_entry(cache_dir, content_hash, entry):
+    """
+    Writes the cache entry atomically (components starting concurrently may share the cache dir), a read-only cache
+    dir is not an error
+    """
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(entry)
+        os.replace(tmp_path, os.path.join(cache_dir, content_hash + TD_CACHE_SUFFIX))
+    except OSError as e:
+        logger.debug('Could not write test description cache entry %s: %s' % (content_hash, e))
+
+
+def _get_entry(path, cache_dir):
+    with open(path, 'rb') as f:
+        content = f.read()
+
+    content_hash = get_content_hash(content)
+    entry = _memory_cache.get(content_hash)
+    if entry is not None:
+        return entry
+
+    cache_dir = _get_trusted_cache_dir(cache_dir) if cache_dir else None
+    entry_path = os.path.join(cache_dir, content_hash + TD_CACHE_SUFFIX) if cache_dir else None
+    if entry_path and os.path.exists(entry_path) and _is_trusted(entry_path):
+        with open(entry_path, 'rb') as f:
+            entry = f.read()
+    else:
+        logger.debug('Test description cache miss, parsing %s' % path)
+        entry = pickle.dumps(parse_yaml_documents(content), protocol=pickle.HIGHEST_PROTOCOL)
+        if cache_dir:
+            _write_entry(cache_dir, content_hash, entry)
+
+    _memory_cache[content_hash] = entry
+    return entry
+
+
+def load_yaml_documents(path, cache_dir=TD_CACHE_DIR):
+    """
+    :param path: test description or test configuration yaml file
+    :param cache_dir: dir of the compiled cache, if None only this process' memory cache is used
+    :return: list of documents in the file (YamlDocument for testcases and configurations), new objects at each call
+    """
+    try:
+        return pickle.loads(_get_entry(path, cache_dir))
+    except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:  # corrupted entry
+        logger.warning('Corrupted test description cache entry for %s (%s), parsing yaml file' % (path, e))
+        with open(path, 'rb') as f:
+            return parse_yaml_documents(f.read())
+
+
+def get_all_yaml_files():
+    files = []
+    for td_dict in TEST_DESCRIPTIONS_DICT, TEST_DESCRIPTIONS_CONFIGS_DICT:
+        for td_files in td_dict.values():
+            files += [f for f in td_files if f not in files]
+    return files
+
+
+def build_cache(files=None, cache_dir=TD_CACHE_DIR):
+    """
+    Parses the yaml files and stores them in the cache dir
+    :return: number of documents cached
+    """
+    count = 0
+    for path in files or get_all_yaml_files():
+        count += len(load_yaml_documents(path, cache_dir))
+        logger.info('Cached %s' % path)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Prebuild the compiled cache of test descriptions')
+    parser.add_argument('files', nargs='*', help='yaml files (default: all test descriptions and configurations)')
+    parser.add_argument('-d', '--cache-dir', default=TD_CACHE_DIR, help='cache dir (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format=LOGGER_FORMAT)
+    count = build_cache(args.files, args.cache_dir)
+    logger.info('%s documents cached in %s' % (count, args.cache_dir))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,11 +6,16 @@ __all__ = [
     'TestConfig',  # model
     'Iut',  # model
     'Step',  # model
+    'TestCaseDescription',  # model
+    'StepDescription',  # model
     'get_list_of_all_test_cases',
     'get_dict_of_all_test_cases',
     'get_list_of_all_test_cases_configurations',
     'get_dict_of_all_test_cases_configurations',
+    'get_dict_of_test_cases',
+    'get_dict_of_test_cases_configurations',
     'get_test_cases_list_from_yaml',
     'get_test_configurations_list_from_yaml',
     'import_test_description_from_yaml',
+    'load_test_descriptions',
 ]
@@ -1,22 +1,22 @@
 # -*- coding: utf-8 -*-
 # !/usr/bin/env python3
-import os
 import json
 import yaml
+import heapq
 import logging
 
 from ioppytest import (
     TEST_DESCRIPTIONS_CONFIGS_DICT,
     TEST_DESCRIPTIONS_DICT,
-    TD_DIR,
     AMQP_URL,
     AMQP_EXCHANGE,
     LOG_LEVEL,
 )
 
-from itertools import cycle
 from collections import OrderedDict
+from collections.abc import Mapping
 from ioppytest.exceptions import TestSuiteError
+from ioppytest.test_descriptions.td_cache import load_yaml_documents, YamlDocument, TESTCASE_TAG, CONFIGURATION_TAG
 from event_bus_utils.rmq_handler import RabbitMQHandler, JsonFormatter
 
 """
@@ -28,10 +28,11 @@ Provides functions for building verdicts based on Step results (notably checks a
 
 >>> from ioppytest.test_suite import *
 >>> dir()
-['Iut', 'Step', 'TestCase', 'TestConfig', 'TestSuite', '__annotations__', '__builtins__', '__doc__', '__loader__', 
-'__name__', '__package__', '__spec__', 'get_dict_of_all_test_cases', 'get_dict_of_all_test_cases_configurations', 
-'get_list_of_all_test_cases', 'get_list_of_all_test_cases_configurations', 'get_test_cases_list_from_yaml', 
-'get_test_configurations_list_from_yaml', 'import_test_description_from_yaml']
+['Iut', 'Step', 'StepDescription', 'TestCase', 'TestCaseDescription', 'TestConfig', 'TestSuite', '__annotations__',
+'__builtins__', '__doc__', '__loader__', '__name__', '__package__', '__spec__', 'get_dict_of_all_test_cases',
+'get_dict_of_all_test_cases_configurations', 'get_dict_of_test_cases', 'get_dict_of_test_cases_configurations',
+'get_list_of_all_test_cases', 'get_list_of_all_test_cases_configurations', 'get_test_cases_list_from_yaml',
+'get_test_configurations_list_from_yaml', 'import_test_description_from_yaml', 'load_test_descriptions']
 
 >>> from ioppytest import *
 >>> TEST_DESCRIPTIONS_DICT['coap']
@@ -153,14 +154,100 @@ def list_to_str(ls):
 # # # # TestSuite, TestCase and TestConfig Models # # # # # # # # # # # # #
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
+class TestCaseScheduler:
+    """
+    Index of the test suite's test cases, kept up to date on each test case state change:
+        - test cases by id
+        - test cases by state
+        - queue of the pending test cases (state None), in test suite order
+        - test cases which changed state since the last pop_changed (e.g. for journaling only those)
+
+    so picking the next test case, or checking if the test suite is finished, doesn't scan the test cases.
+    """
+
+    UNFINISHED_STATES = (None, 'executing', 'ready_for_analysis', 'analyzing')
+
+    def __init__(self, testcases):
+        self.testcases = OrderedDict()  # id -> TestCase, in test suite order
+        self.positions = {}  # id -> position in test suite
+        self.ids = []  # position -> id
+        self.by_state = {}  # state -> {id: TestCase}
+        self._pending = []  # heap of positions of test cases which may be in state None (lazily cleaned)
+        self._changed = set()  # ids
+
+        for tc in testcases:
+            self.add(tc)
+
+    def add(self, tc):
+        if tc.id in self.testcases:  # replaces test case with same id, keeps its position
+            self.by_state[self.testcases[tc.id].state].pop(tc.id, None)
+        else:
+            self.positions[tc.id] = len(self.ids)
+            self.ids.append(tc.id)
+        self.testcases[tc.id] = tc
+        self._changed.add(tc.id)
+        self._index(tc, tc.state)
+        tc.add_state_listener(self.on_state_change)
+
+    def _index(self, tc, state):
+        self.by_state.setdefault(state, OrderedDict())[tc.id] = tc
+        if state is None:
+            heapq.heappush(self._pending, self.positions[tc.id])
+
+    def on_state_change(self, tc, old_state, new_state):
+        if self.testcases.get(tc.id) is not tc:
+            return
+        self._changed.add(tc.id)  # also when re-set to the same state, e.g. reinit of its steps
+        if old_state == new_state:
+            return
+        self.by_state[old_state].pop(tc.id, None)
+        self._index(tc, new_state)
+
+    def pop_changed(self):
+        """
+        :return: ids of the test cases added or which changed state since the previous call
+        """
+        changed, self._changed = self._changed, set()
+        return changed
+
+    def get(self, testcase_id):
+        """
+        :return: TestCase or None if non existent
+        """
+        return self.testcases.get(testcase_id)
+
+    def next_pending(self):
+        """
+        :return: first test case (test suite order) not executed nor skipped, None if there's none
+        """
+        pending = self.by_state.get(None, {})
+        while self._pending:
+            tc_id = self.ids[self._pending[0]]
+            if tc_id in pending:
+                return pending[tc_id]
+            heapq.heappop(self._pending)  # not pending anymore (or duplicated entry)
+        return None
+
+    def get_testcases_in_state(self, *states):
+        return [tc for state in states for tc in self.by_state.get(state, {}).values()]
+
+    def count(self, *states):
+        return sum(len(self.by_state.get(state, {})) for state in states)
+
+    def all_finished(self):
+        return self.count(*self.UNFINISHED_STATES) == 0
+
+
 class TestSuite:
+    """
+    Execution state of a session (test cases and steps states, verdicts, addressing table, ...). The test descriptions
+    are parsed once per process and shared by the sessions, see load_test_descriptions.
+    """
+
     def __init__(self, ted_tc_file, ted_config_file):
 
-        # first let's import the TC configurations
-        if type(ted_config_file) is list:
-            ted_config_file = merge_yaml_files(ted_config_file)
-        imported_configs = import_test_description_from_yaml(ted_config_file)
-        self.tc_configs = OrderedDict()
+        testcase_descriptions, tc_configs = load_test_descriptions(ted_tc_file, ted_config_file)
+        self.tc_configs = OrderedDict(tc_configs)
 
         self.agents = set()
         self.addressing_table = dict()
@@ -168,8 +255,7 @@ class TestSuite:
         # TODO deprecate the node configuration principle maybe? This only makes sense if we have a config per TC
         self.nodes_configured = set()
 
-        for tc_config in imported_configs:
-            self.tc_configs[tc_config.id] = tc_config
+        for tc_config in self.tc_configs.values():
             self.agents |= set(tc_config.nodes)
             # set default addressing table
             for item in tc_config.get_default_addressing_table():
@@ -187,22 +273,11 @@ class TestSuite:
         logger.info('Import: agents participating in TC_CONFIG: %s' % list(self.agents))
         logger.info('Import: default addressing table loaded from TC_CONFIGs: %s' % (self.addressing_table))
 
-        for key, val in self.tc_configs.items():
-            logger.info('Import: test configuration imported from YAML: %s' % key)
-
-        # lets import TCs and make sure there's a tc config for each one of them
-        if type(ted_tc_file) is list:
-            ted_tc_file = merge_yaml_files(ted_tc_file)
-        imported_TDs = import_test_description_from_yaml(ted_tc_file)
-        self.test_descriptions_dict = OrderedDict()
-        for ted in imported_TDs:
-            self.test_descriptions_dict[ted.id] = ted
-            assert ted.configuration_id in self.tc_configs, \
-                "Missing config: %s for test case: %s " % (ted.configuration_id, ted.id)
+        # test cases (this session's execution state) indexed by id and state, and queue of the pending ones
+        self.scheduler = TestCaseScheduler(TestCase.from_description(ted) for ted in testcase_descriptions.values())
+        self.test_descriptions_dict = self.scheduler.testcases
 
         logger.info('Import: %s TC execution scripts imported' % len(self.test_descriptions_dict))
-        for key, val in self.test_descriptions_dict.items():
-            logger.info('test case imported from YAML: %s' % key)
 
         self.current_tc = None
 
@@ -239,26 +314,11 @@ class TestSuite:
 
     def next_testcase(self):
         """
-        Circularly iterates over the testcases, the returned on (returned as current_tc) must be
-        a non executed, or skipped one
+        Gets the first testcase (in test suite order) which is neither executed nor skipped, as current_tc
+        (testcase can eventually be executed out of order due tu user selection)
         :return: current test case (Tescase object) or None if nothing else left to execute
         """
-
-        # _TD_it is a circular iterator over TC objects
-        # (testcase can eventually be executed out of order due tu user selection)
-        self._TD_it = cycle(self.test_descriptions_dict.values())
-
-        self.current_tc = next(self._TD_it)
-
-        # get next not executed nor skipped testcase:
-        max_iters = len(self.test_descriptions_dict)
-        while self.current_tc.state is not None:
-            self.current_tc = self._TD_it.__next__()
-            max_iters -= 1
-            if max_iters < 0:
-                self.current_tc = None
-                return None
-
+        self.current_tc = self.scheduler.next_pending()
         return self.current_tc
 
     def go_to_testcase(self, testcase_id):
@@ -338,6 +398,57 @@ class TestSuite:
         elif self.session_selected_tc_list:
             self.configure_testsuite(self.session_selected_tc_list)
 
+    def pop_changed_testcases(self):
+        """
+        Steps and verdicts only change within the current test case, other test cases only change through their
+        state (see TestCaseScheduler)
+        :return: ids of the test cases which may have changed since the previous call, and the current one
+        """
+        changed = self.scheduler.pop_changed()
+        if self.current_tc is not None:
+            changed.add(self.current_tc.id)
+        return changed
+
+    def get_execution_state(self, testcases=None):
+        """
+        :param testcases: ids of the test cases to include, all of them if None (see pop_changed_testcases)
+        :return: JSON serializable session state, test cases' execution state indexed by id (see TestCase)
+        """
+        testsuite_state = {
+            'current_tc': self.get_current_testcase_id(),
+            'session_id': self.session_id,
+            'session_users': self.session_users,
+            'session_configuration': self.session_configuration,
+            'session_selected_tc_list': self.session_selected_tc_list,
+            'addressing_table': {node: list(address) for node, address in self.addressing_table.items()},
+            'nodes_configured': sorted(self.nodes_configured),
+            'report': self.report,
+        }
+        testcases_state = OrderedDict(
+            (tc_id, tc.get_execution_state()) for tc_id, tc in self.test_descriptions_dict.items()
+            if testcases is None or tc_id in testcases
+        )
+        return testsuite_state, testcases_state
+
+    def restore_execution_state(self, testsuite_state, testcases_state):
+        """
+        :param testsuite_state, testcases_state: as returned by get_execution_state
+        """
+        for tc_id, execution_state in testcases_state.items():
+            tc = self.get_testcase(tc_id)
+            if tc is None:
+                raise TestSuiteError('Cannot restore state of test case %s, not in the test suite' % tc_id)
+            tc.restore_execution_state(execution_state)
+
+        self.current_tc = self.get_testcase(testsuite_state['current_tc']) if testsuite_state['current_tc'] else None
+        self.session_id = testsuite_state['session_id']
+        self.session_users = testsuite_state['session_users']
+        self.session_configuration = testsuite_state['session_configuration']
+        self.session_selected_tc_list = testsuite_state['session_selected_tc_list']
+        self.addressing_table = {node: tuple(address) for node, address in testsuite_state['addressing_table'].items()}
+        self.nodes_configured = set(testsuite_state['nodes_configured'])
+        self.report = testsuite_state['report']
+
     def abort_current_testcase(self):
         self.current_tc.abort()
         self.current_tc = None
@@ -401,24 +512,13 @@ class TestSuite:
         return self.current_tc.check_all_steps_finished()
 
     def check_testsuite_finished(self):
-        # cyclic as user may not have started by the first TC
-        it = cycle(self.test_descriptions_dict.values())
-
-        # we need to check if we already did a cycle (cycle doesnt raises StopIteration)
-        iter_counts = len(self.test_descriptions_dict)
-        tc = next(it)
-
-        while iter_counts >= 0:
-            # check that there's no steps in state = None or executing
-            if tc.state in (None, 'executing', 'ready_for_analysis', 'analyzing'):
-                logger.debug("Got unfinished test case: %s, on state: %s" % (tc.id, tc.state))
-                return False
-            else:  # TC state is 'skipped' or 'finished'
-                tc = next(it)
-            iter_counts -= 1
-        if iter_counts < 0:
-            logger.debug("Testsuite finished. No more test cases to execute.")
-            return True
+        # check that there's no TC in state = None or executing (TC state is 'skipped' or 'finished')
+        if not self.scheduler.all_finished():
+            logger.debug("Got %s unfinished test cases" % self.scheduler.count(*TestCaseScheduler.UNFINISHED_STATES))
+            return False
+
+        logger.debug("Testsuite finished. No more test cases to execute.")
+        return True
 
     def configure_testsuite(self, tc_list_requested, session_id=None, users=None, configuration=None):
         assert tc_list_requested is not None
@@ -499,11 +599,10 @@ class TestSuite:
             return self.get_current_testcase()
         else:
             assert type(testcase_id) is str
-            try:
-                return self.test_descriptions_dict[testcase_id]
-            except KeyError:
+            tc = self.scheduler.get(testcase_id)
+            if tc is None:
                 logger.info('TC %s not found in list: %s' % (testcase_id, self.test_descriptions_dict.keys()))
-                return None
+            return tc
 
     def get_current_testcase(self):
         try:
@@ -707,6 +806,8 @@ class Verdict:
     the new verdict is worse than the previous one.
     """
 
+    __slots__ = ('__value', '__message')
+
     __values = ('none', 'pass', 'inconclusive', 'fail', 'aborted', 'error')
 
     def __init__(self, initial_value: str = None):
@@ -776,6 +877,8 @@ class Verdict:
 
 
 class Iut:
+    __slots__ = ('node', 'mode', 'address')
+
     def __init__(self, node=None, mode="user_assisted"):
         # TODO get IUT mode from session config!!!
         self.node = node
@@ -804,6 +907,8 @@ class TestConfig:
     This class is for generating objects containing a copy of the information of the test configuration yaml file
     """
 
+    __slots__ = ('id', 'uri', 'nodes', 'nodes_description', 'default_addressing', 'configuration_diagram', 'topology')
+
     def __init__(self, configuration_id, uri, nodes, topology, addressing, description, configuration_diagram):
         self.id = configuration_id
         self.uri = uri
@@ -870,25 +975,84 @@ class TestConfig:
         return dict(d)
 
 
-class Step():
+class StepDescription:
+    """
+    Immutable part of a step (as described in the yaml file), shared by the steps of all sessions
+    """
+
+    __slots__ = ('id', 'type', 'description', 'node', '_description_text')
+
     def __init__(self, step_id, type, description, node=None):
         assert type in ("stimuli", "check", "verify", "feature")
+
+        # stimuli and verify step MUST have a iut field in the YAML file
+        if type == 'stimuli' or type == 'verify':
+            assert node is not None
+
         self.id = step_id
         self.type = type
-        self.state = None
         self.description = description
+        self.node = node
+        self._description_text = None
+
+    @property
+    def description_text(self):
+        """
+        :return: description flattened into a single string (see list_to_str), flattened once per step
+        """
+        if self._description_text is None:
+            self._description_text = list_to_str(self.description)
+        return self._description_text
+
+
+class Step():
+    """
+    Execution state of a step (state, partial verdict, IUT) in a session, the step's description is shared (ted)
+    """
+
+    __slots__ = ('ted', 'state', 'partial_verdict', 'iut')
+
+    def __init__(self, step_id, type, description, node=None):
+        self._init_execution_state(StepDescription(step_id, type, description, node))
+
+    @classmethod
+    def from_description(cls, ted):
+        """
+        :param ted: StepDescription
+        """
+        step = cls.__new__(cls)
+        step._init_execution_state(ted)
+        return step
+
+    def _init_execution_state(self, ted):
+        self.ted = ted
+        self.state = None
 
         # stimuli steps dont have a verdict, they are IUT actions
-        if type != 'stimuli':
+        if ted.type != 'stimuli':
             self.partial_verdict = Verdict()
 
-        # stimuli and verify step MUST have a iut field in the YAML file
-        if type == 'stimuli' or type == 'verify':
-            assert node is not None
-            self.iut = Iut(node)
+        if ted.type == 'stimuli' or ted.type == 'verify':
+            self.iut = Iut(ted.node)
         else:
             self.iut = None
 
+    @property
+    def id(self):
+        return self.ted.id
+
+    @property
+    def type(self):
+        return self.ted.type
+
+    @property
+    def description(self):
+        return self.ted.description
+
+    @property
+    def description_text(self):
+        return self.ted.description_text
+
     def __repr__(self):
         node = ''
         mode = ''
@@ -938,47 +1102,131 @@ class Step():
         self.partial_verdict.update(result, result_info)
 
 
-class TestCase:
+class TestCaseDescription:
     """
-    FSM states:
-    (None,'skipped', 'configuring','executing','ready_for_analysis','analyzing','finished')
-    - None -> Rest state. Wait for user input.
-    - Skipped -> If a TC is in skipped state is probably cause of user input. Jump to next TC
-    - Configuring -> Configuring remotes. Once all configuration.executed messages from IUTs are received (or timed-out)
-        we pass to state executing
-    - Executing -> Inside this state we iterate over the steps. Once iteration finished go to "Analyzing" state.
-    - Analyzing -> Most probably we are waiting for TAT analysis CHECK analysis (eith post_mortem or step_by_step).
-        Jump to finished once answer received and final verdict generated.
-    - Finished -> all steps finished, all checks analyzed, and verdict has been emitted. Jump to next TC
-
-    ready_for_analysis -> intermediate state between executing and analyzing for waiting for user call to analyse TC
+    Immutable part of a test case (as described in the yaml file), shared by the test cases of all sessions
     """
 
+    __slots__ = ('id', 'uri', 'objective', 'configuration_id', 'references', 'pre_conditions', 'notes', 'steps')
+
     def __init__(self, testcase_id, uri, objective, configuration, references, pre_conditions, notes, sequence):
         self.id = testcase_id
-        self.state = None
         self.uri = uri
         self.objective = objective
         self.configuration_id = configuration
         self.references = references
         self.pre_conditions = pre_conditions
         self.notes = notes
-        self.sequence = []
+        steps = []
         for s in sequence:
             # some sanity checks of imported steps
             try:
                 assert "step_id" and "description" and "type" in s
                 if s['type'] == 'stimuli':
                     assert "node" in s
-                self.sequence.append(Step(**s))
+                steps.append(StepDescription(**s))
             except:
                 raise TestSuiteError("Error found while trying to parse: %s" % str(s))
+        self.steps = tuple(steps)
+
+    def __repr__(self):
+        return "%s(testcase_id=%s, uri=%s, objective=%s, configuration=%s)" % (
+            self.__class__.__name__, self.id,
+            self.uri, self.objective, self.configuration_id
+        )
+
+
+class TestCase:
+    """
+    FSM states:
+    (None,'skipped', 'configuring','executing','ready_for_analysis','analyzing','finished')
+    - None -> Rest state. Wait for user input.
+    - Skipped -> If a TC is in skipped state is probably cause of user input. Jump to next TC
+    - Configuring -> Configuring remotes. Once all configuration.executed messages from IUTs are received (or timed-out)
+        we pass to state executing
+    - Executing -> Inside this state we iterate over the steps. Once iteration finished go to "Analyzing" state.
+    - Analyzing -> Most probably we are waiting for TAT analysis CHECK analysis (eith post_mortem or step_by_step).
+        Jump to finished once answer received and final verdict generated.
+    - Finished -> all steps finished, all checks analyzed, and verdict has been emitted. Jump to next TC
+
+    ready_for_analysis -> intermediate state between executing and analyzing for waiting for user call to analyse TC
+
+    The test case's description (ted) is shared, test cases of different sessions (TestSuite objects) built from
+    the same TestCaseDescription only differ in their execution state.
+    """
+
+    __slots__ = ('ted', '_state', '_state_listeners', 'sequence', '_step_it', 'current_step', 'report')
+
+    def __init__(self, testcase_id, uri, objective, configuration, references, pre_conditions, notes, sequence):
+        self._init_execution_state(
+            TestCaseDescription(testcase_id, uri, objective, configuration, references, pre_conditions, notes, sequence)
+        )
+
+    @classmethod
+    def from_description(cls, ted):
+        """
+        :param ted: TestCaseDescription
+        :return: new test case (execution state) for the test case description
+        """
+        tc = cls.__new__(cls)
+        tc._init_execution_state(ted)
+        return tc
+
+    def _init_execution_state(self, ted):
+        self.ted = ted
+        self._state_listeners = []
+        self.state = None
+        self.sequence = [Step.from_description(step_ted) for step_ted in ted.steps]
         self._step_it = iter(self.sequence)
         self.current_step = None
         self.report = None
 
         # TODO if ANALYSIS is post mortem change all check step states to postponed at init!
 
+    @property
+    def id(self):
+        return self.ted.id
+
+    @property
+    def uri(self):
+        return self.ted.uri
+
+    @property
+    def objective(self):
+        return self.ted.objective
+
+    @property
+    def configuration_id(self):
+        return self.ted.configuration_id
+
+    @property
+    def references(self):
+        return self.ted.references
+
+    @property
+    def pre_conditions(self):
+        return self.ted.pre_conditions
+
+    @property
+    def notes(self):
+        return self.ted.notes
+
+    @property
+    def state(self):
+        return self._state
+
+    @state.setter
+    def state(self, state):
+        old_state, self._state = getattr(self, '_state', None), state
+        for listener in self._state_listeners:
+            listener(self, old_state, state)
+
+    def add_state_listener(self, listener):
+        """
+        :param listener: function called with (testcase, old_state, new_state) on each state change
+        """
+        self._state_listeners.append(listener)
+
     def reinit(self):
         """
         - prepare test case to be re-executed
@@ -992,6 +1240,45 @@ class TestCase:
         for s in self.sequence:
             s.reinit()
 
+    def get_execution_state(self):
+        """
+        :return: JSON serializable execution state (states, partial verdicts, current step, report)
+        """
+        steps = []
+        for step in self.sequence:
+            verdict = getattr(step, 'partial_verdict', None)  # stimuli steps dont have a verdict
+            steps.append([step.state,
+                          verdict.get_value() if verdict else None,
+                          verdict.get_message() if verdict else None])
+
+        return {
+            'state': self.state,
+            'current_step': self.sequence.index(self.current_step) if self.current_step else None,
+            'steps': steps,
+            'report': self.report,
+        }
+
+    def restore_execution_state(self, execution_state):
+        """
+        :param execution_state: as returned by get_execution_state
+        """
+        for step, (state, verdict_value, verdict_message) in zip(self.sequence, execution_state['steps']):
+            step.state = state
+            if verdict_value is not None:
+                step.partial_verdict = Verdict()
+                step.partial_verdict.update(verdict_value, verdict_message)
+
+        current_step = execution_state['current_step']
+        if current_step is None:
+            self.current_step = None
+            self._step_it = iter(self.sequence)
+        else:
+            self.current_step = self.sequence[current_step]
+            self._step_it = iter(self.sequence[current_step + 1:])
+
+        self.report = execution_state['report']
+        self.state = execution_state['state']
+
     def __repr__(self):
         return "%s(testcase_id=%s, uri=%s, objective=%s, configuration=%s)" % (
             self.__class__.__name__, self.id,
@@ -1159,15 +1446,6 @@ class TestCase:
 # yaml.add_constructor(u'!configuration', testcase_constructor)
 
 
-_test_descriptions_and_configurations_paths = []
-_test_descriptions_and_configurations_paths += list(TEST_DESCRIPTIONS_DICT.values())
-_test_descriptions_and_configurations_paths += list(TEST_DESCRIPTIONS_CONFIGS_DICT.values())
-
-_flat_list_of_test_descriptions_and_configurations = [
-    item for sublist in _test_descriptions_and_configurations_paths for item in sublist
-]
-
-
 # # # YAML parser methods # # #
 def testcase_constructor(loader, node):
     instance = TestCase.__new__(TestCase)
@@ -1189,39 +1467,185 @@ def test_config_constructor(loader, node):
 yaml.add_constructor(u'!configuration', test_config_constructor)
 yaml.add_constructor(u'!testcase', testcase_constructor)
 
-__td_testcases_list = []
-__td_testcases_dict = {}
-__td_config_list = []
-__td_config_dict = {}
-
-for _td in _flat_list_of_test_descriptions_and_configurations:
-    with open(_td, "r", encoding="utf-8") as stream:
-        _yaml_docs = yaml.load_all(stream)
-        for _yaml_doc in _yaml_docs:
-            if type(_yaml_doc) is TestCase:
-                __td_testcases_list.append(_yaml_doc)
-                __td_testcases_dict[_yaml_doc.id] = _yaml_doc
-            elif type(_yaml_doc) is TestConfig:
-                __td_config_list.append(_yaml_doc)
-                __td_config_dict[_yaml_doc.id] = _yaml_doc
-            else:
-                logging.warning("Unrecognised yaml structure: %s" % str(_yaml_doc))
+
+def load_yaml_file(yamlfile):
+    """
+    Loads yaml file's documents through the compiled test descriptions cache (see td_cache)
+    :return: list of TestCase and TestConfig objects (and other documents found in the file)
+    """
+    docs = []
+    for doc in load_yaml_documents(yamlfile):
+        if type(doc) is YamlDocument and doc.tag == TESTCASE_TAG:
+            doc = TestCase(**doc.mapping)
+        elif type(doc) is YamlDocument and doc.tag == CONFIGURATION_TAG:
+            doc = TestConfig(**doc.mapping)
+        docs.append(doc)
+    return docs
+
+
+# (test case files, test configuration files) -> test suite's descriptions, shared by all sessions of the process
+_shared_test_descriptions = {}
+
+
+def load_test_descriptions(ted_tc_file, ted_config_file):
+    """
+    Loads the test suite's yaml files once per process, the sessions (TestSuite objects) of the test suite share the
+    returned descriptions, which must not be modified.
+
+    :param ted_tc_file: TED yaml file(s)
+    :param ted_config_file: test configurations yaml file(s)
+    :return: OrderedDict of TestCaseDescription, OrderedDict of TestConfig (indexed by id)
+    """
+    key = tuple(_as_file_list(ted_tc_file)), tuple(_as_file_list(ted_config_file))
+    if key in _shared_test_descriptions:
+        return _shared_test_descriptions[key]
+
+    tc_configs = OrderedDict()
+    for tc_config in import_test_description_from_yaml(ted_config_file):
+        if type(tc_config) is not TestConfig:
+            continue
+        tc_configs[tc_config.id] = tc_config
+        logger.info('Import: test configuration imported from YAML: %s' % tc_config.id)
+
+    # lets import TCs and make sure there's a tc config for each one of them
+    testcase_descriptions = OrderedDict()
+    for tc in import_test_description_from_yaml(ted_tc_file):
+        if type(tc) is not TestCase:
+            continue
+        assert tc.configuration_id in tc_configs, "Missing config: %s for test case: %s " % (tc.configuration_id, tc.id)
+        testcase_descriptions[tc.id] = tc.ted
+        logger.info('test case imported from YAML: %s' % tc.id)
+
+    _shared_test_descriptions[key] = testcase_descriptions, tc_configs
+    return _shared_test_descriptions[key]
+
+
+class _TestDescriptionsRegistry:
+    """
+    Test cases and test configurations of all test suites (TEST_DESCRIPTIONS_DICT, TEST_DESCRIPTIONS_CONFIGS_DICT),
+    a suite's yaml files are loaded on first lookup of one of its ids, or of the suite itself.
+    """
+
+    def __init__(self, td_files_dict, td_config_files_dict):
+        self.td_files_dict = td_files_dict
+        self.td_config_files_dict = td_config_files_dict
+        self.suites = list(td_files_dict) + [s for s in td_config_files_dict if s not in td_files_dict]
+        self.loaded = OrderedDict()  # suite -> (testcases dict, configurations dict)
+
+    def load_suite(self, suite):
+        """
+        :return: OrderedDict of the suite's test cases, OrderedDict of the suite's test configurations
+        """
+        if suite in self.loaded:
+            return self.loaded[suite]
+
+        if suite not in self.suites:
+            raise TestSuiteError('Unknown test suite %s, expected one of %s' % (suite, self.suites))
+
+        testcases = OrderedDict()
+        configs = OrderedDict()
+        for td_file in self.td_files_dict.get(suite, []) + self.td_config_files_dict.get(suite, []):
+            for yaml_doc in load_yaml_file(td_file):
+                if type(yaml_doc) is TestCase:
+                    testcases[yaml_doc.id] = yaml_doc
+                elif type(yaml_doc) is TestConfig:
+                    configs[yaml_doc.id] = yaml_doc
+                else:
+                    logging.warning("Unrecognised yaml structure: %s" % str(yaml_doc))
+
+        logger.debug('Test suite %s loaded: %s test cases, %s configurations' % (suite, len(testcases), len(configs)))
+        self.loaded[suite] = testcases, configs
+        return self.loaded[suite]
+
+    def lookup(self, item_id, kind):
+        """
+        :param kind: 0 for test cases, 1 for test configurations
+        :raises KeyError: not found in any suite
+        """
+        for suite, items in self.loaded.items():
+            if item_id in items[kind]:
+                return items[kind][item_id]
+
+        # suites named in the id first (TD_COAP_CORE_01, COAP_CFG_01), then the others
+        name = str(item_id).upper()
+        for suite in sorted(self.suites, key=lambda s: s.upper() not in name):
+            if suite not in self.loaded:
+                items = self.load_suite(suite)[kind]
+                if item_id in items:
+                    return items[item_id]
+
+        raise KeyError(item_id)
+
+    def get_all(self, kind):
+        """
+        :return: OrderedDict of the items of all suites (suites order)
+        """
+        all_items = OrderedDict()
+        for suite in self.suites:
+            all_items.update(self.load_suite(suite)[kind])
+        return all_items
+
+
+class _LazyTestDescriptionsDict(Mapping):
+    """
+    Read-only dict view over the registry, lookups only load the suite of the id
+    """
+
+    def __init__(self, registry, kind):
+        self._registry = registry
+        self._kind = kind
+
+    def __getitem__(self, item_id):
+        return self._registry.lookup(item_id, self._kind)
+
+    def __iter__(self):
+        return iter(self._registry.get_all(self._kind))
+
+    def __len__(self):
+        return len(self._registry.get_all(self._kind))
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, list(self))
+
+
+_TESTCASES = 0
+_CONFIGURATIONS = 1
+
+_td_registry = _TestDescriptionsRegistry(TEST_DESCRIPTIONS_DICT, TEST_DESCRIPTIONS_CONFIGS_DICT)
+_td_testcases_dict = _LazyTestDescriptionsDict(_td_registry, _TESTCASES)
+_td_config_dict = _LazyTestDescriptionsDict(_td_registry, _CONFIGURATIONS)
 
 
 def get_list_of_all_test_cases():
-    return __td_testcases_list
+    return list(_td_registry.get_all(_TESTCASES).values())
 
 
 def get_dict_of_all_test_cases():
-    return __td_testcases_dict
+    return _td_testcases_dict
 
 
 def get_list_of_all_test_cases_configurations():
-    return __td_config_list
+    return list(_td_registry.get_all(_CONFIGURATIONS).values())
 
 
 def get_dict_of_all_test_cases_configurations():
-    return __td_config_dict
+    return _td_config_dict
+
+
+def get_dict_of_test_cases(suite):
+    """
+    :param suite: test suite name (key of TEST_DESCRIPTIONS_DICT), e.g. 'coap'
+    :return: OrderedDict of the suite's test cases, only this suite's files are loaded
+    """
+    return _td_registry.load_suite(suite)[_TESTCASES]
+
+
+def get_dict_of_test_cases_configurations(suite):
+    """
+    :param suite: test suite name (key of TEST_DESCRIPTIONS_CONFIGS_DICT), e.g. 'coap'
+    :return: OrderedDict of the suite's test configurations, only this suite's files are loaded
+    """
+    return _td_registry.load_suite(suite)[_CONFIGURATIONS]
 
 
 def get_test_cases_list_from_yaml(testdescription_yamlfile):
@@ -1231,11 +1655,9 @@ def get_test_cases_list_from_yaml(testdescription_yamlfile):
     """
 
     list = []
-    with open(testdescription_yamlfile, "r", encoding="utf-8") as stream:
-        _yaml_docs = yaml.load_all(stream)
-        for _yaml_doc in _yaml_docs:
-            if type(_yaml_doc) is TestCase:
-                list.append(_yaml_doc)
+    for _yaml_doc in load_yaml_file(testdescription_yamlfile):
+        if type(_yaml_doc) is TestCase:
+            list.append(_yaml_doc)
     return list
 
 
@@ -1246,55 +1668,39 @@ def get_test_configurations_list_from_yaml(testdescription_yamlfile):
     """
 
     list = []
-    with open(testdescription_yamlfile, "r", encoding="utf-8") as stream:
-        _yaml_docs = yaml.load_all(stream)
-        for _yaml_doc in _yaml_docs:
-            if type(_yaml_doc) is TestConfig:
-                list.append(_yaml_doc)
+    for _yaml_doc in load_yaml_file(testdescription_yamlfile):
+        if type(_yaml_doc) is TestConfig:
+            list.append(_yaml_doc)
     return list
 
 
-def merge_yaml_files(filelist: list):
-    new_merged_file = os.path.join(TD_DIR, 'merged_files.yaml')
-
-    with open(new_merged_file, 'w', encoding="utf-8") as fout:
-        for file in filelist:
-            with open(file, 'r', encoding="utf-8") as fin:
-                for line in fin:
-                    if line.startswith("#"):
-                        pass
-                    else:
-                        fout.write(line)
-            fout.write(os.linesep)
-
-    return new_merged_file
-
-
 def import_test_description_from_yaml(yamlfile):
     """
     Imports TestCases objects or TestConfig objects from yamlfile(s)
+    Several files are loaded one after the other (same as a single file made of their documents), no merged file is
+    written to disk.
     :param yamlfile: TED yaml file(s)
     :return: list of imported testCase(s) and testConfig(s) object(s)
     """
 
+    td_list = []
+    for yml in _as_file_list(yamlfile):
+        for yaml_doc in load_yaml_file(yml):
+            if type(yaml_doc) is TestCase:
+                logging.debug(' Parsed test case: %s from yaml file: %s :' % (yaml_doc.id, yamlfile))
+                td_list.append(yaml_doc)
+            elif type(yaml_doc) is TestConfig:
+                logging.debug(' Parsed test case config: %s from yaml file: %s :' % (yaml_doc.id, yamlfile))
+                td_list.append(yaml_doc)
+            else:
+                logging.error('Couldnt processes import: %s from %s' % (str(yaml_doc), yamlfile))
+    return td_list
+
+
+def _as_file_list(yamlfile):
     if type(yamlfile) is str:
-        yamlfile_list = [yamlfile]
+        return [yamlfile]
     elif type(yamlfile) is list:
-        yamlfile_list = yamlfile
+        return yamlfile
     else:
         raise TypeError('Expected list or str, got instead : %s' % type(yamlfile))
-
-    td_list = []
-    for yml in yamlfile_list:
-        with open(yml, "r", encoding="utf-8") as stream:
-            yaml_docs = yaml.load_all(stream)
-            for yaml_doc in yaml_docs:
-                if type(yaml_doc) is TestCase:
-                    logging.debug(' Parsed test case: %s from yaml file: %s :' % (yaml_doc.id, yamlfile))
-                    td_list.append(yaml_doc)
-                elif type(yaml_doc) is TestConfig:
-                    logging.debug(' Parsed test case config: %s from yaml file: %s :' % (yaml_doc.id, yamlfile))
-                    td_list.append(yaml_doc)
-                else:
-                    logging.error('Couldnt processes import: %s from %s' % (str(yaml_doc), yamlfile))
-    return td_list
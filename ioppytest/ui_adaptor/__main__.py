@@ -25,6 +25,8 @@ from ioppytest.ui_adaptor.tt_tasks import (configure_testing_tool,
                                            )
 
 from ioppytest import AMQP_URL, AMQP_EXCHANGE, LOG_LEVEL, LOGGER_FORMAT
+from ioppytest.amqp_pool import get_amqp_publisher
+from ioppytest.packet_encoding import PacketAwareAmqpListener
 from event_bus_utils import AmqpListener, amqp_request, AmqpSynchCallTimeoutError
 from event_bus_utils.rmq_handler import RabbitMQHandler, JsonFormatter
 from messages import *
@@ -107,8 +109,8 @@ class AmqpMessagePublisher:
         # init AMQP comms
         self.amqp_url = amqp_url
         self.exchange = amqp_exchange
-        self.connection = None
-        self.channel = None
+        self.publisher = None
+        self.connection = None  # for synch requests, which block for up to their timeout
         self.amqp_connect()
 
         # init role->user_ID map
@@ -151,8 +153,7 @@ class AmqpMessagePublisher:
         return ret
 
     def amqp_connect(self):
-        self.connection = pika.BlockingConnection(pika.URLParameters(self.amqp_url))
-        self.channel = self.connection.channel()
+        self.publisher = get_amqp_publisher(self.amqp_url, self.exchange)
 
         # Hello world message
         m = MsgTestingToolComponentReady(
@@ -161,10 +162,9 @@ class AmqpMessagePublisher:
 
         )
 
-        self.channel.basic_publish(
+        self.publisher.publish(
             body=m.to_json(),
             routing_key=m.routing_key,
-            exchange=self.exchange,
             properties=pika.BasicProperties(
                 content_type='application/json',
             )
@@ -182,14 +182,20 @@ class AmqpMessagePublisher:
     def stop(self):
 
         self._notify_component_shutdown()
+        self.publisher = None
 
-        if self.channel:
-            self.channel.close()
-            self.channel = None
-
-        if self.connection:
+        if self.connection and self.connection.is_open:
             self.connection.close()
-            self.connection = None
+        self.connection = None
+
+    def _synch_request_connection(self):
+        """
+        Synch requests wait for (user) replies for up to their timeout, so they use a dedicated connection instead of
+        holding one of the pooled publishing connections
+        """
+        if self.connection is None or not self.connection.is_open:
+            self.connection = pika.BlockingConnection(pika.URLParameters(self.amqp_url))
+        return self.connection
 
     def publish_ui_display(self, message: Message, user_id=None, level=None):
 
@@ -204,48 +210,15 @@ class AmqpMessagePublisher:
 
     def publish_message(self, message):
         """
-        Generic publish message which uses class connection
+        Generic publish message which uses the process-wide pool of connections
         Publishes message into the correct topic (uses Message object metadata)
-        Creates temporary channel on it's own
-        Connection must be a pika.BlockingConnection
         """
-        channel = None
-        properties = pika.BasicProperties(**message.get_properties())
-
         logger.debug("Publishing to routing_key: %s, msg: %s"
                      % (message.routing_key,
                         repr(message)[:STDOUT_MAX_TEXT_LENGTH_PER_LINE],))
 
-        try:
-            time.sleep(PUBLISH_DELAY)
-            channel = self.connection.channel()
-            channel.basic_publish(
-                exchange=AMQP_EXCHANGE,
-                routing_key=message.routing_key,
-                properties=properties,
-                body=message.to_json(),
-            )
-
-        except (pika.exceptions.ConnectionClosed, BrokenPipeError):
-
-            print("Log handler connection closed. Reconnecting..")
-
-            connection = pika.BlockingConnection(
-                pika.URLParameters(AMQP_URL))  # this doesnt overwrite connection argument!
-            channel = connection.channel()
-
-            # send retry
-            channel.basic_publish(
-                exchange=AMQP_EXCHANGE,
-                routing_key=message.routing_key,
-                properties=properties,
-                body=message.to_json(),
-            )
-
-        finally:
-
-            if channel and channel.is_open:
-                channel.close()
+        time.sleep(PUBLISH_DELAY)
+        self.publisher.publish_message(message)
 
     def synch_request(self, request, user_id=None, timeout=30):
         """ method for synch requests:
@@ -306,11 +279,20 @@ class AmqpMessagePublisher:
 
         # fixme in amqp request use timeout instead of retries
         time.sleep(PUBLISH_DELAY)
-        resp = amqp_request(self.connection,
-                            request,
-                            COMPONENT_ID,
-                            retries=timeout * 2,
-                            use_message_typing=True)
+        try:
+            resp = amqp_request(self._synch_request_connection(),
+                                request,
+                                COMPONENT_ID,
+                                retries=timeout * 2,
+                                use_message_typing=True)
+        except pika.exceptions.AMQPConnectionError:
+            # e.g. idle connection dropped by the broker, let's retry once with a new one
+            self.connection = None
+            resp = amqp_request(self._synch_request_connection(),
+                                request,
+                                COMPONENT_ID,
+                                retries=timeout * 2,
+                                use_message_typing=True)
         return resp
 
     def publish_ui_request(self, request, user_id=None):
@@ -562,7 +544,7 @@ def main():
         amqp_exchange=AMQP_EXCHANGE,
         iut_role_to_user_id_mapping=None)
 
-    tt_amqp_listener_thread = AmqpListener(
+    tt_amqp_listener_thread = PacketAwareAmqpListener(
         amqp_url=AMQP_URL,
         amqp_exchange=AMQP_EXCHANGE,
         topics=TESTING_TOOL_TOPIC_SUBSCRIPTIONS,
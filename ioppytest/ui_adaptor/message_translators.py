@@ -49,6 +49,9 @@ logger.addHandler(rabbitmq_handler)
 
 TESTING_TOOL_AGENT_NAME = 'agent_TT'
 
+# separators appended after each byte when rendering packets (8 bytes, tab, 7 bytes, new line)
+PACKET_BYTES_SEPARATORS = [' '] * 7 + [' \t '] + [' '] * 6 + [' \n']
+
 
 @property
 def NotImplementedField(self):
@@ -1001,13 +1004,24 @@ class GenericBidirectonalTranslator(object):
         return MsgUiDisplayMarkdownText(level='highlighted', fields=fields)
 
     def _get_ui_lossy_context(self, message):
+        impairments = getattr(message, 'impairments', None)
+
+        if not message.number_of_packets_to_drop and not impairments:
+            value = 'Link impairments removed'
+        else:
+            value = 'Test configured to drop the following %s packet(s)' % message.number_of_packets_to_drop
 
         fields = [
             {
                 'type': 'p',
-                'value': 'Test configured to drop the following %s packet(s)' % message.number_of_packets_to_drop
+                'value': value
             }
         ]
+
+        if impairments:
+            fields.append({'type': 'p', 'value': 'Link impairments: %s' % ', '.join(
+                '%s: %s' % (k, v) for k, v in sorted(impairments.items()))})
+
         return MsgUiDisplayMarkdownText(level='highlighted', fields=fields)
 
     def _get_ui_message_highlighted_description(self, message):
@@ -1396,19 +1410,12 @@ class GenericBidirectonalTranslator(object):
 
         fields.append({'type': 'p', 'value': '%s:%s' % ('interface', message.interface_name)})
 
-        network_bytes_aligned = ''
-        count = 0
-        for int_value in message.data:
-            network_bytes_aligned += format(int_value, '02x')
-            if count == 7:
-                network_bytes_aligned += ' \t'
-                count += 1
-            if count == 15:
-                network_bytes_aligned += ' \n'
-                count = 0
-            else:
-                network_bytes_aligned += ' '
-                count += 1
+        # data may come as list of ints (json encoding) or as bytes (compact encodings), lines of 15 bytes
+        hex_data = bytes(message.data).hex()
+        network_bytes_aligned = ''.join(
+            hex_data[i:i + 2] + PACKET_BYTES_SEPARATORS[(i // 2) % len(PACKET_BYTES_SEPARATORS)]
+            for i in range(0, len(hex_data), 2)
+        )
 
         fields.append({'type': 'p', 'value': '\n%s' % (network_bytes_aligned)})
 
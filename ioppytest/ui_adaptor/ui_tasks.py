@@ -14,6 +14,7 @@ from ioppytest.ui_adaptor import (UiResponseError,
                                   SessionError,
                                   WAITING_TIME_FOR_SECOND_USER,
                                   UI_TAG_SETUP, )
+from ioppytest.packet_sniffer.capture_compression import COMPRESSION_GZIP, get_compression, get_capture_filename
 
 
 # auxiliary functions
@@ -52,11 +53,16 @@ def list_to_str(ls):
     return ret
 
 
-def send_testcase_pcap_to_ui_file_for_download(amqp_publisher, testcase_id=None, user_id='all'):
+def send_testcase_pcap_to_ui_file_for_download(amqp_publisher, testcase_id=None, user_id='all',
+                                               compression=COMPRESSION_GZIP):
+    """
+    :param compression: compression requested to the sniffer, if the sniffer honours it the user downloads a
+        <testcase_id>.pcap.gz file
+    """
     if testcase_id:
-        resp = amqp_publisher.synch_request(MsgSniffingGetCapture(testcase_id=testcase_id))
+        resp = amqp_publisher.synch_request(MsgSniffingGetCapture(capture_id=testcase_id, compression=compression))
     else:
-        resp = amqp_publisher.synch_request(MsgSniffingGetCaptureLast())
+        resp = amqp_publisher.synch_request(MsgSniffingGetCaptureLast(compression=compression))
 
     if resp is None:
         logging.error('Sniffer didnt respond to network traffic capture request.')
@@ -70,7 +76,7 @@ def send_testcase_pcap_to_ui_file_for_download(amqp_publisher, testcase_id=None,
     m.routing_key = m.routing_key.replace('.all.', '.{}.'.format(user_id))
     m.fields = [
         {
-            "name": resp.filename,
+            "name": get_capture_filename(resp.filename, get_compression(getattr(resp, 'file_enc', None))),
             "type": "data",
             "value": resp.value,
         }
@@ -6,9 +6,11 @@ and HEAD requests in a fairly straightforward manner.
 """
 
 import os
+import io
 import html
 import glob
 import json
+import itertools
 import yaml
 import urllib
 import shutil
@@ -20,6 +22,8 @@ from jinja2 import Template
 from ioppytest import (
     TEST_DESCRIPTIONS,
     RESULTS_DIR,
+    TMPDIR,
+    PCAP_DIR,
     AUTO_DISSECTION_FILE,
     PROJECT_DIR,
     LOG_LEVEL,
@@ -29,10 +33,12 @@ from ioppytest import (
 
 from http.server import BaseHTTPRequestHandler, HTTPServer
 
-from ioppytest.test_suite import (get_list_of_all_test_cases,
+from ioppytest.test_suite import (get_dict_of_test_cases,
                                   get_test_cases_list_from_yaml,
                                   get_test_configurations_list_from_yaml)
 
+from ioppytest.packet_sniffer.capture_index import slice_capture
+from ioppytest.packet_sniffer.capture_compression import COMPRESSED_CAPTURE_SUFFIX
 from ioppytest.test_descriptions.format_conversion import (get_markdown_representation_of_testcase,
                                                            get_markdown_representation_of_testcase_configuration)
 
@@ -42,7 +48,19 @@ FILENAME_HTML_REPORT = 'testsuite_results.html'
 logger = logging.getLogger(COMPONENT_ID)
 logger.setLevel(LOG_LEVEL)
 
-td_objects_list = get_list_of_all_test_cases()
+
+def get_testcase(tc_name):
+    """
+    Test suites are loaded on the first request for one of their test cases (not when the module is imported)
+    :param tc_name: test case id, case insensitive
+    :return: TestCase, None if not found
+    """
+    for suite in TEST_DESCRIPTIONS_DICT:
+        for tc in get_dict_of_test_cases(suite).values():
+            if tc.id.lower() == tc_name.lower():
+                return tc
+    return None
+
 
 head = """
 <html>
@@ -315,10 +333,64 @@ class SimpleHTTPRequestHandler(BaseHTTPRequestHandler):
         self.wfile.write(bytes("</html>\n", 'utf-8'))
         return
 
+    def handle_capture(self, filename, query):
+        """
+        Serves a capture (sniffer's dir first, then the coordinator's dumps dir), optionally sliced using its frame
+        index, e.g.: /ioppytest/pcaps/TD_COAP_CORE_01.pcap?t_start=1488586183.45&t_end=1488586184&agent=coap_client
+
+        Captures stored compressed (.pcap.gz) are sent as such to clients accepting gzip encoding, else decompressed.
+        """
+        for d, name in itertools.product((TMPDIR, PCAP_DIR), (filename, filename + COMPRESSED_CAPTURE_SUFFIX)):
+            file = os.path.join(d, name)
+            if os.path.isfile(file):
+                break
+        else:
+            self.send_error(404, "Capture %s couldn't be found" % filename)
+            return None
+
+        try:
+            t_start = float(query['t_start'][0]) if 't_start' in query else None
+            t_end = float(query['t_end'][0]) if 't_end' in query else None
+        except ValueError:
+            self.send_error(400, "t_start and t_end must be timestamps")
+            return None
+
+        agents = query.get('agent')
+        link = query.get('link', [None])[0]
+        content_encoding = None
+
+        if file.endswith(COMPRESSED_CAPTURE_SUFFIX) and (filename.endswith(COMPRESSED_CAPTURE_SUFFIX) or (
+                (t_start, t_end, agents, link) == (None, None, None, None) and
+                'gzip' in self.headers.get('Accept-Encoding', ''))):
+            # no need to decompress it
+            with open(file, 'rb') as f:
+                data = f.read()
+            if not filename.endswith(COMPRESSED_CAPTURE_SUFFIX):
+                content_encoding = 'gzip'
+        else:
+            f = io.BytesIO()
+            frames = slice_capture(file, f, t_start=t_start, t_end=t_end, agents=agents, link=link)
+            logger.info('Serving %s frames of %s' % (frames, file))
+            data = f.getvalue()
+
+        self.send_response(200)
+        self.send_header("Content-Type", 'application/octet-stream')
+        if content_encoding:
+            self.send_header("Content-Encoding", content_encoding)
+        self.send_header("Content-Disposition", 'attachment; filename="{}"'.format(filename))
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
     def handle_pcaps(self, path):
         logger.info('Handling data: %s' % path)
         assert '/pcaps' in path
 
+        url = urllib.parse.urlsplit(path)
+        filename = os.path.basename(url.path)
+        if filename.endswith(('.pcap', '.pcap' + COMPRESSED_CAPTURE_SUFFIX)) and not filename.startswith('DLT_'):
+            return self.handle_capture(filename, urllib.parse.parse_qs(url.query))
+
         if 'IEEE802_15_4' in path:
             file = os.path.join(PROJECT_DIR, 'tmp', 'DLT_IEEE802_15_4.pcap')
         elif 'DLT_RAW' in path:
@@ -376,13 +448,7 @@ class SimpleHTTPRequestHandler(BaseHTTPRequestHandler):
         Still supports legacy links: (...)/tests/TD_COAP_(...)
         """
         tc_name = path.split('/')[-1]
-        tc = None
-
-        for tc_iter in td_objects_list:
-
-            if tc_iter.id.lower() == tc_name.lower():
-                tc = tc_iter
-                break
+        tc = get_testcase(tc_name)
 
         if tc is None:
             self.send_error(404, "Testcase %s couldn't be found in list %s" % (tc_name, testcases_paths))
@@ -409,14 +475,7 @@ class SimpleHTTPRequestHandler(BaseHTTPRequestHandler):
         Helper to produce testcase for paths like : (...)/tests/TD_COAP_(...)
         """
         tc_name = path.split('/')[-1]
-        tc = None
-
-        for tc_iter in td_objects_list:
-
-            if tc_iter.id.lower() == tc_name.lower():
-                tc = tc_iter
-
-                break
+        tc = get_testcase(tc_name)
 
         if tc is None:
             self.send_error(404, "Testcase couldn't be found")
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/env python3
+
+"""
+Measures packets/sec forwarded by the packet router, in default mode and in throughput mode.
+
+A burst of packets is published into a source topic of the routing table (as an agent would do), and the time needed
+for all packets to reach the destination topic is measured. Packets which overflow the router's source queue are
+reported as lost.
+
+EXECUTE AS:
+
+    python3 -m tests.benchmark__packet_router_throughput
+
+PRE-CONDITIONS:
+- Export AMQP_URL in the running environment
+- No other packet router running in the bus
+
+or run it without broker, on the in-memory event bus backend:
+
+    python3 -m tests.benchmark__packet_router_throughput --memory-broker
+"""
+
+import time
+import logging
+import argparse
+
+import pika
+import tabulate
+from messages import MsgPacketSniffedRaw
+
+from ioppytest import AMQP_URL, AMQP_EXCHANGE, memory_broker
+from ioppytest.packet_encoding import PACKET_ENCODINGS, PACKET_ENCODING_JSON, encode_packet_message
+
+SRC_RKEY = 'fromAgent.agent1.ip.tun.packet.raw'
+DST_RKEY = 'toAgent.agent2.ip.tun.packet.raw'
+DST_QUEUE = 'benchmark_packet_router@%s' % DST_RKEY
+
+MAX_WAIT_FOR_PACKETS = 60  # seconds
+
+
+def run_benchmark(packet_count, throughput_mode, packet_encoding):
+    # imported here, components' modules connect to the bus when imported (see --memory-broker)
+    from ioppytest.packet_router.__main__ import PacketRouter
+
+    router = PacketRouter(AMQP_URL, AMQP_EXCHANGE, {SRC_RKEY: [DST_RKEY]}, throughput_mode=throughput_mode)
+    router.daemon = True
+    router.start()
+
+    connection = pika.BlockingConnection(pika.URLParameters(AMQP_URL))
+    channel = connection.channel()
+    channel.queue_delete(queue=DST_QUEUE)
+    channel.queue_declare(queue=DST_QUEUE, auto_delete=False)
+    channel.queue_bind(exchange=AMQP_EXCHANGE, queue=DST_QUEUE, routing_key=DST_RKEY)
+
+    packet = MsgPacketSniffedRaw()
+    packet.routing_key = SRC_RKEY
+    body, props = encode_packet_message(packet, packet_encoding)
+
+    t_start = time.time()
+    for _ in range(packet_count):
+        channel.basic_publish(exchange=AMQP_EXCHANGE, routing_key=SRC_RKEY, body=body, properties=props)
+
+    received = 0
+    t_last_packet = t_start
+    while time.time() - t_last_packet < MAX_WAIT_FOR_PACKETS and received < packet_count:
+        method_frame, header_frame, _ = channel.basic_get(DST_QUEUE, auto_ack=True)
+        if method_frame is None:
+            # nothing for 1 sec after the last packet means the rest got lost
+            if time.time() - t_last_packet > 1 and received:
+                break
+            time.sleep(0.001)
+            continue
+        received += 1
+        t_last_packet = time.time()
+
+    elapsed = t_last_packet - t_start
+
+    router.connection.add_callback_threadsafe(router.stop)
+    router.join(timeout=10)
+    channel.queue_delete(queue=DST_QUEUE)
+    connection.close()
+
+    return received, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packets", type=int, default=5000, help="Number of packets in the burst")
+    parser.add_argument("--encoding", choices=PACKET_ENCODINGS, default=PACKET_ENCODING_JSON)
+    parser.add_argument("--memory-broker", help="Use the in-memory event bus backend instead of AMQP_URL's broker",
+                        action='store_true')
+    args = parser.parse_args()
+
+    if args.memory_broker:
+        memory_broker.install()
+
+    logging.getLogger('packet_router').setLevel(logging.WARNING)
+
+    results = []
+    for mode_name, throughput_mode in (('default', False), ('throughput', True)):
+        received, elapsed = run_benchmark(args.packets, throughput_mode, args.encoding)
+        results.append([
+            mode_name,
+            args.packets,
+            received,
+            args.packets - received,
+            '%.2f' % elapsed,
+            '%.1f' % (received / elapsed if elapsed else 0),
+        ])
+
+    print(tabulate.tabulate(results, headers=['mode', 'sent', 'routed', 'lost', 'seconds', 'packets/s']))
+
+
+if __name__ == '__main__':
+    main()
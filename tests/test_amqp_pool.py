@@ -0,0 +1,78 @@
+import unittest
+import threading
+import logging
+import pika
+
+from messages import MsgTestSuiteStart
+from ioppytest import AMQP_URL, AMQP_EXCHANGE
+from ioppytest.amqp_pool import AmqpPublisherPool, get_amqp_publisher
+
+
+class AmqpPublisherPoolTestCase(unittest.TestCase):
+    """
+    python3 -m pytest tests/test_amqp_pool.py
+    """
+
+    def setUp(self):
+        logging.info('using AMQP vars: %s, %s' % (AMQP_URL, AMQP_EXCHANGE,))
+        self.queue_name = 'testing_amqp_pool'
+
+        self.connection = pika.BlockingConnection(pika.URLParameters(AMQP_URL))
+        self.channel = self.connection.channel()
+        self.channel.queue_delete(queue=self.queue_name)
+        self.channel.queue_declare(queue=self.queue_name, auto_delete=False)
+        self.channel.queue_bind(exchange=AMQP_EXCHANGE,
+                                queue=self.queue_name,
+                                routing_key=MsgTestSuiteStart.routing_key)
+
+        self.pool = AmqpPublisherPool(AMQP_URL, AMQP_EXCHANGE, size=2)
+
+    def tearDown(self):
+        self.pool.close()
+        self.channel.queue_delete(queue=self.queue_name)
+        self.connection.close()
+
+    def _count_messages_in_queue(self):
+        count = 0
+        while True:
+            method_frame, header_frame, body = self.channel.basic_get(self.queue_name, auto_ack=True)
+            if method_frame is None:
+                return count
+            count += 1
+
+    def test_publish_reuses_connections(self):
+        for _ in range(10):
+            self.pool.publish_message(MsgTestSuiteStart())
+
+        # published with confirms, so messages are already routed when publish returns
+        assert self._count_messages_in_queue() == 10
+
+        with self.pool.connection() as c1:
+            assert c1.is_open
+
+    def test_publish_from_several_threads(self):
+        def publish_some():
+            for _ in range(5):
+                self.pool.publish_message(MsgTestSuiteStart())
+
+        threads = [threading.Thread(target=publish_some) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert self._count_messages_in_queue() == 20
+
+    def test_reconnects_after_connection_dropped(self):
+        self.pool.publish_message(MsgTestSuiteStart())
+
+        # let's kill the pooled connections behind the pool's back
+        for _ in range(self.pool.size):
+            with self.pool.connection() as c:
+                c.close()
+
+        self.pool.publish_message(MsgTestSuiteStart())
+        assert self._count_messages_in_queue() == 2
+
+    def test_process_wide_publisher_is_shared(self):
+        assert get_amqp_publisher(AMQP_URL, AMQP_EXCHANGE) is get_amqp_publisher(AMQP_URL, AMQP_EXCHANGE)
@@ -1,9 +1,12 @@
+import os
+import json
 import pprint
 import unittest
 from time import sleep
 
-from ioppytest import AMQP_URL, AMQP_EXCHANGE
+from ioppytest import AMQP_URL, AMQP_EXCHANGE, TMPDIR
 from ioppytest.test_coordinator.coordinator import Coordinator
+from ioppytest.test_coordinator.journal import SessionJournal
 from ioppytest import TD_COAP_CFG, TD_COAP
 from messages import *
 
@@ -335,6 +338,18 @@ class CoordinatorStateMachineTests(unittest.TestCase):
 
         logger.info(pprint.pformat(self.test_coordinator.testsuite.get_report()))
 
+    def test_stream_capture_failure_reply_has_no_capture_metadata(self):
+        # partial file can't be created, nothing is requested to the sniffer
+        reply = self.test_coordinator.call_service_sniffer_stream_capture(capture_id='TD_COAP_CORE_03',
+                                                                         dump_dir=os.path.join(TMPDIR, 'nonexistent'))
+        assert reply.ok is False
+        assert reply.error_message
+        assert reply.filename == 'TD_COAP_CORE_03.pcap'
+        assert reply.file_enc is None
+        assert reply.total_size == 0
+        assert reply.chunks == 0
+        assert 'TD_COAP_CORE_01' not in reply.to_json()
+
     def __emulate_iut_configuration_messages(self):
 
         self.test_coordinator.iut_configuration_executed(MsgConfigurationExecuted(
@@ -347,4 +362,129 @@ class CoordinatorStateMachineTests(unittest.TestCase):
             node="coap_client",
             ipv6_address="someAddressFor::coap_server"  # example of pixit
         ))
-        assert self.test_coordinator.state == 'waiting_for_testcase_start', 'got: %s' % self.test_coordinator.state
\ No newline at end of file
+        assert self.test_coordinator.state == 'waiting_for_testcase_start', 'got: %s' % self.test_coordinator.state
+
+
+class CoordinatorSessionRestoreTests(unittest.TestCase):
+    """
+    python3 -m pytest tests/test_fsm_and_coordinator.py::CoordinatorSessionRestoreTests
+    """
+
+    def setUp(self):
+        self.journal_file = os.path.join(TMPDIR, 'test_coordinator_journal.jsonl')
+        self.test_coordinator = self._new_coordinator()
+        self.test_coordinator.bootstrap()
+
+        self.test_coordinator.configure_testsuite(MsgSessionConfiguration(configuration=default_configuration))
+        self.test_coordinator.start_testsuite(MsgTestSuiteStart())
+        assert self.test_coordinator.state == 'waiting_for_iut_configuration_executed'
+
+    def tearDown(self):
+        os.remove(self.journal_file)
+
+    def _new_coordinator(self):
+        return Coordinator(amqp_url=AMQP_URL,
+                           amqp_exchange=AMQP_EXCHANGE,
+                           testsuite_name='coap',
+                           ted_config_file=TD_COAP_CFG,
+                           ted_tc_file=TD_COAP,
+                           journal_file=self.journal_file)
+
+    def _crash_and_restore(self):
+        # the crashed coordinator doesn't journal anything else (e.g. on FSM timeouts)
+        self.test_coordinator.journal.close()
+        self.test_coordinator.journal = None
+
+        restored_coordinator = self._new_coordinator()
+        assert restored_coordinator.restore_session() is True
+        return restored_coordinator
+
+    def test_restore_ongoing_testcase(self):
+        self.test_coordinator.iut_configuration_executed(MsgAgentTunStarted(name="coap_client",
+                                                                            ipv6_prefix="cccc",
+                                                                            ipv6_host="1"))
+        self.test_coordinator.iut_configuration_executed(MsgAgentTunStarted(name="coap_server",
+                                                                            ipv6_prefix="cccc",
+                                                                            ipv6_host="2"))
+        self.test_coordinator.skip_testcase(MsgTestCaseSkip(testcase_id='TD_COAP_CORE_03'))
+        self.test_coordinator.start_testcase(MsgTestCaseStart())
+        self.test_coordinator.step_executed(MsgStepStimuliExecuted(node='coap_client'))
+        assert self.test_coordinator.testsuite.get_current_step_id() == 'TD_COAP_CORE_01_step_04'
+
+        restored = self._crash_and_restore()
+
+        assert restored.testsuite.session_id == self.test_coordinator.testsuite.session_id
+        assert restored.get_nodes_addressing_table() == self.test_coordinator.get_nodes_addressing_table()
+        assert restored.testsuite.nodes_configured == {'coap_client', 'coap_server'}
+        assert restored.testsuite.get_testcase('TD_COAP_CORE_03').state == 'skipped'
+        assert restored.testsuite.get_testcase('TD_COAP_CORE_04').state == 'skipped'  # not in session config
+
+        # ongoing test case is restarted
+        assert restored.testsuite.get_current_testcase_id() == 'TD_COAP_CORE_01'
+        assert restored.testsuite.get_current_testcase_state() == 'configuring'
+        assert restored.testsuite.get_current_step() is None
+        assert restored.state == 'waiting_for_iut_configuration_executed', 'got: %s' % restored.state
+
+    def test_restore_does_not_re_execute_finished_testcases(self):
+        current_tc = self.test_coordinator.testsuite.get_current_testcase()
+        current_tc.generate_testcase_report(err_msg='some error')
+        current_tc.change_state('finished')
+        self.test_coordinator.skip_testcase(MsgTestCaseSkip(testcase_id='TD_COAP_CORE_03'))
+
+        restored = self._crash_and_restore()
+
+        tc = restored.testsuite.get_testcase('TD_COAP_CORE_01')
+        assert tc.state == 'finished'
+        assert tc.report == current_tc.report
+        assert [step.state for step in tc.sequence] == [step.state for step in current_tc.sequence]
+        assert restored.testsuite.get_current_testcase_id() == 'TD_COAP_CORE_02'
+        assert restored.state == 'waiting_for_iut_configuration_executed', 'got: %s' % restored.state
+
+    def test_restore_stable_state(self):
+        self.test_coordinator.skip_testcase(MsgTestCaseSkip())
+        self.test_coordinator.skip_testcase(MsgTestCaseSkip())
+        self.test_coordinator.skip_testcase(MsgTestCaseSkip())
+        assert self.test_coordinator.state == 'testsuite_finished'
+
+        restored = self._crash_and_restore()
+        assert restored.state == 'testsuite_finished'
+        assert restored.get_testsuite_report() == self.test_coordinator.get_testsuite_report()
+
+    def test_journal_snapshots_only_changed_testcases(self):
+        self.test_coordinator.skip_testcase(MsgTestCaseSkip(testcase_id='TD_COAP_CORE_03'))
+        self.test_coordinator.save_session_snapshot()
+
+        with open(self.journal_file) as f:
+            records = [json.loads(line) for line in f]
+
+        # first snapshot of the session has all test cases, then only the skipped one and the current one change
+        assert len(records[0]['delta']['testcases']) == len(self.test_coordinator.testsuite.get_testcases_basic())
+        assert set(records[-1]['delta']['testcases']) <= {'TD_COAP_CORE_03', 'TD_COAP_CORE_01'}
+        assert 'TD_COAP_CORE_03' in {tc for r in records[1:] for tc in r['delta'].get('testcases', {})}
+
+        snapshot = json.loads(json.dumps(self.test_coordinator.get_session_snapshot()))
+        assert SessionJournal(self.journal_file).load() == snapshot
+
+    def test_journal_only_appends_changes(self):
+        journal = SessionJournal(self.journal_file)
+        journal.clear()
+        snapshot = {'fsm': {'state': 'a'}, 'testcases': {'TC_1': {'state': None}, 'TC_2': {'state': None}}}
+
+        assert journal.append(snapshot) == 3
+        assert journal.append(snapshot) == 0
+        snapshot['testcases']['TC_2'] = {'state': 'finished'}
+        assert journal.append(snapshot) == 1
+        journal.close()
+
+        # record being written when the process died
+        with open(self.journal_file, 'a') as f:
+            f.write('{"t": 1, "delta": {"fsm": {"sta')
+
+        journal = SessionJournal(self.journal_file)
+        assert journal.load() == snapshot
+        assert journal.append(snapshot) == 0
+        snapshot['fsm']['state'] = 'b'
+        assert journal.append(snapshot) == 1
+        journal.close()
+
+        assert SessionJournal(self.journal_file).load() == snapshot
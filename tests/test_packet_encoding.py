@@ -0,0 +1,59 @@
+import unittest
+from collections import namedtuple
+
+import pika
+from messages import MsgPacketSniffedRaw, MsgRoutingStartLossyLink
+
+from ioppytest.packet_encoding import (
+    PACKET_ENCODINGS,
+    PACKET_ENCODING_JSON,
+    PACKET_ENCODING_RAW,
+    CONTENT_TYPE_RAW,
+    get_packet_encoding,
+    is_packet_routing_key,
+    load_packet_message,
+    encode_packet_message,
+)
+
+Method = namedtuple('Method', ['routing_key', 'delivery_tag'])
+
+
+class PacketEncodingTestCase(unittest.TestCase):
+    """
+    python3 -m pytest tests/test_packet_encoding.py
+    """
+
+    def setUp(self):
+        self.packet = MsgPacketSniffedRaw()
+        self.packet.routing_key = 'fromAgent.coap_client.ip.tun.packet.raw'
+        self.method = Method(self.packet.routing_key, 1)
+
+    def _roundtrip(self, encoding):
+        body, props = encode_packet_message(self.packet, encoding)
+        if type(body) is str:
+            body = body.encode('utf-8')
+        return body, props, load_packet_message(self.method, props, body)
+
+    def test_encodings_roundtrip(self):
+        for encoding in PACKET_ENCODINGS:
+            body, props, m = self._roundtrip(encoding)
+
+            assert get_packet_encoding(props) == encoding
+            assert type(m) is MsgPacketSniffedRaw
+            assert bytes(m.data) == bytes(self.packet.data)
+            assert m.timestamp == self.packet.timestamp
+            assert m.interface_name == self.packet.interface_name
+
+    def test_raw_encoding_is_packet_itself(self):
+        body, props, m = self._roundtrip(PACKET_ENCODING_RAW)
+        assert props.content_type == CONTENT_TYPE_RAW
+        assert body == bytes(self.packet.data)
+
+    def test_json_is_default_encoding(self):
+        assert get_packet_encoding(pika.BasicProperties()) == PACKET_ENCODING_JSON
+        assert get_packet_encoding(pika.BasicProperties(content_type='application/json')) == PACKET_ENCODING_JSON
+
+    def test_packet_routing_keys(self):
+        assert is_packet_routing_key('fromAgent.coap_client.ip.tun.packet.raw')
+        assert is_packet_routing_key('toAgent.coap_server.802154.serial.packet.raw')
+        assert not is_packet_routing_key(MsgRoutingStartLossyLink.routing_key)
@@ -6,7 +6,14 @@ import json
 import pika
 
 from messages import MsgPacketInjectRaw, MsgRoutingStartLossyLink
-from ioppytest.packet_router.__main__ import PacketRouter
+from ioppytest.packet_router.__main__ import (PacketRouter,
+                                              partition_routing_table,
+                                              generate_routing_table_from_test_configuration)
+from ioppytest.packet_router.impairments import LinkImpairment, TimerWheel
+from ioppytest.packet_router.stats import RoutingStats
+from ioppytest.messages_extensions import MsgRoutingTableUpdate
+from ioppytest.test_suite.testsuite import get_dict_of_all_test_cases_configurations
+from ioppytest.packet_encoding import PACKET_ENCODING_RAW, encode_packet_message
 from ioppytest import AMQP_URL, AMQP_EXCHANGE
 
 TIME_NEEDED_FOR_EVENT_TO_BE_ROUTED = 5  # estimation
@@ -93,6 +100,91 @@ class PacketRouterTestCase(unittest.TestCase):
         assert method_frame is not None, 'Expected to get a message, but nothing was received'
         self.channel.basic_ack(method_frame.delivery_tag)
 
+    def test_packet_routing_forwards_body_and_headers_untouched(self):
+        """
+        Tests that packets are forwarded as published by the agent (same body, content type and headers).
+        """
+        assert self.channel.is_open, 'no channel opened for tests'
+
+        m = MsgPacketInjectRaw()
+        m.routing_key = list(self.routing_table.keys())[0]
+        body, props = encode_packet_message(m, PACKET_ENCODING_RAW)
+        self.channel.basic_publish(
+            body=body,
+            routing_key=m.routing_key,
+            exchange=AMQP_EXCHANGE,
+            properties=props
+        )
+
+        time.sleep(TIME_NEEDED_FOR_EVENT_TO_BE_ROUTED)
+        method_frame, header_frame, received_body = self.channel.basic_get(self.queue_name)
+        assert method_frame is not None, 'Expected to get a message, but nothing was received'
+        self.channel.basic_ack(method_frame.delivery_tag)
+
+        assert method_frame.routing_key == self.routing_table[m.routing_key][0]
+        assert received_body == body
+        assert header_frame.content_type == props.content_type
+        assert header_frame.headers == props.headers
+
+    def test_packet_from_unknown_source_is_not_routed(self):
+        """
+        Tests that packets from agents outside the routing table are consumed but not routed.
+        """
+        assert self.channel.is_open, 'no channel opened for tests'
+
+        m = MsgPacketInjectRaw()
+        m.routing_key = 'fromAgent.agent3.ip.tun.packet.raw'
+        self.channel.basic_publish(
+            body=m.to_json(),
+            routing_key=m.routing_key,
+            exchange=AMQP_EXCHANGE,
+            properties=pika.BasicProperties(
+                content_type='application/json',
+            )
+        )
+
+        time.sleep(TIME_NEEDED_FOR_EVENT_TO_BE_ROUTED)
+        method_frame, header_frame, body = self.channel.basic_get(self.queue_name)
+        assert method_frame is None, 'Expected None, meaning that the packet was not routed'
+
+    def test_routing_table_update(self):
+        """
+        Tests that after a routing table update request packets are routed using the new test configuration's table.
+        """
+        assert self.channel.is_open, 'no channel opened for tests'
+
+        m = MsgRoutingTableUpdate(configuration_id='COAP_CFG_01')
+        self.channel.basic_publish(
+            body=m.to_json(),
+            routing_key=m.routing_key,
+            exchange=AMQP_EXCHANGE,
+            properties=pika.BasicProperties(**m.get_properties())
+        )
+        time.sleep(TIME_NEEDED_FOR_EVENT_TO_BE_ROUTED)
+
+        # agent1 is not part of COAP_CFG_01
+        self._send_packet_fromAgent1()
+        time.sleep(TIME_NEEDED_FOR_EVENT_TO_BE_ROUTED)
+        method_frame, header_frame, body = self.channel.basic_get(self.queue_name)
+        assert method_frame is None, 'Expected None, meaning that the packet was not routed'
+
+        m = MsgPacketInjectRaw()
+        m.routing_key = 'fromAgent.coap_client.ip.tun.packet.raw'
+        self.channel.basic_publish(
+            body=m.to_json(),
+            routing_key=m.routing_key,
+            exchange=AMQP_EXCHANGE,
+            properties=pika.BasicProperties(
+                content_type='application/json',
+            )
+        )
+        time.sleep(TIME_NEEDED_FOR_EVENT_TO_BE_ROUTED)
+        method_frame, header_frame, body = self.channel.basic_get(self.queue_name)
+        assert method_frame is not None, 'Expected to get a message, but nothing was received'
+        self.channel.basic_ack(method_frame.delivery_tag)
+        assert method_frame.routing_key in ('toAgent.coap_server.ip.tun.packet.raw',
+                                            'toAgent.agent_TT.ip.tun.packet.raw')
+
     def _send_packet_fromAgent1(self):
         """
         tests
@@ -137,3 +229,133 @@ class PacketRouterTestCase(unittest.TestCase):
             )
         )
 
+
+class RoutingTablePartitionTestCase(unittest.TestCase):
+    """
+    python3 -m pytest tests/test_packet_router.py -k RoutingTablePartition
+    """
+
+    def setUp(self):
+        self.testconfig = get_dict_of_all_test_cases_configurations()['COAP_CFG_01']
+        self.routing_table = generate_routing_table_from_test_configuration(self.testconfig)
+
+    def test_partition_by_node_keeps_all_routes_of_a_source_together(self):
+        partitions = partition_routing_table(self.routing_table, self.testconfig, 2, 'node')
+        assert len(partitions) == 2
+
+        merged = {}
+        for p in partitions:
+            assert not set(p) & set(merged), 'source routing key found in several partitions'
+            merged.update(p)
+        assert merged == self.routing_table
+
+        for p in partitions:
+            src_nodes = {k for k in p if 'coap_client' in k.split('.')}
+            assert not src_nodes or len(src_nodes) == 3  # fromAgent tun, fromAgent serial and legacy serial
+
+    def test_partition_by_link(self):
+        # COAP_CFG_01 has only one link, the rest of partitions are kept (empty) so shard indexes stay stable
+        partitions = partition_routing_table(self.routing_table, self.testconfig, 4, 'link')
+        assert partitions == [self.routing_table, {}, {}, {}]
+
+
+class LinkImpairmentsTestCase(unittest.TestCase):
+    """
+    python3 -m pytest tests/test_packet_router.py -k LinkImpairments
+    """
+
+    def test_timer_wheel_returns_expired_items_in_order(self):
+        wheel = TimerWheel(tick=0.001, slots=8)
+        now = 1000.0
+
+        for item, delay in enumerate([0.005, 0.001, 0.020, 0.005]):
+            wheel.schedule(now, delay, item)
+
+        assert wheel.advance(now) == []
+        assert wheel.advance(now + 0.0015) == [1]
+        assert wheel.advance(now + 0.006) == [0, 3]
+        assert len(wheel) == 1
+
+        # item scheduled more than a full turn of the wheel ahead
+        assert wheel.advance(now + 0.015) == []
+        assert wheel.advance(now + 0.025) == [2]
+        assert len(wheel) == 0
+
+    def test_timer_wheel_next_expiry(self):
+        wheel = TimerWheel(tick=0.001, slots=8)
+        now = 1000.0
+        assert wheel.next_expiry() is None
+
+        # expiries beyond a full turn of the wheel share slots with nearer ones
+        assert round(wheel.schedule(now, 0.020, 'a'), 6) == 1000.020
+        assert round(wheel.next_expiry(), 6) == 1000.020
+        wheel.schedule(now, 0.004, 'b')
+        assert round(wheel.next_expiry(), 6) == 1000.004
+
+        assert wheel.advance(now + 0.005) == ['b']
+        assert round(wheel.next_expiry(), 6) == 1000.020
+
+    def test_drop_next_packets_before_other_impairments(self):
+        impairment = LinkImpairment(delay=0.1, drop_next=2)
+        assert impairment.process() == []
+        assert impairment.process() == []
+        assert impairment.process() == [0.1]
+
+    def test_loss_duplication_and_reorder(self):
+        assert LinkImpairment(loss=100).process() == []
+        assert LinkImpairment(duplication=100).process() == [0, 0]
+        assert LinkImpairment(delay=0.1, reorder=100).process() == [0]
+
+    def test_reorder_without_delay_is_refused(self):
+        with self.assertRaises(AssertionError):
+            LinkImpairment.from_dict({'reorder': 5})
+        assert LinkImpairment.from_dict({'reorder': 5, 'jitter': 0.01}).reorder == 5
+
+    def test_jitter_bounds(self):
+        impairment = LinkImpairment(delay=0.1, jitter=0.05)
+        for _ in range(100):
+            delay, = impairment.process()
+            assert 0.05 <= delay <= 0.15
+
+    def test_unknown_impairment_parameter(self):
+        with self.assertRaises(ValueError):
+            LinkImpairment.from_dict({'bandwidth': 100})
+
+
+class RoutingStatsTestCase(unittest.TestCase):
+    """
+    python3 -m pytest tests/test_packet_router.py -k RoutingStats
+    """
+
+    def setUp(self):
+        self.routing_table = {
+            'fromAgent.agent1.ip.tun.packet.raw': ['toAgent.agent2.ip.tun.packet.raw',
+                                                   'toAgent.agent_TT.ip.tun.packet.raw'],
+        }
+        self.stats = RoutingStats(self.routing_table)
+
+    def test_per_route_counters(self):
+        src = 'fromAgent.agent1.ip.tun.packet.raw'
+        for dst in self.routing_table[src]:
+            self.stats.record_forwarded(src, dst, 100, latency=0.002)
+            self.stats.record_forwarded(src, dst, 50)
+        self.stats.record_dropped(src)
+        self.stats.record_overflow(src, count=3)
+
+        routes = self.stats.to_list()
+        assert len(routes) == 2
+        for route in routes:
+            assert route['src'] == src
+            assert route['packets'] == 2
+            assert route['bytes'] == 150
+            assert route['drops'] == 1
+            assert route['overflows'] == 3
+            assert route['latency']['count'] == 1
+            assert [0.005, 1] in route['latency']['buckets']
+
+    def test_latency_beyond_last_bucket(self):
+        src, dst = 'fromAgent.agent1.ip.tun.packet.raw', 'toAgent.agent2.ip.tun.packet.raw'
+        self.stats.record_forwarded(src, dst, 100, latency=60)
+        latency = self.stats.to_list()[0]['latency']
+        assert latency['buckets'][-1] == ['+inf', 1]
+        assert latency['max'] == 60
@@ -1,18 +1,48 @@
 import multiprocessing
+import threading
 import unittest
+import hashlib
+import gzip
+import base64
+import io
+import ipaddress
 import logging
 import time
 import json
+import struct
 import pika
 import os
 
-from ioppytest import AMQP_URL, AMQP_EXCHANGE
+from ioppytest import AMQP_URL, AMQP_EXCHANGE, TMPDIR, memory_broker
+from ioppytest.packet_encoding import encode_packet_body
 from event_bus_utils import amqp_request, publish_message
 from ioppytest.packet_sniffer.__main__ import Sniffer
+from ioppytest.packet_sniffer.capture_transfer import CaptureTransferClient, CaptureTransferError
+from ioppytest.packet_sniffer.ring_buffer import CaptureRingBuffer
+from ioppytest.packet_sniffer.capture_index import CaptureIndex, load_capture_index, get_index_path
+from ioppytest.packet_sniffer.capture_worker import PcapWriter
+from ioppytest.packet_sniffer.capture_compression import decode_capture, FILE_ENC_PCAP_GZIP
+from ioppytest.packet_sniffer.capture_index import slice_capture
+from ioppytest.packet_sniffer.capture_filter import CaptureFrame, compile_capture_filter
+from ioppytest.messages_extensions import MsgSniffingExtractCapture, MsgSniffingGetCaptureSlice
 from messages import *
 import pure_pcapy
 
 
+
+def forge_ip_packet(proto, sport=0, dport=0, src='fe80::1', dst='fe80::2', version=6):
+    """
+    :return: IPv6 / IPv4 packet with an UDP / TCP header (sport, dport) or an empty ICMP payload
+    """
+    payload = struct.pack('!HH', sport, dport) + bytes(4) if proto in ('udp', 'tcp') else bytes(4)
+    proto = {'icmp': 1, 'tcp': 6, 'udp': 17, 'icmp6': 58}[proto]
+    if version == 6:
+        return (struct.pack('!IHBB', 6 << 28, len(payload), proto, 64) +
+                ipaddress.ip_address(src).packed + ipaddress.ip_address(dst).packed + payload)
+    return (struct.pack('!BBHHHBBH', 0x45, 0, 20 + len(payload), 0, 0, 64, proto, 0) +
+            ipaddress.ip_address(src).packed + ipaddress.ip_address(dst).packed + payload)
+
+
 class SnifferTestCase(unittest.TestCase):
     """
     python3 -m unittest tests/test_packet_sniffer.py
@@ -122,3 +152,418 @@ class SnifferTestCase(unittest.TestCase):
         )
 
         assert response.ok, 'Returned %s' % repr(response)
+
+
+class CaptureTransferTestCase(unittest.TestCase):
+    """
+    Runs on the in-memory event bus backend, no broker needed
+
+    python3 -m pytest tests/test_packet_sniffer.py -k CaptureTransfer
+    """
+
+    def setUp(self):
+        memory_broker.install()
+        memory_broker.reset_broker()
+
+        self.capture_id = 'test_capture_transfer'
+        self.capture = os.urandom(300 * 1024 + 7)
+        with open(os.path.join(TMPDIR, '%s.pcap' % self.capture_id), 'wb') as f:
+            f.write(self.capture)
+
+        self.connection = pika.BlockingConnection(pika.URLParameters(AMQP_URL))
+        channel = self.connection.channel()
+        channel.queue_declare(queue='component_ready')
+        channel.queue_bind(exchange=AMQP_EXCHANGE, queue='component_ready',
+                           routing_key=MsgTestingToolComponentReady.routing_key)
+
+        self.sniffer = Sniffer(traffic_dlt=pure_pcapy.DLT_RAW, amqp_url=AMQP_URL, amqp_exchange=AMQP_EXCHANGE)
+        self.sniffer_thread = threading.Thread(target=self.sniffer.run, daemon=True)
+        self.sniffer_thread.start()
+
+        # wait for the sniffer to be subscribed to the bus
+        for _ in range(100):
+            method, props, body = channel.basic_get('component_ready', auto_ack=True)
+            if method:
+                break
+            time.sleep(0.01)
+        channel.close()
+
+        self.client = CaptureTransferClient(self.connection, self.__class__.__name__, AMQP_EXCHANGE, timeout=5)
+
+    def tearDown(self):
+        self.sniffer.connection.add_callback_threadsafe(self.sniffer.channel.stop_consuming)
+        self.sniffer_thread.join(timeout=5)
+        self.connection.close()
+        os.remove(os.path.join(TMPDIR, '%s.pcap' % self.capture_id))
+        memory_broker.uninstall()
+
+    def test_get_chunk(self):
+        reply = self.client.get_chunk(self.capture_id, offset=10, length=100)
+        assert base64.b64decode(reply.value) == self.capture[10:110]
+        assert reply.total_size == len(self.capture)
+        assert not reply.eof
+
+    def test_download_by_chunks(self):
+        f = io.BytesIO()
+        filename, size = self.client.download(self.capture_id, f, chunk_size=64 * 1024)
+        assert filename == '%s.pcap' % self.capture_id
+        assert size == len(self.capture)
+        assert f.getvalue() == self.capture
+
+    def test_stream_with_checksum(self):
+        f = io.BytesIO()
+        reply = self.client.stream(self.capture_id, f, chunk_size=64 * 1024)
+        assert reply.chunks == 5
+        assert reply.checksum == hashlib.sha256(self.capture).hexdigest()
+        assert f.getvalue() == self.capture
+
+    def test_stream_compressed(self):
+        f = io.BytesIO()
+        reply = self.client.stream(self.capture_id, f, chunk_size=64 * 1024, compression='gzip')
+        assert reply.file_enc == FILE_ENC_PCAP_GZIP
+        assert reply.checksum == hashlib.sha256(f.getvalue()).hexdigest()
+        assert gzip.decompress(f.getvalue()) == self.capture
+
+    def test_get_capture_compressed(self):
+        reply = amqp_request(self.connection, MsgSniffingGetCapture(capture_id=self.capture_id, compression='gzip'),
+                             self.__class__.__name__, retries=10, use_message_typing=True)
+        assert reply.ok
+        assert decode_capture(reply.file_enc, reply.value) == self.capture
+
+    def test_stream_unknown_capture(self):
+        with self.assertRaises(CaptureTransferError):
+            self.client.stream('unknown_capture_id', io.BytesIO())
+
+
+class CaptureWorkerTestCase(unittest.TestCase):
+    """
+    Runs on the in-memory event bus backend, no broker needed
+
+    python3 -m pytest tests/test_packet_sniffer.py -k CaptureWorker
+    """
+
+    def setUp(self):
+        memory_broker.install()
+        memory_broker.reset_broker()
+
+        self.capture_id = 'test_capture_worker'
+        self.routing_key_data_packet = 'fromAgent.someRandomIutRole.ip.tun.packet.raw'
+
+        self.connection = pika.BlockingConnection(pika.URLParameters(AMQP_URL))
+        channel = self.connection.channel()
+        channel.queue_declare(queue='component_ready')
+        channel.queue_bind(exchange=AMQP_EXCHANGE, queue='component_ready',
+                           routing_key=MsgTestingToolComponentReady.routing_key)
+
+        self.sniffer = Sniffer(traffic_dlt=pure_pcapy.DLT_RAW, amqp_url=AMQP_URL, amqp_exchange=AMQP_EXCHANGE,
+                               ring_buffer=CaptureRingBuffer(max_size=1024 * 1024))
+        self.sniffer_thread = threading.Thread(target=self.sniffer.run, daemon=True)
+        self.sniffer_thread.start()
+
+        for _ in range(100):
+            method, props, body = channel.basic_get('component_ready', auto_ack=True)
+            if method:
+                break
+            time.sleep(0.01)
+        channel.close()
+
+    def tearDown(self):
+        self.sniffer.connection.add_callback_threadsafe(self.sniffer.channel.stop_consuming)
+        self.sniffer_thread.join(timeout=5)
+        self.connection.close()
+        path = os.path.join(TMPDIR, '%s.pcap' % self.capture_id)
+        for f in path, get_index_path(path):
+            if os.path.exists(f):
+                os.remove(f)
+        memory_broker.uninstall()
+
+    def _request(self, message):
+        return amqp_request(self.connection, message, self.__class__.__name__, retries=10, use_message_typing=True)
+
+    def _publish_packet(self, data, routing_key=None, timestamp=None):
+        # body built here, MsgPacketSniffedRaw serializes the (seconds) AMQP timestamp property as packet's timestamp
+        fields = {'interface_name': 'tun0', 'timestamp': time.time() if timestamp is None else timestamp}
+        if timestamp is False:
+            del fields['timestamp']
+        body, content_type, headers = encode_packet_body(data, fields)
+        channel = self.connection.channel()
+        channel.basic_publish(AMQP_EXCHANGE, routing_key or self.routing_key_data_packet, body,
+                              pika.BasicProperties(content_type=content_type, headers=headers))
+        channel.close()
+
+    def _read_frames(self, filename=None, timestamps=False):
+        with open(os.path.join(TMPDIR, filename or '%s.pcap' % self.capture_id), 'rb') as f:
+            reader = pure_pcapy.Reader(f)
+            assert reader.datalink() == pure_pcapy.DLT_RAW
+            frames = []
+            while True:
+                header, data = reader.next()
+                if header is None:
+                    return frames
+                if timestamps:
+                    ts_sec, ts_usec = header.getts()
+                    frames.append((ts_sec + ts_usec / 1000000, data))
+                else:
+                    frames.append(data)
+
+    def test_captures_only_packets_between_start_and_stop(self):
+        self._publish_packet(b'before start')
+
+        assert self._request(MsgSniffingStart(capture_id=self.capture_id, filter_proto=None)).ok
+        self._publish_packet(b'first')
+        self._publish_packet(b'second')
+
+        # reply sent once capture is flushed and closed, file can be read right away
+        reply = self._request(MsgSniffingStop())
+        assert reply.ok
+        assert reply.frames == 2
+        assert reply.captures == {self.capture_id: 2}
+
+        self._publish_packet(b'after stop')
+        assert self._request(MsgSniffingStart(capture_id='another_capture', filter_proto=None)).ok
+        assert self._request(MsgSniffingStop()).ok
+        os.remove(os.path.join(TMPDIR, 'another_capture.pcap'))
+        os.remove(os.path.join(TMPDIR, 'another_capture.pcap.idx'))
+
+        assert self._read_frames() == [b'first', b'second']
+
+    def test_start_while_capturing_is_refused(self):
+        assert self._request(MsgSniffingStart(capture_id=self.capture_id, filter_proto=None)).ok
+        assert not self._request(MsgSniffingStart(capture_id=self.capture_id, filter_proto=None)).ok
+        assert self._request(MsgSniffingStop()).ok
+
+    def test_concurrent_link_captures(self):
+        for link_id, nodes in ('link_01', ['node1', 'node2']), ('link_02', ['node2', 'node3']):
+            request = MsgSniffingStart(capture_id=self.capture_id, link_id=link_id, nodes=nodes, filter_proto=None)
+            assert self._request(request).ok
+
+        for node in 'node1', 'node2', 'node3', 'node4':
+            self._publish_packet(node.encode(), 'fromAgent.%s.ip.tun.packet.raw' % node)
+
+        reply = self._request(MsgSniffingStop())
+        assert reply.ok
+        assert reply.captures == {self.capture_id: 4}
+
+        # capture's file gets all packets (node4 is in no link), link files only the packets of the link's nodes
+        assert self._read_frames() == [b'node1', b'node2', b'node3', b'node4']
+        for link_id, frames in ('link_01', [b'node1', b'node2']), ('link_02', [b'node2', b'node3']):
+            filename = '%s_%s.pcap' % (self.capture_id, link_id)
+            assert self._read_frames(filename) == frames
+            os.remove(os.path.join(TMPDIR, filename))
+            os.remove(get_index_path(os.path.join(TMPDIR, filename)))
+
+        # slices of the capture, using its frame index
+        for filters, frames in ({'link_id': 'link_02'}, [b'node2', b'node3']), ({'agents': ['node1']}, [b'node1']):
+            reply = self._request(MsgSniffingGetCaptureSlice(capture_id=self.capture_id, **filters))
+            assert reply.ok, repr(reply)
+            assert reply.frames == len(frames)
+            with open(os.path.join(TMPDIR, 'test_slice.pcap'), 'wb') as f:
+                f.write(base64.b64decode(reply.value))
+            assert self._read_frames('test_slice.pcap') == frames
+            os.remove(os.path.join(TMPDIR, 'test_slice.pcap'))
+
+    def test_extract_capture_from_ring_buffer(self):
+        self._publish_packet(b'before', 'fromAgent.node1.ip.tun.packet.raw')
+        time.sleep(0.1)
+        t_start = time.time()
+        for node in 'node1', 'node2', 'node3':
+            self._publish_packet(node.encode(), 'fromAgent.%s.ip.tun.packet.raw' % node)
+        time.sleep(0.1)
+        t_end = time.time()
+        self._publish_packet(b'after', 'fromAgent.node1.ip.tun.packet.raw')
+
+        reply = self._request(MsgSniffingExtractCapture(capture_id=self.capture_id, t_start=t_start, t_end=t_end,
+                                                        nodes=['node1', 'node2']))
+        assert reply.ok, repr(reply)
+        assert reply.frames == 2
+        assert reply.oldest_timestamp < t_start
+        assert self._read_frames() == [b'node1', b'node2']
+
+    def test_frames_stamped_with_packet_timestamp(self):
+        assert self._request(MsgSniffingStart(capture_id=self.capture_id, filter_proto=None)).ok
+        t_before = time.time()
+        self._publish_packet(b'stamped', timestamp=1488586183.25)
+        self._publish_packet(b'not stamped', timestamp=False)
+        assert self._request(MsgSniffingStop()).ok
+        t_after = time.time()
+
+        (stamped_ts, stamped), (ingest_ts, not_stamped) = self._read_frames(timestamps=True)
+        assert (stamped, not_stamped) == (b'stamped', b'not stamped')
+        assert stamped_ts == 1488586183.25
+        assert t_before - 0.001 <= ingest_ts <= t_after
+
+        # the out of order frame is still found when slicing the capture by time window
+        reply = self._request(MsgSniffingGetCaptureSlice(capture_id=self.capture_id, t_start=1488586183,
+                                                         t_end=1488586184))
+        assert reply.ok, repr(reply)
+        assert reply.frames == 1
+
+    def test_capture_filter_applied_on_ingest(self):
+        coap = forge_ip_packet('udp', 5683, 5683)
+        ping = forge_ip_packet('icmp6')
+        assert self._request(MsgSniffingStart(capture_id=self.capture_id, filter_proto='udp', filter_if='tun0')).ok
+        for data in coap, ping, coap:
+            self._publish_packet(data)
+
+        reply = self._request(MsgSniffingStop())
+        assert reply.captures == {self.capture_id: 2}
+        assert self._read_frames() == [coap, coap]
+
+        assert not self._request(MsgSniffingStart(capture_id=self.capture_id, filter_proto='udp port')).ok
+
+
+class CaptureFilterTestCase(unittest.TestCase):
+    """
+    python3 -m pytest tests/test_packet_sniffer.py -k CaptureFilter
+    """
+
+    def _matches(self, expression, data, interface_name='tun0', filter_if=None):
+        return compile_capture_filter(expression, filter_if)(CaptureFrame(data, interface_name))
+
+    def test_no_filter(self):
+        for expression in None, '', 'none', 'TBD':
+            assert compile_capture_filter(expression) is None
+
+    def test_protocol_and_port_filters(self):
+        coap = forge_ip_packet('udp', 40000, 5683)
+        coap_v4 = forge_ip_packet('udp', 40000, 5683, src='10.0.0.1', dst='10.0.0.2', version=4)
+        http = forge_ip_packet('tcp', 40000, 80)
+        ping = forge_ip_packet('icmp6')
+
+        for expression, matched in (
+                ('udp', [coap, coap_v4]),
+                ('ip6 and udp', [coap]),
+                ('udp dst port 5683', [coap, coap_v4]),
+                ('src port 5683', []),
+                ('port 80 or icmp6', [http, ping]),
+                ('not udp', [http, ping, b'not an ip packet']),
+                ('host 10.0.0.2', [coap_v4]),
+                ('src host fe80::1 and not tcp', [coap, ping]),
+        ):
+            assert [p for p in (coap, coap_v4, http, ping, b'not an ip packet')
+                    if self._matches(expression, p)] == matched, expression
+
+    def test_interface_filter(self):
+        coap = forge_ip_packet('udp', 5683, 5683)
+        assert self._matches(None, coap, 'tun0', filter_if='tun0')
+        assert not self._matches('udp', coap, 'serial0', filter_if='tun0')
+
+    def test_wrong_filters(self):
+        for expression in 'udp port', 'port http', 'udp and', 'udp tcp', 'host nowhere', 'sctp':
+            with self.assertRaises(ValueError):
+                compile_capture_filter(expression)
+
+        with self.assertRaises(ValueError):
+            compile_capture_filter('udp', dlt=pure_pcapy.DLT_IEEE802_15_4_NOFCS)
+
+
+class CaptureRingBufferTestCase(unittest.TestCase):
+    """
+    python3 -m pytest tests/test_packet_sniffer.py -k CaptureRingBuffer
+    """
+
+    def setUp(self):
+        self.spill_dir = os.path.join(TMPDIR, 'test_ring_buffer')
+
+    def tearDown(self):
+        if os.path.exists(self.spill_dir):
+            os.rmdir(self.spill_dir)
+
+    def test_memory_only_drops_oldest_frames(self):
+        rb = CaptureRingBuffer(max_size=30)
+        for i in range(10):
+            rb.append(float(i), 'node%s' % (i % 2), b'%010d' % i)
+
+        assert len(rb.frames) == 3
+        assert rb.oldest_timestamp == 7
+        assert [f.data for f in rb.extract(0, 8)] == [b'0000000007', b'0000000008']
+
+    def test_spill_to_disk(self):
+        rb = CaptureRingBuffer(max_size=30, spill_dir=self.spill_dir, spill_max_size=100, spill_segment_size=40)
+        for i in range(20):
+            rb.append(float(i), 'node%s' % (i % 2), b'%010d' % i)
+
+        # 3 frames in memory, spilled ones (29 bytes records) bounded by spill_max_size
+        assert len(rb.frames) == 3
+        assert rb.spill_size <= 100
+        oldest = int(rb.oldest_timestamp)
+        assert [f.data for f in rb.extract(0, 100)] == [b'%010d' % i for i in range(oldest, 20)]
+        assert [f.source_agent for f in rb.extract(0, 100, nodes=['node1'])] == \
+               ['node1'] * len([i for i in range(oldest, 20) if i % 2])
+
+        rb.close()
+        assert os.listdir(self.spill_dir) == []
+
+    def test_out_of_order_frames(self):
+        rb = CaptureRingBuffer(max_size=30, spill_dir=self.spill_dir, spill_max_size=1000, spill_segment_size=40)
+        for i in 0, 2, 1, 4, 3, 6, 5:
+            rb.append(float(i), 'node0', b'%010d' % i)
+
+        assert rb.oldest_timestamp == 0
+        assert sorted(f.data for f in rb.extract(1, 4)) == [b'%010d' % i for i in range(1, 5)]
+
+        rb.close()
+
+
+class CaptureIndexTestCase(unittest.TestCase):
+    """
+    python3 -m pytest tests/test_packet_sniffer.py -k CaptureIndex
+    """
+
+    def setUp(self):
+        self.path = os.path.join(TMPDIR, 'test_capture_index.pcap')
+        writer = PcapWriter(self.path, pure_pcapy.DLT_RAW)
+        for i in range(10):
+            writer.write(100 + i, b'frame%d' % i, 'node%s' % (i % 2), ['link_01'] if i < 5 else ['link_02'])
+        writer.close()
+
+    def tearDown(self):
+        for f in self.path, get_index_path(self.path):
+            if os.path.exists(f):
+                os.remove(f)
+
+    def test_index_file(self):
+        index = load_capture_index(self.path)
+        assert len(index) == 10
+        assert index.agent_names == ['node0', 'node1']
+        assert index.select(t_start=102, t_end=104.5) == [2, 3, 4]
+        assert index.select(t_start=102, agents=['node1'], link='link_02') == [5, 7, 9]
+        assert index.select(link='unknown_link') == []
+
+        with open(self.path, 'rb') as f:
+            f.seek(index.offsets[3] + 16)
+            assert f.read(index.lengths[3]) == b'frame3'
+
+    def test_index_built_from_pcap(self):
+        saved = CaptureIndex.load(get_index_path(self.path))
+        os.remove(get_index_path(self.path))
+
+        built = load_capture_index(self.path)
+        assert list(built.offsets) == list(saved.offsets)
+        assert list(built.timestamps) == list(saved.timestamps)
+        assert built.agent_names == []
+
+    def test_out_of_order_timestamps(self):
+        index = CaptureIndex()
+        for i, timestamp in enumerate([100, 102, 101, 104, 103]):
+            index.add(i, timestamp, 1)
+
+        assert not index.sorted
+        assert index.select(t_start=101, t_end=103) == [1, 2, 4]
+
+        index.save(get_index_path(self.path))
+        assert not CaptureIndex.load(get_index_path(self.path)).sorted
+
+    def test_slice_compressed_capture(self):
+        with open(self.path, 'rb') as f, gzip.open(self.path + '.gz', 'wb') as gz:
+            gz.write(f.read())
+
+        try:
+            f = io.BytesIO()
+            assert slice_capture(self.path + '.gz', f, t_start=103, t_end=104) == 2
+            with open(self.path, 'rb') as original:
+                original = original.read()
+            index = load_capture_index(self.path)
+            assert f.getvalue() == original[:24] + original[index.offsets[3]:index.offsets[5]]
+        finally:
+            os.remove(self.path + '.gz')
@@ -0,0 +1,92 @@
+import os
+import stat
+import pickle
+import shutil
+import unittest
+
+import yaml
+
+from ioppytest import TMPDIR, TD_COAP_CORE, TD_COAP_CFG
+from ioppytest.test_descriptions import td_cache
+from ioppytest.test_descriptions.td_cache import (load_yaml_documents, build_cache, get_all_yaml_files, YamlDocument,
+                                                  TESTCASE_TAG, CONFIGURATION_TAG)
+
+
+class TestDescriptionsCacheTestCase(unittest.TestCase):
+    """
+    python3 -m pytest tests/test_td_cache.py
+    """
+
+    def setUp(self):
+        self.cache_dir = os.path.join(TMPDIR, 'test_td_cache')
+        self.yaml_file = os.path.join(TMPDIR, 'test_td_cache.yaml')
+        shutil.copy(TD_COAP_CFG, self.yaml_file)
+        td_cache._memory_cache.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.remove(self.yaml_file)
+        td_cache._memory_cache.clear()
+
+    def _cache_entries(self):
+        return sorted(os.listdir(self.cache_dir))
+
+    def test_cached_documents_equal_parsed_ones(self):
+        with open(TD_COAP_CORE, 'rb') as f:
+            parsed = td_cache.parse_yaml_documents(f.read())
+
+        assert load_yaml_documents(TD_COAP_CORE, self.cache_dir) == parsed
+        td_cache._memory_cache.clear()
+        assert load_yaml_documents(TD_COAP_CORE, self.cache_dir) == parsed  # from the cache dir
+
+        assert all(type(doc) is YamlDocument and doc.tag == TESTCASE_TAG for doc in parsed)
+        assert parsed[0].mapping['testcase_id'] == 'TD_COAP_CORE_01'
+
+    def test_each_load_returns_new_objects(self):
+        docs = load_yaml_documents(self.yaml_file, self.cache_dir)
+        docs[0].mapping['nodes'].append('foo')
+
+        assert 'foo' not in load_yaml_documents(self.yaml_file, self.cache_dir)[0].mapping['nodes']
+
+    def test_entry_invalidated_by_content_change(self):
+        docs = load_yaml_documents(self.yaml_file, self.cache_dir)
+        assert docs[0].tag == CONFIGURATION_TAG
+        entries = self._cache_entries()
+        assert len(entries) == 1
+
+        with open(self.yaml_file, 'a') as f:
+            f.write('\n--- !configuration\n%s' % yaml.dump({
+                'configuration_id': 'TEST_CFG', 'uri': None, 'nodes': [], 'topology': [], 'addressing': [],
+                'description': [], 'configuration_diagram': None}))
+
+        docs_after_edit = load_yaml_documents(self.yaml_file, self.cache_dir)
+        assert len(docs_after_edit) == len(docs) + 1
+        assert docs_after_edit[-1].mapping['configuration_id'] == 'TEST_CFG'
+        assert len(self._cache_entries()) == 2
+
+    def test_corrupted_entry_falls_back_to_yaml(self):
+        expected = load_yaml_documents(self.yaml_file, self.cache_dir)
+        td_cache._memory_cache.clear()
+        with open(os.path.join(self.cache_dir, self._cache_entries()[0]), 'wb') as f:
+            f.write(b'not a pickle')
+
+        assert load_yaml_documents(self.yaml_file, self.cache_dir) == expected
+
+    def test_cache_dir_is_private(self):
+        load_yaml_documents(self.yaml_file, self.cache_dir)
+        assert stat.S_IMODE(os.stat(self.cache_dir).st_mode) == 0o700
+
+    def test_entries_of_writable_cache_dir_are_not_unpickled(self):
+        with open(self.yaml_file, 'rb') as f:
+            content = f.read()
+        os.makedirs(self.cache_dir)
+        os.chmod(self.cache_dir, 0o777)
+        entry_path = os.path.join(self.cache_dir, td_cache.get_content_hash(content) + td_cache.TD_CACHE_SUFFIX)
+        with open(entry_path, 'wb') as f:
+            f.write(pickle.dumps(['planted']))
+
+        assert load_yaml_documents(self.yaml_file, self.cache_dir) == td_cache.parse_yaml_documents(content)
+
+    def test_build_cache(self):
+        build_cache(cache_dir=self.cache_dir)
+        assert len(self._cache_entries()) == len(get_all_yaml_files())
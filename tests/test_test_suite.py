@@ -1,9 +1,16 @@
+import os
 import logging
 import pprint
 import unittest
 
-from ioppytest import TEST_DESCRIPTIONS_DICT, TEST_DESCRIPTIONS_CONFIGS_DICT
-from ioppytest.test_suite.testsuite import TestSuite
+from ioppytest import TEST_DESCRIPTIONS_DICT, TEST_DESCRIPTIONS_CONFIGS_DICT, TD_DIR
+from ioppytest.exceptions import TestSuiteError
+from ioppytest.test_suite.testsuite import (TestSuite, TestCase, TestCaseScheduler, TestConfig, Step, Iut, Verdict,
+                                            TestCaseDescription, StepDescription, load_test_descriptions)
+from ioppytest.test_suite.testsuite import (get_dict_of_test_cases, get_dict_of_test_cases_configurations,
+                                            get_dict_of_all_test_cases, _TestDescriptionsRegistry,
+                                            _LazyTestDescriptionsDict, _TESTCASES, _CONFIGURATIONS,
+                                            get_test_cases_list_from_yaml, import_test_description_from_yaml, list_to_str)
 
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
@@ -234,3 +241,183 @@ class TestSuiteTestsForLwM2MTestDescription(TestSuiteTests):
         )
 
         print("Got %s testcases for test suite" % len(self.testsuite.get_testcases_list()))
+
+
+class LazyTestDescriptionsLoadingTests(unittest.TestCase):
+    """
+    python3 -m pytest tests/test_test_suite.py -k LazyTestDescriptions
+    """
+
+    def setUp(self):
+        self.registry = _TestDescriptionsRegistry(TEST_DESCRIPTIONS_DICT, TEST_DESCRIPTIONS_CONFIGS_DICT)
+        self.testcases = _LazyTestDescriptionsDict(self.registry, _TESTCASES)
+        self.configs = _LazyTestDescriptionsDict(self.registry, _CONFIGURATIONS)
+
+    def test_lookup_only_loads_the_suite_of_the_id(self):
+        assert self.configs['COAP_CFG_01'].id == 'COAP_CFG_01'
+        assert 'TD_COAP_CORE_01' in self.testcases
+        assert list(self.registry.loaded) == ['coap']
+
+    def test_unknown_id_loads_all_suites(self):
+        assert 'TD_FOO_01' not in self.testcases
+        assert list(self.registry.loaded) == self.registry.suites
+
+        with self.assertRaises(KeyError):
+            self.configs['FOO_CFG_01']
+
+    def test_per_suite_accessors(self):
+        testcases = get_dict_of_test_cases('coap')
+        assert list(testcases)[0] == 'TD_COAP_CORE_01'
+        assert list(get_dict_of_test_cases_configurations('coap')) == ['COAP_CFG_01', 'COAP_CFG_02']
+        assert all(tc.id in get_dict_of_all_test_cases() for tc in testcases.values())
+
+        with self.assertRaises(TestSuiteError):
+            get_dict_of_test_cases('foo')
+
+
+class MultiFileTestDescriptionsTests(unittest.TestCase):
+    """
+    python3 -m pytest tests/test_test_suite.py -k MultiFileTestDescriptions
+    """
+
+    def test_files_loaded_in_memory(self):
+        td_files = TEST_DESCRIPTIONS_DICT['6lowpan']
+        assert len(td_files) > 1
+
+        testsuite = TestSuite(ted_tc_file=td_files, ted_config_file=TEST_DESCRIPTIONS_CONFIGS_DICT['6lowpan'])
+
+        expected_ids = [tc.id for td_file in td_files for tc in get_test_cases_list_from_yaml(td_file)]
+        assert testsuite.get_testcases_list() == expected_ids
+        assert [tc.id for tc in import_test_description_from_yaml(td_files)] == expected_ids
+        assert not os.path.exists(os.path.join(TD_DIR, 'merged_files.yaml'))
+
+
+class TestCaseSchedulerTests(unittest.TestCase):
+    """
+    python3 -m pytest tests/test_test_suite.py -k TestCaseScheduler
+    """
+
+    def setUp(self):
+        self.testcases = [
+            TestCase('TD_PARAM_%04d' % i, None, 'objective', 'CFG_01', None, [], None,
+                     [{'step_id': 'TD_PARAM_%04d_step_01' % i, 'type': 'check', 'description': ['check']}])
+            for i in range(2000)
+        ]
+        self.scheduler = TestCaseScheduler(self.testcases)
+
+    def test_pending_queue_follows_test_suite_order(self):
+        assert self.scheduler.next_pending() is self.testcases[0]
+
+        for tc in self.testcases[:1500]:
+            tc.change_state('skipped' if tc.id.endswith('5') else 'finished')
+        assert self.scheduler.next_pending() is self.testcases[1500]
+        assert self.scheduler.count('skipped') == 150
+
+        self.testcases[10].reinit()  # back to pending, executed before the following ones
+        assert self.scheduler.next_pending() is self.testcases[10]
+
+        for tc in self.testcases:
+            tc.change_state('finished')
+        assert self.scheduler.next_pending() is None
+        assert self.scheduler.all_finished()
+
+    def test_index_by_id_and_state(self):
+        assert self.scheduler.get('TD_PARAM_0042') is self.testcases[42]
+        assert self.scheduler.get('TD_FOO') is None
+
+        self.testcases[42].change_state('executing')
+        assert self.scheduler.get_testcases_in_state('executing') == [self.testcases[42]]
+        assert not self.scheduler.all_finished()
+        assert self.scheduler.count(None) == len(self.testcases) - 1
+
+
+class TestDescriptionModelsTests(unittest.TestCase):
+    """
+    python3 -m pytest tests/test_test_suite.py -k TestDescriptionModels
+    """
+
+    def setUp(self):
+        self.testsuite = TestSuite(TEST_DESCRIPTIONS_DICT['coap'], TEST_DESCRIPTIONS_CONFIGS_DICT['coap'])
+
+    def test_models_have_no_instance_dict(self):
+        tc = self.testsuite.get_testcase('TD_COAP_CORE_01')
+        models = [tc, tc.ted, tc.sequence[0], tc.sequence[0].ted, tc.sequence[0].iut, Verdict(),
+                  get_dict_of_test_cases_configurations('coap')[tc.configuration_id]]
+        for model in models:
+            assert not hasattr(model, '__dict__'), type(model)
+            with self.assertRaises(AttributeError):
+                model.foo = 'bar'
+
+        assert {TestCase, TestCaseDescription, TestConfig, Step, StepDescription, Iut, Verdict} == \
+               {type(m) for m in models}
+
+    def test_step_description_flattened_once(self):
+        step = self.testsuite.get_testcase('TD_COAP_CORE_01').sequence[0]
+
+        text = step.description_text
+        assert text == list_to_str(step.description)
+        assert step.description_text is text
+        assert step.to_dict(verbose=True)['step_info'] == step.description
+
+
+class TestSuiteSessionsTests(unittest.TestCase):
+    """
+    python3 -m pytest tests/test_test_suite.py -k TestSuiteSessions
+    """
+
+    def setUp(self):
+        self.ted_files = TEST_DESCRIPTIONS_DICT['coap'], TEST_DESCRIPTIONS_CONFIGS_DICT['coap']
+        self.sessions = [TestSuite(*self.ted_files) for _ in range(3)]
+
+    def test_sessions_share_test_descriptions(self):
+        testcase_descriptions, tc_configs = load_test_descriptions(*self.ted_files)
+
+        for ts in self.sessions:
+            for tc_id, ted in testcase_descriptions.items():
+                tc = ts.get_testcase(tc_id)
+                assert tc.ted is ted
+                assert all(step.ted is step_ted for step, step_ted in zip(tc.sequence, ted.steps))
+            assert all(ts.tc_configs[cfg_id] is cfg for cfg_id, cfg in tc_configs.items())
+
+        assert self.sessions[0].get_testcase('TD_COAP_CORE_01') is not self.sessions[1].get_testcase('TD_COAP_CORE_01')
+
+    def test_sessions_execution_states_are_isolated(self):
+        ts, other_ts = self.sessions[0], self.sessions[1]
+
+        ts.configure_testsuite(['TD_COAP_CORE_01', 'TD_COAP_CORE_02'], session_id='session_1')
+        ts.next_testcase()
+        ts.get_current_testcase().change_state('executing')
+        ts.next_step()
+        ts.finish_stimuli_step()
+        ts.update_node_address('coap_client', ('cccc', 1))
+
+        assert ts.get_testcase('TD_COAP_CORE_03').state == 'skipped'
+        assert ts.get_testcase('TD_COAP_CORE_01').sequence[0].state == 'finished'
+
+        assert other_ts.session_id is None
+        assert other_ts.get_current_testcase() is None
+        assert other_ts.get_testcase('TD_COAP_CORE_03').state is None
+        assert other_ts.get_testcase('TD_COAP_CORE_01').sequence[0].state is None
+        assert other_ts.get_node_address('coap_client') != ('cccc', 1)
+        assert not other_ts.nodes_configured
+
+    def test_execution_state_restored_in_another_session(self):
+        ts, restored_ts = self.sessions[0], self.sessions[1]
+
+        ts.configure_testsuite(['TD_COAP_CORE_01', 'TD_COAP_CORE_02'], session_id='session_1')
+        ts.next_testcase()
+        ts.get_current_testcase().change_state('executing')
+        ts.next_step()
+        ts.finish_stimuli_step()
+        ts.get_current_testcase().sequence[1].set_result('fail', 'wrong message id')
+        ts.update_node_address('coap_client', ('cccc', 1))
+
+        restored_ts.restore_execution_state(*ts.get_execution_state())
+
+        assert restored_ts.get_execution_state() == ts.get_execution_state()
+        assert restored_ts.get_current_testcase_id() == 'TD_COAP_CORE_01'
+        assert restored_ts.get_current_step_id() == 'TD_COAP_CORE_01_step_01'
+        assert restored_ts.next_step().id == 'TD_COAP_CORE_01_step_02'
+        assert restored_ts.get_current_step().partial_verdict.get_message() == 'wrong message id'
+        assert restored_ts.get_node_address('coap_client') == ('cccc', 1)
+        assert restored_ts.next_testcase().id == 'TD_COAP_CORE_02'  # scheduler follows the restored states